@@ -0,0 +1,333 @@
+################################################################################
+#
+# Aggregator module for pocket1090
+#
+# Merges the aircraft seen by several receivers into one aircraft.json-style
+#  snapshot, for displays (e.g., other pocket1090 instances) to read:
+#  * the feeds are AircraftSources: dump1090-fa json directories, aircraft.json
+#    URLs (e.g., a dump1090-fa web interface, or another aggregator), or
+#    dump1090 Beast/SBS streams (see parseFeed())
+#  * aircraft are deduped by their ICAO address ('hex'), and a merged aircraft
+#    has the fields of its most recently seen report, and the position of the
+#    report whose position was the freshest (by its 'seen_pos')
+#  * the merged snapshot is served over HTTP at /data/aircraft.json (the same
+#    path as dump1090-fa's web interface), and/or written (atomically, as
+#    dump1090-fa does) to aircraft.json in a directory
+#
+# It's an asyncio service: the sources block, so each feed reads its source in
+#  a thread of its own and hands its snapshots to the event loop, where all of
+#  the merging and serving is done (so none of the state needs locks). The
+#  snapshots are merged as they arrive, and a new merged snapshot is published
+#  as soon as there is one, but at most every minInterval secs.
+#
+# A feed that fails (e.g., its connection drops, or it sends something that
+#  can't be decoded) is reopened after RECONNECT_DELAY secs.
+#
+# N.B. The receivers' clocks must agree (e.g., via NTP or GPS), as the
+#      freshest position is picked by absolute time.
+#
+################################################################################
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from AircraftSource import HttpSource, JsonDirSource
+from NetSource import DEF_EXPIRE, NetSource
+from Profiler import PROFILER
+from SnapshotParser import DEF_BACKEND, SnapshotParser
+
+
+DEF_AGGREGATOR_HOST = "127.0.0.1"
+DEF_AGGREGATOR_PORT = 8091
+DEF_MIN_INTERVAL = 0.5  # min secs between merged snapshots
+
+SNAPSHOT_PATHS = ("/data/aircraft.json", "/aircraft.json")
+SNAPSHOT_FILE = "aircraft.json"
+
+RECONNECT_DELAY = 5.0   # secs before a failed feed is reopened
+READ_TIMEOUT = 1.0      # max secs a feed's thread blocks before checking for stop
+LATENCY_STATS_LEN = 1000  # number of publish latencies kept
+
+HTTP_STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+def _dumps(obj):
+    """Return the given object as compact JSON bytes
+    """
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def httpResponse(status, body=b"", headers=None, keepAlive=True, sendBody=True):
+    """Return an HTTP/1.1 response (without the body, e.g., for HEAD, if
+       sendBody is False)
+    """
+    head = [f"HTTP/1.1 {status} {HTTP_STATUS[status]}", f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keepAlive else 'close'}"]
+    head.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (body if sendBody else b"")
+
+
+async def readRequest(reader):
+    """Read an HTTP request's head from an asyncio stream, and return its
+       method, path (with any query), headers (with lowercase names), and
+       whether the connection is to be kept alive, or None if it's malformed
+
+      Raises asyncio.IncompleteReadError if the connection is closed first.
+    """
+    request = await reader.readuntil(b"\r\n\r\n")
+    lines = request.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3:
+        return None
+    method, path, version = parts
+    headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+    keepAlive = (version == "HTTP/1.1") and (headers.get("connection", "").lower() != "close")
+    return method, path, headers, keepAlive
+
+
+def parseFeed(spec, backend=DEF_BACKEND, netInterval=0.0):
+    """Return a function that opens the AircraftSource given by a feed spec:
+       * 'dir:<path>': the json directory that dump1090-fa writes to
+       * 'http://...' (or 'https://...'): the URL of an aircraft.json
+       * 'beast:<host>[:<port>]' or 'sbs:<host>[:<port>]': dump1090's network
+         output
+    """
+    if spec.startswith(("http://", "https://")):
+        return lambda: HttpSource(spec, parser=SnapshotParser(backend))
+    kind, _, rest = spec.partition(":")
+    if (kind == "dir") and rest:
+        return lambda: JsonDirSource(rest, parser=SnapshotParser(backend))
+    if (kind in ("beast", "sbs")) and rest:
+        host, _, port = rest.partition(":")
+        if port and not port.isdigit():
+            raise ValueError(f"Invalid port in feed: '{spec}'")
+        return lambda: NetSource(host, int(port) if port else None, kind, minInterval=netInterval)
+    raise ValueError(f"Invalid feed: '{spec}'")
+
+
+class Aggregator():
+    """Merges the snapshots of several feeds, and publishes the merged snapshot
+
+      feeds is a dict of feed name: function that opens its AircraftSource
+      (e.g., from parseFeed()). A port of None means don't serve the merged
+      snapshot, and 0 picks a free port (which run() sets 'port' to).
+    """
+    def __init__(self, feeds, outputDir=None, host=DEF_AGGREGATOR_HOST, port=DEF_AGGREGATOR_PORT,
+                 minInterval=DEF_MIN_INTERVAL, expire=DEF_EXPIRE):
+        if not feeds:
+            raise ValueError("No feeds to aggregate")
+        self.feeds = dict(feeds)
+        self.outputDir = outputDir
+        self.host = host
+        self.port = port
+        self.minInterval = minInterval
+        self.expire = expire
+
+        # hex: [time last seen, fields, time of the freshest position, (lat, lon), name of its feed]
+        self.aircraft = {}
+        self.messages = {}  # feed name: number of messages in its last snapshot
+        self.snapshots = {name: 0 for name in self.feeds}
+        self.failures = {name: 0 for name in self.feeds}
+        self.published = 0
+        self.body = None
+        self.etag = None
+        self.pendingSince = None  # monotonic time of the oldest snapshot that hasn't been published
+        self.latencies = deque([], maxlen=LATENCY_STATS_LEN)
+        self.loop = None
+        self.running = False
+
+    def __repr__(self):
+        return (f"{len(self.feeds)} feeds, {len(self.aircraft)} aircraft, {sum(self.snapshots.values())} snapshots merged, "
+                f"{self.published} published, {sum(self.failures.values())} feed failures")
+
+    def merge(self, name, ts, snapshot):
+        """Merge a snapshot from the named feed, taken at the given time (in
+           Unix epoch time), into the aircraft
+        """
+        aircraft = self.aircraft
+        for a in snapshot.get('aircraft', ()):
+            hexId = a.get('hex')
+            if not hexId:
+                continue
+            seen = ts - a.get('seen', 0.0)
+            m = aircraft.get(hexId)
+            if m is None:
+                m = aircraft[hexId] = [seen, dict(a), None, None, name]
+            elif seen >= m[0]:
+                m[0] = seen
+                m[1].update(a)
+            if ('lat' in a) and ('lon' in a):
+                posTime = ts - a.get('seen_pos', a.get('seen', 0.0))
+                if (m[2] is None) or (posTime > m[2]):
+                    m[2], m[3], m[4] = posTime, (a['lat'], a['lon']), name
+        self.messages[name] = snapshot.get('messages', 0)
+        self.snapshots[name] += 1
+
+    def snapshot(self, now):
+        """Return the merged aircraft.json-style snapshot at the given time,
+           dropping the aircraft that haven't been seen within the expiry
+           interval
+        """
+        aircraft, expired = [], []
+        for hexId, (seen, fields, posTime, pos, _) in self.aircraft.items():
+            if (now - seen) > self.expire:
+                expired.append(hexId)
+                continue
+            a = dict(fields)
+            a['seen'] = round(max(0.0, now - seen), 1)
+            if pos is None:
+                a.pop('lat', None)
+                a.pop('lon', None)
+                a.pop('seen_pos', None)
+            else:
+                a['lat'], a['lon'] = pos
+                a['seen_pos'] = round(max(0.0, now - posTime), 1)
+            aircraft.append(a)
+        for hexId in expired:
+            del self.aircraft[hexId]
+        return {'now': now, 'messages': sum(self.messages.values()), 'aircraft': aircraft}
+
+    def publish(self, now):
+        """Make the merged snapshot at the given time the one that's served,
+           and write it to the output directory (if any)
+        """
+        with PROFILER.stage("publish"):
+            self.body = _dumps(self.snapshot(now))
+            self.published += 1
+            self.etag = f'"{self.published}"'
+            if self.outputDir:
+                path = os.path.join(self.outputDir, SNAPSHOT_FILE)
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(self.body)
+                os.replace(f"{path}.tmp", path)
+        if self.pendingSince is not None:
+            self.latencies.append(time.monotonic() - self.pendingSince)
+            self.pendingSince = None
+
+    async def _pause(self, secs):
+        """Sleep for the given secs, or until stop() is called
+        """
+        try:
+            await asyncio.wait_for(self.stopping.wait(), secs)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _readFeed(self, name, openSource, executor):
+        """Read snapshots from a feed's source (in the given executor) and
+           merge them, reopening the source if it fails, until stopped
+        """
+        loop = asyncio.get_running_loop()
+        while self.running:
+            try:
+                source = await loop.run_in_executor(executor, openSource)
+            except Exception as e:
+                self.failures[name] += 1
+                logging.warning(f"Failed to open feed '{name}': {e!r}, retrying in {RECONNECT_DELAY} secs")
+                await self._pause(RECONNECT_DELAY)
+                continue
+            try:
+                while self.running:
+                    snapshot = await loop.run_in_executor(executor, source.read, READ_TIMEOUT)
+                    if snapshot is None:
+                        continue
+                    if self.pendingSince is None:
+                        self.pendingSince = time.monotonic()
+                    with PROFILER.stage("merge"):
+                        self.merge(name, *snapshot)
+                    self.pending.set()
+            except Exception as e:
+                # e.g., a dropped connection, or a malformed snapshot or message
+                self.failures[name] += 1
+                logging.warning(f"Feed '{name}' failed: {e!r}, reopening it in {RECONNECT_DELAY} secs")
+            finally:
+                await loop.run_in_executor(executor, source.close)
+            await self._pause(RECONNECT_DELAY)
+
+    async def _publisher(self):
+        """Publish a merged snapshot whenever a feed's snapshot has been merged
+           (but at most every minInterval secs), or every READ_TIMEOUT secs if
+           none have been (so the aircraft still expire)
+        """
+        while self.running:
+            try:
+                await asyncio.wait_for(self.pending.wait(), READ_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            self.pending.clear()
+            self.publish(time.time())
+            await self._pause(self.minInterval)
+
+    async def _handleClient(self, reader, writer):
+        """Serve HTTP/1.1 requests for the merged snapshot on a connection
+        """
+        try:
+            while self.running:
+                request = await readRequest(reader)
+                if request is None:
+                    writer.write(httpResponse(400, keepAlive=False))
+                    break
+                method, path, headers, keepAlive = request
+                if method not in ("GET", "HEAD"):
+                    response = httpResponse(405, keepAlive=keepAlive)
+                elif (path.split("?", 1)[0] not in SNAPSHOT_PATHS) or (self.body is None):
+                    response = httpResponse(404, keepAlive=keepAlive)
+                elif headers.get("if-none-match") == self.etag:
+                    response = httpResponse(304, headers={'ETag': self.etag}, keepAlive=keepAlive)
+                else:
+                    response = httpResponse(200, self.body, {'Content-Type': "application/json", 'ETag': self.etag,
+                                                               'Cache-Control': "no-cache"}, keepAlive, (method == "GET"))
+                writer.write(response)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        """Aggregate the feeds until stop() is called
+        """
+        self.loop = asyncio.get_running_loop()
+        self.running = True
+        self.pending = asyncio.Event()
+        self.stopping = asyncio.Event()
+        executor = ThreadPoolExecutor(max_workers=len(self.feeds), thread_name_prefix="feed")
+        server = None
+        if self.port is not None:
+            server = await asyncio.start_server(self._handleClient, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]
+            logging.info(f"Serving the merged snapshot at http://{self.host}:{self.port}{SNAPSHOT_PATHS[0]}")
+        tasks = [asyncio.create_task(self._readFeed(name, openSource, executor)) for name, openSource in self.feeds.items()]
+        tasks.append(asyncio.create_task(self._publisher()))
+        try:
+            await self.stopping.wait()
+        finally:
+            # the feeds' threads notice within READ_TIMEOUT secs
+            self.running = False
+            self.stopping.set()
+            await asyncio.wait(tasks, timeout=(2 * READ_TIMEOUT))
+            for task in tasks:
+                task.cancel()
+            if server:
+                server.close()
+                await server.wait_closed()
+            executor.shutdown(wait=False)
+
+    def stop(self):
+        """Stop the aggregator (can be called from any thread)
+        """
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.stopping.set)
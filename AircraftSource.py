@@ -0,0 +1,307 @@
+################################################################################
+#
+# Aircraft Source module for pocket1090
+#
+# Sources of aircraft.json-style snapshots for the track pipeline:
+#  * JsonDirSource: the json directory that dump1090-fa writes to
+#  * HttpSource: an aircraft.json URL (e.g., dump1090-fa's web interface, or
+#    an Aggregator)
+#  * CaptureSource: a recorded capture (see CaptureWriter) replayed in real
+#    time, N times real time, or as fast as possible
+#  * SyntheticSource: generated traffic around a given location
+#  * NetSource (in NetSource.py): dump1090's Beast/SBS network output
+#
+# A capture file has one JSON object per line, of the form
+#  {"ts": <Unix epoch time>, "snapshot": <contents of aircraft.json>}
+#  and is gzip-compressed if its name ends in '.gz'.
+#
+# JsonDirSource, HttpSource, and CaptureSource parse snapshots with a SnapshotParser, so
+#  their snapshots only have the fields that the tracks use.
+#
+################################################################################
+
+import gzip
+import json
+import logging
+import math
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+
+from FileWatcher import FileWatcher
+from Profiler import PROFILER
+from SnapshotParser import SnapshotParser
+
+
+KNOTS_TO_KMPS = 1.852 / 3600.0
+KM_PER_DEG_LAT = 111.32
+
+CAPTURE_LOOP_GAP = 1.0       # secs between the end of a capture and its restart
+
+DEF_HTTP_INTERVAL = 1.0       # secs between requests for aircraft.json
+DEF_HTTP_TIMEOUT = 5.0        # secs to wait for a response
+
+DEF_SYNTHETIC_AIRCRAFT = 50
+DEF_SYNTHETIC_RADIUS = 64     # Km
+DEF_SYNTHETIC_INTERVAL = 1.0  # secs between snapshots
+
+
+def openCapture(filePath, mode):
+    """Open a capture file as text, (de)compressing if its name ends in '.gz'
+    """
+    if filePath.endswith(".gz"):
+        return gzip.open(filePath, mode + "t")
+    return open(filePath, mode)
+
+
+class AircraftSource():
+    """Base class for all sources of aircraft.json-style snapshots
+
+      A snapshot is a dict with (at least) 'now', 'messages', and 'aircraft'
+      (a list of per-aircraft dicts keyed by dump1090's field names).
+    """
+    def read(self, timeout=None):
+        """Return a tuple with the time the snapshot was taken (in Unix epoch
+           time) and the snapshot, or None if the timeout (in secs) expired
+
+          Raises EOFError when the source has no more snapshots.
+        """
+        raise NotImplementedError("Subclasses must implement read()")
+
+    def close(self):
+        """Release any resources held by the source
+        """
+        pass
+
+    @staticmethod
+    def _sleepUntil(due, timeout):
+        """Sleep until the given (monotonic) time, but no longer than timeout
+           secs, returning True if the due time was reached
+        """
+        delay = due - time.monotonic()
+        if (timeout is not None) and (delay > timeout):
+            time.sleep(timeout)
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+class JsonDirSource(AircraftSource):
+    """Read aircraft.json from the directory dump1090-fa writes its files to
+    """
+    def __init__(self, path, pollInterval=None, useInotify=True, parser=None):
+        self.aircraftFile = os.path.join(path, "aircraft.json")
+        self.parser = parser if parser else SnapshotParser()
+        kwargs = {} if pollInterval is None else {'pollInterval': pollInterval}
+        self.watcher = FileWatcher(self.aircraftFile, useInotify=useInotify, **kwargs)
+
+    def read(self, timeout=None):
+        ts = self.watcher.wait(timeout)
+        if ts is None:
+            return None
+        with open(self.aircraftFile, "rb") as f, PROFILER.stage("parse"):
+            return ts, self.parser.parse(f.read())
+
+    def close(self):
+        self.watcher.close()
+
+
+class HttpSource(AircraftSource):
+    """Poll an aircraft.json URL
+
+      The snapshot's ETag (if the server sends one) is sent with the next
+      request, so an unchanged snapshot isn't sent, parsed, or returned again.
+      Failed requests are logged and retried at the next interval.
+    """
+    def __init__(self, url, interval=DEF_HTTP_INTERVAL, requestTimeout=DEF_HTTP_TIMEOUT, parser=None):
+        self.url = url
+        self.interval = interval
+        self.requestTimeout = requestTimeout
+        self.parser = parser if parser else SnapshotParser()
+        self.etag = None
+        self.nextDue = None
+        self.failures = 0
+        logging.info(f"Polling '{url}' every {interval} secs")
+
+    def read(self, timeout=None):
+        if self.nextDue is None:
+            self.nextDue = time.monotonic()
+        if not self._sleepUntil(self.nextDue, timeout):
+            return None
+        self.nextDue = max(self.nextDue + self.interval, time.monotonic())
+        request = urllib.request.Request(self.url, headers={'If-None-Match': self.etag} if self.etag else {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.requestTimeout) as response:
+                data = response.read()
+                self.etag = response.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                self.failures += 1
+                logging.warning(f"Request for '{self.url}' failed: {e}")
+            return None
+        except (urllib.error.URLError, OSError) as e:
+            self.failures += 1
+            logging.warning(f"Request for '{self.url}' failed: {e}")
+            return None
+        with PROFILER.stage("parse"):
+            snapshot = self.parser.parse(data)
+        return snapshot.get('now', time.time()), snapshot
+
+
+class CaptureSource(AircraftSource):
+    """Replay a recorded capture file
+
+      A speed of 1.0 replays in real time, N replays N times faster, and 0
+      replays as fast as possible. If loop is True, the capture restarts
+      (with its timestamps shifted) when the end is reached.
+    """
+    def __init__(self, filePath, speed=1.0, loop=False, parser=None):
+        if speed < 0:
+            raise ValueError("Invalid replay speed, must be non-negative")
+        self.filePath = filePath
+        self.speed = speed
+        self.loop = loop
+        self.parser = parser if parser else SnapshotParser()
+        self.f = openCapture(filePath, "r")
+        self.startTs = None
+        self.startTime = None
+        self.offset = 0.0
+        self.lastTs = None
+        self.pending = None
+
+    def _nextRecord(self):
+        line = self.f.readline()
+        while line and not line.strip():
+            line = self.f.readline()
+        if not line:
+            if not self.loop or self.lastTs is None:
+                raise EOFError(f"End of capture '{self.filePath}'")
+            self.f.seek(0)
+            line = self.f.readline()
+            with PROFILER.stage("parse"):
+                ts, snapshot = self.parser.parseRecord(line)
+            self.offset = self.lastTs - ts + CAPTURE_LOOP_GAP
+        else:
+            with PROFILER.stage("parse"):
+                ts, snapshot = self.parser.parseRecord(line)
+        ts += self.offset
+        self.lastTs = ts
+        return ts, snapshot
+
+    def read(self, timeout=None):
+        if self.pending is None:
+            self.pending = self._nextRecord()
+        ts, snapshot = self.pending
+        if self.speed > 0:
+            if self.startTs is None:
+                self.startTs, self.startTime = ts, time.monotonic()
+            due = self.startTime + ((ts - self.startTs) / self.speed)
+            if not self._sleepUntil(due, timeout):
+                return None
+        self.pending = None
+        return ts, snapshot
+
+    def close(self):
+        self.f.close()
+
+
+class CaptureWriter():
+    """Record snapshots into a capture file that CaptureSource can replay
+    """
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.f = openCapture(filePath, "w")
+        logging.info(f"Recording capture to '{filePath}'")
+
+    def write(self, ts, snapshot):
+        self.f.write(json.dumps({'ts': ts, 'snapshot': snapshot}, separators=(",", ":")))
+        self.f.write("\n")
+
+    def close(self):
+        self.f.close()
+
+
+class SyntheticSource(AircraftSource):
+    """Generate traffic flying straight and level(ish) around a location
+
+      Aircraft that fly out of the radius are replaced with new ones, and
+      churn is the probability (per snapshot) that any given aircraft is
+      replaced anyway. The speed has the same meaning as for CaptureSource,
+      and count limits the number of snapshots (None means no limit).
+    """
+    def __init__(self, location, numAircraft=DEF_SYNTHETIC_AIRCRAFT, radius=DEF_SYNTHETIC_RADIUS,
+                 interval=DEF_SYNTHETIC_INTERVAL, speed=1.0, churn=0.0, count=None, seed=None):
+        self.lat, self.lon = location.latitude, location.longitude
+        self.numAircraft = numAircraft
+        self.radius = radius
+        self.interval = interval
+        self.speed = speed
+        self.churn = churn
+        self.count = count
+        self.rnd = random.Random(seed)
+        self.now = time.time()
+        self.messages = 0
+        self.snapshots = 0
+        self.nextDue = None
+        self.aircraft = [self._newAircraft() for _ in range(numAircraft)]
+
+    def _newAircraft(self):
+        rnd = self.rnd
+        dist = self.radius * math.sqrt(rnd.random())
+        bearing = rnd.uniform(0, 2 * math.pi)
+        lat = self.lat + ((dist * math.cos(bearing)) / KM_PER_DEG_LAT)
+        lon = self.lon + ((dist * math.sin(bearing)) / (KM_PER_DEG_LAT * math.cos(math.radians(self.lat))))
+        rate = rnd.choice((0, 0, 0, rnd.randrange(-2000, 2000, 64)))
+        return {'hex': f"{rnd.randrange(1 << 24):06x}",
+                'flight': f"{rnd.choice(('UAL', 'SWA', 'DAL', 'AAL', 'N'))}{rnd.randrange(1, 9999)}",
+                'alt_baro': rnd.randrange(1000, 41000, 25),
+                'alt_geom': None,
+                'gs': round(rnd.uniform(90, 480), 1),
+                'track': round(rnd.uniform(0, 360), 1),
+                'baro_rate': rate,
+                'category': rnd.choice(("A1", "A2", "A3", "A3", "A3", "A4", "A5", "A7", "B1")),
+                'squawk': f"{rnd.randrange(8)}{rnd.randrange(8)}{rnd.randrange(8)}{rnd.randrange(8)}",
+                'emergency': "none",
+                'lat': round(lat, 6),
+                'lon': round(lon, 6),
+                'rssi': round(rnd.uniform(-30, -3), 1)}
+
+    def _step(self):
+        """Advance all of the aircraft by one interval
+        """
+        for n, a in enumerate(self.aircraft):
+            d = a['gs'] * KNOTS_TO_KMPS * self.interval
+            t = math.radians(a['track'])
+            a['lat'] = round(a['lat'] + ((d * math.cos(t)) / KM_PER_DEG_LAT), 6)
+            a['lon'] = round(a['lon'] + ((d * math.sin(t)) / (KM_PER_DEG_LAT * math.cos(math.radians(a['lat'])))), 6)
+            a['alt_baro'] = max(0, a['alt_baro'] + int(a['baro_rate'] * (self.interval / 60.0)))
+            a['alt_geom'] = a['alt_baro'] + 125
+            dLat = (a['lat'] - self.lat) * KM_PER_DEG_LAT
+            dLon = (a['lon'] - self.lon) * KM_PER_DEG_LAT * math.cos(math.radians(self.lat))
+            if (math.hypot(dLat, dLon) > self.radius) or (self.rnd.random() < self.churn):
+                self.aircraft[n] = self._newAircraft()
+        self.now += self.interval
+        self.messages += self.numAircraft * int(10 * self.interval)
+
+    def read(self, timeout=None):
+        if (self.count is not None) and (self.snapshots >= self.count):
+            raise EOFError("End of synthetic traffic")
+        if self.speed > 0:
+            if self.nextDue is None:
+                self.nextDue = time.monotonic()
+            if not self._sleepUntil(self.nextDue, timeout):
+                return None
+            self.nextDue += self.interval / self.speed
+        if self.snapshots:
+            self._step()
+        self.snapshots += 1
+        aircraft = []
+        for a in self.aircraft:
+            info = {k: v for k, v in a.items() if v is not None}
+            info['seen'] = round(self.rnd.uniform(0, 1), 1)
+            info['seen_pos'] = round(self.rnd.uniform(0, 2), 1)
+            aircraft.append(info)
+        return self.now, {'now': self.now, 'messages': self.messages, 'aircraft': aircraft}
@@ -2,7 +2,20 @@
 #
 # Compass module for pocket1090
 #
-# N.B. Currently hardwired to always return true north
+# A background thread samples the BNO055's orientation quaternion at a fixed
+#  rate, smooths it (normalized lerp towards each new sample), and publishes
+#  the heading, roll, and pitch as a single tuple, so reading the orientation
+#  never waits on the I2C bus.
+#
+# The published heading only moves once the smoothed heading has changed by
+#  at least the hysteresis threshold, so sensor jitter doesn't make the
+#  renderer re-rotate its static layers.
+#
+# FakeBNO055 stands in for the sensor, so the compass can be exercised
+#  without hardware.
+#
+# N.B. The BNO055 reports heading clockwise from north, so the heading here
+#      is the negated yaw of the quaternion.
 #
 # TODO
 #  * implement the interface to the chosen flux-gate magnetometer
@@ -10,8 +23,14 @@
 ################################################################################
 
 import logging
+import random
+import threading
+import time
 
-from Adafruit_BNO055 import BNO055
+try:
+    from Adafruit_BNO055 import BNO055
+except ImportError:
+    BNO055 = None
 
 from __init__ import * #### FIXME
 
@@ -19,6 +38,10 @@ from __init__ import * #### FIXME
 I2C_DEVICE = "/dev/i2c-1"
 DEF_RESET_PIN = 5
 
+DEF_SAMPLE_RATE = 20.0  # Hz
+DEF_SMOOTHING = 0.3     # weight of each new sample (1.0 means no smoothing)
+DEF_HYSTERESIS = 2.0    # degrees the heading must change by before it's published
+
 
 # System Status register values
 # From BNO055 datasheet section 4.3.58
@@ -86,9 +109,98 @@ SELF_TEST_RESULTS = {
 ALL_SELF_TEST_PASS = 0x0F
 
 
+def quaternionToEuler(x, y, z, w):
+    """Return the (heading, roll, pitch) in degrees of the orientation given by
+       a unit quaternion, with the heading clockwise from north
+    """
+    yaw = math.atan2(2 * ((w * z) + (x * y)), 1 - (2 * ((y * y) + (z * z))))
+    roll = math.atan2(2 * ((w * x) + (y * z)), 1 - (2 * ((x * x) + (y * y))))
+    pitch = math.asin(max(-1.0, min(1.0, 2 * ((w * y) - (z * x)))))
+    return (-math.degrees(yaw)) % 360.0, math.degrees(roll), math.degrees(pitch)
+
+def eulerToQuaternion(heading, roll, pitch):
+    """Return the unit quaternion (x, y, z, w) of the given heading (clockwise
+       from north), roll, and pitch in degrees
+    """
+    cy, sy = math.cos(math.radians(-heading) / 2), math.sin(math.radians(-heading) / 2)
+    cr, sr = math.cos(math.radians(roll) / 2), math.sin(math.radians(roll) / 2)
+    cp, sp = math.cos(math.radians(pitch) / 2), math.sin(math.radians(pitch) / 2)
+    return ((sr * cp * cy) - (cr * sp * sy),
+            (cr * sp * cy) + (sr * cp * sy),
+            (cr * cp * sy) - (sr * sp * cy),
+            (cr * cp * cy) + (sr * sp * sy))
+
+def headingDelta(a, b):
+    """Return the difference from heading b to heading a (-180 to 180 degrees)
+    """
+    return ((a - b + 180.0) % 360.0) - 180.0
+
+
+class FakeBNO055():
+    """Stand-in for the BNO055 driver that turns at a constant rate, with
+       Gaussian noise on its readings and (optionally) a delay on each read
+    """
+    def __init__(self, heading=0.0, rotationRate=0.0, noise=0.0, readDelay=0.0, seed=None):
+        self.heading = heading
+        self.rotationRate = rotationRate
+        self.noise = noise
+        self.readDelay = readDelay
+        self.rnd = random.Random(seed)
+        self.start = time.monotonic()
+        self.reads = 0
+
+    def begin(self):
+        return True
+
+    def get_system_status(self):
+        return FUSION, ALL_SELF_TEST_PASS, NO_ERROR
+
+    def get_revision(self):
+        return 0x0311, 0x15, 0xFB, 0x32, 0x0F
+
+    def get_calibration_status(self):
+        return 3, 3, 3, 3
+
+    def _euler(self):
+        if self.readDelay:
+            time.sleep(self.readDelay)
+        self.reads += 1
+        heading = self.heading + (self.rotationRate * (time.monotonic() - self.start))
+        return ((heading + self.rnd.gauss(0, self.noise)) % 360.0,
+                self.rnd.gauss(0, self.noise), self.rnd.gauss(0, self.noise))
+
+    def read_euler(self):
+        return self._euler()
+
+    def read_quaternion(self):
+        return eulerToQuaternion(*self._euler())
+
+    def read_temp(self):
+        return 25
+
+
 class Compass():
-    def __init__(self, rstPin=DEF_RESET_PIN):
-        self.bno = BNO055.BNO055(rstPin)
+    """BNO055-based compass, sampled in a background thread
+
+      If sampleRate is None (or zero), there's no background thread and each
+      call to getEulerAngles() reads the sensor.
+    """
+    def __init__(self, rstPin=DEF_RESET_PIN, bno=None, sampleRate=DEF_SAMPLE_RATE,
+                 smoothing=DEF_SMOOTHING, hysteresis=DEF_HYSTERESIS):
+        if bno is None:
+            if BNO055 is None:
+                logging.error("BNO055 driver not installed")
+                raise RuntimeError("BNO055 Initialization Error")
+            bno = BNO055.BNO055(rstPin)
+        self.bno = bno
+        self.sampleRate = sampleRate
+        self.smoothing = smoothing
+        self.hysteresis = hysteresis
+        self.quaternion = None
+        self.orientation = None
+        self.samples = 0
+        self.errors = 0
+        self.running = False
         if not self.bno.begin():
             logging.error("Failed to init the compass")
             raise RuntimeError("BNO055 Initialization Error")
@@ -109,6 +221,57 @@ class Compass():
         sw, bl, accel, magn, gyro = self.bno.get_revision()
         logging.info(f"Software version: {sw}, Bootloader version: {bl}, Accelerometer Id: 0x{accel:02X}, Magnetometer Id: 0x{magn}, Gyroscope Id: 0x{gyro}")
 
+        if sampleRate:
+            self._sample()
+            self.running = True
+            self.thread = threading.Thread(target=self._sampler, args=(), daemon=True)
+            self.thread.start()
+
+    def _sample(self):
+        """Read the orientation, blend it into the smoothed quaternion, and
+           publish the smoothed orientation (holding the heading until it
+           moves by at least the hysteresis)
+        """
+        q = self.getOrientation()
+        norm = math.sqrt(sum(c * c for c in q))
+        if norm == 0:
+            raise ValueError("Invalid quaternion")
+        q = tuple(c / norm for c in q)
+        if self.quaternion is not None:
+            # q and -q are the same orientation, so blend towards the nearer one
+            if sum(a * b for a, b in zip(self.quaternion, q)) < 0:
+                q = tuple(-c for c in q)
+            q = tuple(a + (self.smoothing * (b - a)) for a, b in zip(self.quaternion, q))
+            norm = math.sqrt(sum(c * c for c in q))
+            q = tuple(c / norm for c in q)
+        self.quaternion = q
+        heading, roll, pitch = quaternionToEuler(*q)
+        if (self.orientation is not None) and (abs(headingDelta(heading, self.orientation[0])) < self.hysteresis):
+            heading = self.orientation[0]
+        self.orientation = (heading, roll, pitch)
+        self.samples += 1
+
+    def _sampler(self):
+        interval = 1.0 / self.sampleRate
+        nextDue = time.monotonic()
+        while self.running:
+            nextDue += interval
+            try:
+                self._sample()
+            except Exception as e:
+                self.errors += 1
+                logging.warning(f"Invalid compass read: {e}")
+            delay = nextDue - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextDue = time.monotonic()
+
+    def close(self):
+        if self.running:
+            self.running = False
+            self.thread.join(1.0)
+
     def calibrate(self):
         """ #### TODO
         """
@@ -125,9 +288,12 @@ class Compass():
         return sys, gyro, accel, mag
 
     def getEulerAngles(self):
-        """Read and return the Euler angles for heading, roll, pitch (all in degrees)
-          #### TODO
+        """Return the latest smoothed Euler angles for heading, roll, pitch (all
+           in degrees) without waiting for the sensor, or read them from the
+           sensor if it isn't sampled in the background
         """
+        if self.running:
+            return self.orientation
         heading, roll, pitch = self.bno.read_euler()
         return heading, roll, pitch
 
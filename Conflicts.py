@@ -0,0 +1,232 @@
+################################################################################
+#
+# Conflicts module for pocket1090
+#
+# Predicts the tracks' trajectories and alerts on close approaches: to the
+#  observer (e.g., an aircraft about to pass low overhead), and between pairs
+#  of aircraft (e.g., a near miss).
+#
+# Each track is extrapolated in a flat local East/North plane around the
+#  observer (as in Geodesy.deadReckon()), in a straight line at its ground
+#  speed and track, and climbing/descending at its geometric (or else its
+#  barometric) rate, from its position dead-reckoned to the snapshot time. The
+#  time of closest (horizontal) approach is clamped to the look-ahead horizon,
+#  so a pair that's already diverging has its closest approach now, and the
+#  vertical separation is taken at that time.
+#
+# Pairs are found without comparing every pair of aircraft: each track's
+#  path over the horizon (its bounding box, padded by half of the separation)
+#  goes in a SpatialGrid, and only the tracks whose paths' boxes overlap can
+#  come within the separation of each other (the exact test is then done for
+#  all of the candidate pairs at once, in NumPy). So the cost grows with the
+#  number of aircraft that are near each other, not with the square of the
+#  number of aircraft. (With few enough aircraft, testing every pair in NumPy
+#  is cheaper than bucketing them, so that's done instead.)
+#
+# An alert is raised once, when it's first predicted, and stays active (and
+#  isn't raised again) until it hasn't been predicted for clearTime secs.
+#
+# N.B. Tracks without an altitude (e.g., on the ground) or with positions
+#      older than maxPositionAge secs are ignored, and the observer is assumed
+#      not to move within the horizon.
+#
+################################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from Geodesy import KNOTS_TO_KMPS
+from SpatialGrid import SpatialGrid
+
+
+DEF_HORIZON = 60.0              # secs to look ahead
+DEF_PAIR_SEPARATION = 1.852     # Km (1 NM), min horizontal separation between aircraft
+DEF_PAIR_VERTICAL = 1000.0      # feet, min vertical separation between aircraft
+DEF_OBSERVER_RADIUS = 2.0       # Km, min horizontal distance from the observer
+DEF_OBSERVER_HEIGHT = 5000.0    # feet, min height above (or below) the observer
+DEF_OBSERVER_ALTITUDE = 0.0     # feet
+DEF_MAX_POSITION_AGE = 15.0     # secs
+DEF_CLEAR_TIME = 10.0           # secs an alert must go unpredicted before it's cleared
+
+ALL_PAIRS_LIMIT = 100000  # max number of pairs to test without bucketing them (~450 aircraft)
+
+# kind: "observer" or "pair", ids: the track uniqueIds, flights: their flight numbers,
+#  time: secs until the closest approach, distance: horizontal Km, vertical: feet
+Alert = namedtuple("Alert", ["kind", "ids", "flights", "time", "distance", "vertical"])
+
+
+def alertText(alert):
+    """Return a one-line description of an alert
+    """
+    who = " and ".join(f"{f.strip() or '?'} ({i})" for i, f in zip(alert.ids, alert.flights))
+    where = "the observer" if alert.kind == "observer" else "each other"
+    return (f"{who} within {alert.distance:.2f}Km and {abs(alert.vertical):.0f}ft of {where} "
+            f"in {alert.time:.0f} secs")
+
+
+def closestApproach(east, north, vEast, vNorth, horizon):
+    """Return arrays of the time (in secs, clamped to 0-horizon) and horizontal
+       distance (in Km) of the closest approach of relative positions (in Km)
+       moving at relative velocities (in Km/sec)
+    """
+    vv = (vEast * vEast) + (vNorth * vNorth)
+    moving = vv > 0.0
+    t = np.where(moving, -((east * vEast) + (north * vNorth)) / np.where(moving, vv, 1.0), 0.0)
+    t = np.clip(t, 0.0, horizon)
+    return t, np.hypot(east + (vEast * t), north + (vNorth * t))
+
+
+class TrackKinematics():
+    """Arrays of the position (Km East/North of the observer), velocity
+       (Km/sec), altitude (feet), and vertical rate (feet/sec) of each of the
+       usable tracks of a TrackTable, as of the given time
+    """
+    def __init__(self, tracks, now, maxPositionAge=DEF_MAX_POSITION_AGE):
+        slots = tracks.slots()
+        cols = tracks.columns
+        distances, azimuths = tracks.predict(now, maxPositionAge)
+        distances, azimuths = distances[slots], azimuths[slots]
+        ages = (now - cols['timestamp'][slots]) + np.nan_to_num(cols['seenPos'][slots])
+        altitudes = cols['altitude'][slots]
+        altitudes = np.where(np.isnan(altitudes), cols['baroAltitude'][slots], altitudes)
+        rates = cols['geomRate'][slots]
+        rates = np.nan_to_num(np.where(np.isnan(rates), cols['baroRate'][slots], rates)) / 60.0
+        usable = (ages <= maxPositionAge) & np.isfinite(distances) & np.isfinite(altitudes)
+
+        self.slots = slots[usable]
+        self.ids = [tracks.tracks[s].uniqueId for s in self.slots.tolist()]
+        azimuths = np.radians(azimuths[usable])
+        self.east = distances[usable] * np.sin(azimuths)
+        self.north = distances[usable] * np.cos(azimuths)
+        speeds = np.nan_to_num(cols['speed'][slots][usable]) * KNOTS_TO_KMPS
+        headings = np.radians(np.nan_to_num(cols['heading'][slots][usable]))
+        self.vEast = speeds * np.sin(headings)
+        self.vNorth = speeds * np.cos(headings)
+        self.rates = rates[usable]
+        self.altitudes = altitudes[usable] + (self.rates * np.clip(ages[usable], 0.0, maxPositionAge))
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class ConflictDetector():
+    """Closest-point-of-approach alerts for the tracks, against the observer
+       and between pairs of aircraft
+
+      check() is called (e.g., by the ingester) after each snapshot has been
+      applied to the tracks.
+    """
+    def __init__(self, horizon=DEF_HORIZON, pairSeparation=DEF_PAIR_SEPARATION, pairVertical=DEF_PAIR_VERTICAL,
+                 observerRadius=DEF_OBSERVER_RADIUS, observerHeight=DEF_OBSERVER_HEIGHT,
+                 observerAltitude=DEF_OBSERVER_ALTITUDE, maxPositionAge=DEF_MAX_POSITION_AGE,
+                 clearTime=DEF_CLEAR_TIME):
+        if (horizon < 0) or (pairSeparation <= 0) or (observerRadius < 0):
+            raise ValueError("Invalid conflict detection limits")
+        self.horizon = horizon
+        self.pairSeparation = pairSeparation
+        self.pairVertical = pairVertical
+        self.observerRadius = observerRadius
+        self.observerHeight = observerHeight
+        self.observerAltitude = observerAltitude
+        self.maxPositionAge = maxPositionAge
+        self.clearTime = clearTime
+        self.active = {}  # (kind, ids): (Alert, time last predicted)
+        self.raised = 0
+        self.candidates = 0  # pairs tested in the last check
+
+    def __repr__(self):
+        return f"{len(self.active)} active alerts, {self.raised} raised"
+
+    def observerAlerts(self, k):
+        """Return a list of the alerts of the tracks that will come within the
+           observer's radius and height, given their TrackKinematics
+        """
+        t, d = closestApproach(k.east, k.north, k.vEast, k.vNorth, self.horizon)
+        vertical = (k.altitudes + (k.rates * t)) - self.observerAltitude
+        hits = np.flatnonzero((d < self.observerRadius) & (np.abs(vertical) < self.observerHeight))
+        return [("observer", (k.ids[n],), t[n], d[n], vertical[n]) for n in hits.tolist()]
+
+    def candidatePairs(self, k):
+        """Return arrays of the indices of the pairs of tracks that could come
+           within the separation of each other, given their TrackKinematics
+        """
+        if ((len(k) * (len(k) - 1)) // 2) <= ALL_PAIRS_LIMIT:
+            return np.triu_indices(len(k), 1)
+        return self.gridPairs(k)
+
+    def gridPairs(self, k):
+        """Return arrays of the indices of the pairs of tracks whose padded
+           paths over the horizon overlap, given their TrackKinematics
+        """
+        pad, horizon = self.pairSeparation / 2.0, self.horizon
+        east2, north2 = k.east + (k.vEast * horizon), k.north + (k.vNorth * horizon)
+        lefts = np.minimum(k.east, east2) - pad
+        bottoms = np.minimum(k.north, north2) - pad
+        widths = np.abs(east2 - k.east) + (2 * pad)
+        heights = np.abs(north2 - k.north) + (2 * pad)
+        boxes = list(zip(lefts.tolist(), bottoms.tolist(), widths.tolist(), heights.tolist()))
+        # cells about the size of a typical path, so each box is in a few of them
+        grid = SpatialGrid(max(float(np.median(np.maximum(widths, heights))) if len(boxes) else 1.0, 2 * pad))
+        for n, box in enumerate(boxes):
+            grid.insert(box, n)
+        first, second = [], []
+        query = grid.query
+        for n, box in enumerate(boxes):
+            others = [m for m in query(box) if m > n]
+            first.extend([n] * len(others))
+            second.extend(others)
+        return np.array(first, dtype=np.intp), np.array(second, dtype=np.intp)
+
+    def pairAlerts(self, k, first, second):
+        """Return a list of the alerts of the given pairs of tracks (arrays of
+           indices into their TrackKinematics) that will lose separation
+        """
+        horizon = self.horizon
+        # prefilter on the altitudes the pairs could be at within the horizon
+        alt1, alt2 = k.altitudes[first], k.altitudes[second]
+        end1, end2 = alt1 + (k.rates[first] * horizon), alt2 + (k.rates[second] * horizon)
+        mask = ((np.minimum(alt1, end1) - self.pairVertical) < np.maximum(alt2, end2)) & \
+               ((np.minimum(alt2, end2) - self.pairVertical) < np.maximum(alt1, end1))
+        first, second = first[mask], second[mask]
+        t, d = closestApproach(k.east[second] - k.east[first], k.north[second] - k.north[first],
+                               k.vEast[second] - k.vEast[first], k.vNorth[second] - k.vNorth[first], horizon)
+        vertical = (k.altitudes[second] + (k.rates[second] * t)) - (k.altitudes[first] + (k.rates[first] * t))
+        hits = np.flatnonzero((d < self.pairSeparation) & (np.abs(vertical) < self.pairVertical))
+        alerts = []
+        for n in hits.tolist():
+            ids = (k.ids[first[n]], k.ids[second[n]])
+            if ids[1] < ids[0]:
+                ids = (ids[1], ids[0])
+            alerts.append(("pair", ids, t[n], d[n], vertical[n]))
+        return alerts
+
+    def check(self, tracks, now):
+        """Predict the closest approaches of the tracks (a TrackTable) as of
+           the given time, and return a list of the Alerts that were raised
+
+          N.B. This reads the tracks, so it must be called while holding the
+               tracks lock, or by whatever is the only thing that updates them.
+        """
+        k = TrackKinematics(tracks, now, self.maxPositionAge)
+        predicted = self.observerAlerts(k)
+        if len(k) > 1:
+            first, second = self.candidatePairs(k)
+            self.candidates = len(first)
+            predicted += self.pairAlerts(k, first, second)
+        raised = []
+        for kind, ids, t, d, vertical in predicted:
+            key = (kind, ids)
+            alert = Alert(kind, ids, tuple(tracks[i].flightNumber for i in ids), float(t), float(d), float(vertical))
+            if key not in self.active:
+                raised.append(alert)
+            self.active[key] = (alert, now)
+        for key in [key for key, (_, last) in self.active.items() if (now - last) >= self.clearTime]:
+            del self.active[key]
+        self.raised += len(raised)
+        return raised
+
+    def activeAlerts(self):
+        """Return a list of the currently active Alerts, soonest first
+        """
+        return sorted((alert for alert, _ in self.active.values()), key=lambda a: a.time)
@@ -0,0 +1,215 @@
+################################################################################
+#
+# Coverage module for pocket1090
+#
+# Accumulates the receiver's range and coverage from the tracks' positions, in
+#  a polar grid of azimuth bins (1 deg by default) by altitude bands, keeping
+#  the max range, the strongest and weakest RSSI, and the number of position
+#  reports of each cell.
+#
+# Updating a cell is constant time (an index calculation and a few compares),
+#  so it's done by the ingester for every track that was added or changed, and
+#  the display only reads the max range per azimuth when it redraws its
+#  overlay.
+#
+# A map is saved as a compressed numpy (.npz) file (written to a temporary
+#  file and then renamed, so a crash can't leave a partial map), and loading a
+#  saved map and merging it into the current one accumulates the coverage
+#  across sessions. The cells are relative to the receiver, so the map records
+#  the site it was started at, and maps from sites farther apart than
+#  SITE_RADIUS aren't merged (and a map that can't be merged is never saved
+#  over).
+#
+################################################################################
+
+from bisect import bisect_right
+import logging
+import math
+import os
+import threading
+import time
+import zipfile
+
+from geopy import Point
+from geopy import distance as geoDistance
+import numpy as np
+
+
+DEF_AZIMUTH_BINS = 360
+DEF_ALTITUDE_BANDS = (0, 5000, 10000, 20000, 30000, 40000)  # feet, the lower edge of each band (the last is open-ended)
+
+SITE_RADIUS = 5.0  # max Km between the sites of maps that can be merged
+
+FORMAT_VERSION = 1
+
+
+class CoverageMap():
+    """Polar grid of the max range, min/max RSSI, and number of position
+       reports, per azimuth bin and altitude band
+    """
+    def __init__(self, azimuthBins=DEF_AZIMUTH_BINS, altitudeBands=DEF_ALTITUDE_BANDS, site=None):
+        if azimuthBins < 1:
+            raise ValueError(f"Invalid number of azimuth bins: {azimuthBins}")
+        if (not altitudeBands) or (list(altitudeBands) != sorted(set(altitudeBands))):
+            raise ValueError(f"Invalid altitude bands: {altitudeBands}")
+        self.azimuthBins = azimuthBins
+        self.altitudeBands = tuple(altitudeBands)
+        self.site = site
+        self.lock = threading.Lock()
+        shape = (len(self.altitudeBands), azimuthBins)
+        self.maxRange = np.zeros(shape, np.float64)         # Km
+        self.maxRssi = np.full(shape, -np.inf, np.float32)  # dBFS
+        self.minRssi = np.full(shape, np.inf, np.float32)   # dBFS
+        self.counts = np.zeros(shape, np.uint32)
+        self.version = 0  # incremented whenever a cell's max range increases
+        self._binsPerDegree = azimuthBins / 360.0
+
+    def __len__(self):
+        """Return the number of cells that have had position reports
+        """
+        return int(np.count_nonzero(self.counts))
+
+    def cell(self, azimuth, altitude):
+        """Return the (altitude band, azimuth bin) indices of the cell that a
+           position at the given azimuth (degrees) and altitude (feet) is in
+        """
+        band = max(bisect_right(self.altitudeBands, altitude) - 1, 0)
+        return band, int(azimuth * self._binsPerDegree) % self.azimuthBins
+
+    def update(self, distance, azimuth, altitude, rssi=None):
+        """Add a position report at the given distance (Km), azimuth (degrees),
+           altitude (feet), and RSSI (dBFS, or None), and return True if it
+           increased the max range of its cell
+        """
+        if (distance is None) or (azimuth is None) or (altitude is None):
+            return False
+        indx = self.cell(azimuth, altitude)
+        with self.lock:
+            self.counts[indx] += 1
+            if (rssi is not None) and not math.isnan(rssi):
+                if rssi > self.maxRssi[indx]:
+                    self.maxRssi[indx] = rssi
+                if rssi < self.minRssi[indx]:
+                    self.minRssi[indx] = rssi
+            if distance > self.maxRange[indx]:
+                self.maxRange[indx] = distance
+                self.version += 1
+                return True
+        return False
+
+    def updateTrack(self, track):
+        """Add a track's current position report
+        """
+        altitude = track.altitude
+        if altitude is None:
+            altitude = track.baroAltitude
+        return self.update(track.distance, track.azimuth, altitude, track.rssi)
+
+    def ranges(self, bands=None):
+        """Return an array of the max range (Km) in each azimuth bin, over the
+           given altitude bands (default: all of them)
+        """
+        with self.lock:
+            return self.maxRange[list(range(len(self.altitudeBands))) if bands is None else list(bands)].max(axis=0, initial=0.0)
+
+    def azimuths(self):
+        """Return an array of the azimuth (degrees) of the middle of each bin
+        """
+        return (np.arange(self.azimuthBins) + 0.5) * (360.0 / self.azimuthBins)
+
+    def maxRangeInfo(self):
+        """Return the max range (Km) and the azimuth (degrees) and altitude band
+           it was at, or None if there haven't been any position reports
+        """
+        with self.lock:
+            if not self.counts.any():
+                return None
+            band, azi = np.unravel_index(np.argmax(self.maxRange), self.maxRange.shape)
+            return float(self.maxRange[band, azi]), float(self.azimuths()[azi]), self.altitudeBands[band]
+
+    def checkSite(self, location):
+        """Make the given location (a geopy Point) the map's site if it doesn't
+           have one yet, and return True if the location is at the map's site
+        """
+        if self.site is None:
+            self.site = location
+        return self.sameSite(location)
+
+    def sameSite(self, location):
+        """Return True if the given location (a geopy Point) is within
+           SITE_RADIUS of the map's site (or the map has no site)
+        """
+        if (self.site is None) or (location is None):
+            return True
+        return geoDistance.distance(self.site, location).km <= SITE_RADIUS
+
+    def merge(self, other):
+        """Merge another map (with the same grid, from the same site) into
+           this one
+        """
+        if (other.azimuthBins != self.azimuthBins) or (other.altitudeBands != self.altitudeBands):
+            raise ValueError("Can't merge coverage maps with different grids")
+        if not self.sameSite(other.site):
+            raise ValueError(f"Can't merge coverage maps from different sites: {self.site} and {other.site}")
+        with self.lock:
+            if self.site is None:
+                self.site = other.site
+            increased = (other.maxRange > self.maxRange).any()
+            np.maximum(self.maxRange, other.maxRange, out=self.maxRange)
+            np.maximum(self.maxRssi, other.maxRssi, out=self.maxRssi)
+            np.minimum(self.minRssi, other.minRssi, out=self.minRssi)
+            self.counts += other.counts
+            if increased:
+                self.version += 1
+
+    def save(self, path):
+        """Write the map to the given file, atomically
+        """
+        with self.lock:
+            arrays = {'maxRange': self.maxRange.copy(), 'maxRssi': self.maxRssi.copy(),
+                      'minRssi': self.minRssi.copy(), 'counts': self.counts.copy()}
+        site = (np.nan, np.nan) if self.site is None else (self.site.latitude, self.site.longitude)
+        tmpPath = f"{path}.tmp"
+        with open(tmpPath, "wb") as f:
+            np.savez_compressed(f, version=FORMAT_VERSION, altitudeBands=np.array(self.altitudeBands, np.float64),
+                                site=np.array(site, np.float64), **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return the map saved in the given file
+        """
+        with np.load(path) as f:
+            if int(f['version']) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported coverage map version: {int(f['version'])}")
+            lat, lon = f['site']
+            site = None if np.isnan(lat) else Point(float(lat), float(lon))
+            bands = tuple(int(b) for b in f['altitudeBands'])
+            maxRange = f['maxRange']
+            m = cls(maxRange.shape[1], bands, site)
+            if maxRange.shape != m.maxRange.shape:
+                raise ValueError(f"Invalid coverage map: {path}")
+            m.maxRange[:] = maxRange
+            m.maxRssi[:] = f['maxRssi']
+            m.minRssi[:] = f['minRssi']
+            m.counts[:] = f['counts']
+        return m
+
+    def loadAndMerge(self, path):
+        """Merge the map saved in the given file (if it exists) into this one,
+           and return the path to save the map to: the given one, or if the
+           file couldn't be merged (e.g., it's from another site, or corrupt),
+           a new one next to it, so that the map in it isn't overwritten
+        """
+        if not os.path.exists(path):
+            return path
+        try:
+            self.merge(CoverageMap.load(path))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            root, ext = os.path.splitext(path)
+            newPath = f"{root}_{time.strftime('%Y%m%d%H%M%S')}{ext}"
+            logging.warning(f"Not merging coverage map '{path}': {e}, saving this session's map to '{newPath}' instead")
+            return newPath
+        return path
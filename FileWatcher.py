@@ -0,0 +1,125 @@
+################################################################################
+#
+# File Watcher module for pocket1090
+#
+# Waits for dump1090-fa to replace one of the files in its json directory.
+#  dump1090-fa writes to a temp file and then renames it into place, so the
+#  watcher listens (via inotify) for IN_CLOSE_WRITE/IN_MOVED_TO events on the
+#  directory and falls back to polling the file's mtime if inotify isn't
+#  available (e.g., non-Linux hosts or some network file systems).
+#
+################################################################################
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+DEF_POLL_INTERVAL = 0.5
+
+
+class FileWatcher():
+    """Block until a new version of the given file has been written
+
+      N.B. The first call to wait() returns immediately if the file exists,
+           so the caller always gets to process the current contents.
+    """
+    def __init__(self, filePath, pollInterval=DEF_POLL_INTERVAL, useInotify=True):
+        self.filePath = filePath
+        self.dirPath, self.fileName = os.path.split(os.path.abspath(filePath))
+        self.pollInterval = pollInterval
+        self.lastMtime = None
+        self.fd = self._initInotify() if useInotify else None
+        self.mode = "poll" if self.fd is None else "inotify"
+        logging.info(f"Watching '{self.filePath}' using {self.mode}")
+
+    def _initInotify(self):
+        """Return an inotify file descriptor watching the file's directory, or
+           None if inotify can't be used
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            inotifyInit = libc.inotify_init1
+            inotifyAddWatch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            logging.warning("inotify not available, falling back to polling")
+            return None
+        fd = inotifyInit(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logging.warning(f"inotify_init1 failed ({os.strerror(ctypes.get_errno())}), falling back to polling")
+            return None
+        wd = inotifyAddWatch(fd, os.fsencode(self.dirPath), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            logging.warning(f"inotify_add_watch failed ({os.strerror(ctypes.get_errno())}), falling back to polling")
+            os.close(fd)
+            return None
+        return fd
+
+    def _getMtime(self):
+        """Return the file's (mtime, mtime_ns) or (None, None) if it doesn't exist
+        """
+        try:
+            st = os.stat(self.filePath)
+        except FileNotFoundError:
+            return None, None
+        return st.st_mtime, st.st_mtime_ns
+
+    def _fileEvent(self):
+        """Drain all pending inotify events and return True if any of them
+           were for the watched file (or if the event queue overflowed)
+        """
+        found = False
+        while True:
+            try:
+                buf = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return found
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, nameLen = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + nameLen].rstrip(b"\0")
+                offset += nameLen
+                if (mask & IN_Q_OVERFLOW) or (os.fsdecode(name) == self.fileName):
+                    found = True
+
+    def wait(self, timeout=None):
+        """Wait for a new version of the file and return its mtime (in Unix
+           epoch time), or None if the timeout (in secs) expired first
+        """
+        deadline = None if timeout is None else (time.monotonic() + timeout)
+        while True:
+            mtime, mtimeNs = self._getMtime()
+            if (mtimeNs is not None) and (mtimeNs != self.lastMtime):
+                self.lastMtime = mtimeNs
+                return mtime
+            remaining = None if deadline is None else (deadline - time.monotonic())
+            if (remaining is not None) and (remaining <= 0):
+                return None
+            if self.fd is None:
+                time.sleep(self.pollInterval if remaining is None else min(self.pollInterval, remaining))
+                continue
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready:
+                self._fileEvent()
+
+    def close(self):
+        """Release the inotify file descriptor (if any)
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
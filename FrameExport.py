@@ -0,0 +1,259 @@
+################################################################################
+#
+# Frame Export module for pocket1090
+#
+# Sinks that the radar display hands each rendered frame to (e.g., in headless
+#  mode), for viewing it remotely or checking it in benchmarks and tests:
+#
+#  * PngSink: writes frames as PNG files (atomically replacing a single file,
+#             or one file per frame)
+#  * SharedMemorySink: copies the raw RGB pixels into a POSIX shared memory
+#             segment, which SharedMemoryReader (or any other process) reads
+#  * MjpegServer: serves the frames as an MJPEG stream (and single JPEGs) on
+#             a local HTTP socket
+#
+# Each sink has a write(surface, frameNumber) method, which is called from the
+#  render loop, so the expensive work (e.g., JPEG encoding) is skipped when
+#  it isn't needed or done in a background thread.
+#
+# The shared memory segment starts with a header of a sequence number, the
+#  width, and the height (little-endian uint64, uint32, uint32), followed by
+#  the pixels (height rows of width RGB triples). The sequence number is odd
+#  while a frame is being written (i.e., it's a seqlock).
+#
+################################################################################
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import logging
+from multiprocessing import resource_tracker, shared_memory
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import pygame
+
+
+DEF_MJPEG_HOST = "127.0.0.1"
+DEF_MJPEG_PORT = 8090
+DEF_MJPEG_FPS = 5  # max frames per second that are encoded for the MJPEG stream
+MJPEG_BOUNDARY = "pocket1090frame"
+
+SHM_HEADER = struct.Struct("<QII")
+
+
+class PngSink():
+    """Writes every n-th frame to a PNG file
+
+      If the path contains '{frame}', it's replaced with the frame number
+      (i.e., one file per frame), otherwise the file is replaced atomically
+      with each new frame.
+    """
+    def __init__(self, path, every=1):
+        if every < 1:
+            raise ValueError("Invalid frame interval, must be at least one")
+        self.path = path
+        self.every = every
+        self.written = 0
+
+    def write(self, surface, frameNumber):
+        if frameNumber % self.every:
+            return
+        if "{frame}" in self.path:
+            pygame.image.save(surface, self.path.format(frame=frameNumber))
+        else:
+            tmpPath = f"{self.path}.tmp.png"
+            pygame.image.save(surface, tmpPath)
+            os.replace(tmpPath, self.path)
+        self.written += 1
+
+    def close(self):
+        pass
+
+
+class SharedMemorySink():
+    """Copies each frame's RGB pixels into a named shared memory segment
+    """
+    def __init__(self, name, size):
+        width, height = size
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=(SHM_HEADER.size + (width * height * 3)))
+        self.name = self.shm.name
+        self.size = size
+        self.seq = 0
+        self.pixels = self.shm.buf[SHM_HEADER.size:]
+        SHM_HEADER.pack_into(self.shm.buf, 0, self.seq, width, height)
+
+    def write(self, surface, frameNumber):
+        if surface.get_size() != self.size:
+            raise ValueError("Frame size doesn't match the shared memory segment")
+        SHM_HEADER.pack_into(self.shm.buf, 0, self.seq + 1, *self.size)
+        self.pixels[:] = pygame.image.tostring(surface, "RGB")
+        self.seq += 2
+        SHM_HEADER.pack_into(self.shm.buf, 0, self.seq, *self.size)
+
+    def close(self):
+        self.pixels.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedMemoryReader():
+    """Reads the frames written by a SharedMemorySink in another process
+    """
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before Python 3.13, attaching to a segment also registers it to
+            #  be unlinked when this process exits
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        _, width, height = SHM_HEADER.unpack_from(self.shm.buf, 0)
+        self.size = (width, height)
+        self.pixels = np.ndarray((height, width, 3), dtype=np.uint8, buffer=self.shm.buf, offset=SHM_HEADER.size)
+
+    def read(self, retries=100):
+        """Return the sequence number and a copy of the pixels (as a height x
+           width x 3 array) of the latest complete frame, or (None, None) if
+           one couldn't be read without it being overwritten
+        """
+        for _ in range(retries):
+            seq = SHM_HEADER.unpack_from(self.shm.buf, 0)[0]
+            if seq & 1:
+                time.sleep(0.001)
+                continue
+            pixels = self.pixels.copy()
+            if SHM_HEADER.unpack_from(self.shm.buf, 0)[0] == seq:
+                return seq // 2, pixels
+        return None, None
+
+    def close(self):
+        del self.pixels
+        self.shm.close()
+
+
+class _MjpegHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server.sink
+        if self.path in ("/", "/stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            server._addClient()
+            try:
+                seq = 0
+                while server.running:
+                    seq, jpeg = server.waitFrame(seq)
+                    if jpeg is None:
+                        continue
+                    self.wfile.write(f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                     f"Content-Length: {len(jpeg)}\r\n\r\n".encode("ascii"))
+                    self.wfile.write(jpeg)
+                    self.wfile.write(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                server._removeClient()
+        elif self.path == "/frame.jpg":
+            server._addClient()
+            try:
+                _, jpeg = server.waitFrame(server.seq)
+            finally:
+                server._removeClient()
+            if jpeg is None:
+                self.send_error(503, "No frame available")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(jpeg)))
+            self.end_headers()
+            self.wfile.write(jpeg)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        logging.debug(f"MJPEG: {self.address_string()} {format % args}")
+
+
+class MjpegServer():
+    """Serves the frames as an MJPEG stream at '/stream' (and the latest frame
+       at '/frame.jpg') from a background HTTP server
+
+      Frames are only copied and encoded (in a background thread, at most
+      maxFps times a second) while there are clients, and each client gets the
+      latest frame when it's ready for one, so slow clients skip frames rather
+      than hold up the render loop or the other clients.
+    """
+    def __init__(self, port=DEF_MJPEG_PORT, host=DEF_MJPEG_HOST, maxFps=DEF_MJPEG_FPS):
+        self.interval = 1.0 / maxFps
+        self.clients = 0
+        self.pending = None
+        self.lastCopy = 0
+        self.jpeg = None
+        self.seq = 0
+        self.encoded = 0
+        self.cond = threading.Condition()
+        self.running = True
+        self.httpd = ThreadingHTTPServer((host, port), _MjpegHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.sink = self
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, args=(), daemon=True).start()
+        self.encoder = threading.Thread(target=self._encoder, args=(), daemon=True)
+        self.encoder.start()
+
+    def _addClient(self):
+        with self.cond:
+            self.clients += 1
+
+    def _removeClient(self):
+        with self.cond:
+            self.clients -= 1
+
+    def write(self, surface, frameNumber):
+        if not self.clients:
+            return
+        now = time.monotonic()
+        if (now - self.lastCopy) < self.interval:
+            return
+        self.lastCopy = now
+        frame = surface.copy()
+        with self.cond:
+            self.pending = frame
+            self.cond.notify_all()
+
+    def _encoder(self):
+        while True:
+            with self.cond:
+                while self.running and (self.pending is None):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                frame, self.pending = self.pending, None
+            f = io.BytesIO()
+            pygame.image.save(frame, f, "frame.jpg")
+            with self.cond:
+                self.jpeg = f.getvalue()
+                self.seq += 1
+                self.encoded += 1
+                self.cond.notify_all()
+
+    def waitFrame(self, lastSeq, timeout=1.0):
+        """Wait (up to timeout secs) for a frame newer than lastSeq, and return
+           its sequence number and JPEG bytes (or lastSeq and None)
+        """
+        with self.cond:
+            if self.cond.wait_for(lambda: (self.seq > lastSeq) or not self.running, timeout) and self.running:
+                return self.seq, self.jpeg
+        return lastSeq, None
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.encoder.join(1.0)
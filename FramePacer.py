@@ -0,0 +1,83 @@
+################################################################################
+#
+# Frame Pacer module for pocket1090
+#
+# Paces a render loop at a fixed frame rate, and keeps frame pacing stats:
+#  the times between frame starts, their percentiles, and the number of
+#  frames that were dropped because a frame took longer than its slot.
+#
+################################################################################
+
+from collections import deque
+import time
+
+
+DEF_FPS = 10
+DEF_PACING_STATS_LEN = 300  # number of frames that pacing stats are kept for
+
+
+class FramePacer():
+    """Sleeps until the start of the next frame slot at the given rate
+
+      If a frame overruns its slot, the missed slots are counted as dropped
+      and the schedule restarts from the current time (i.e., no catching up
+      with a burst of frames).
+    """
+    def __init__(self, fps=DEF_FPS, statsLen=DEF_PACING_STATS_LEN):
+        if fps <= 0:
+            raise ValueError("Invalid frame rate, must be greater than zero")
+        self.fps = fps
+        self.interval = 1.0 / fps
+        self.frameTimes = deque([], maxlen=statsLen)
+        self.frames = 0
+        self.dropped = 0
+        self.nextFrame = None
+        self.lastFrame = None
+
+    def wait(self):
+        """Wait until the start of the next frame, and return the number of
+           frames that were dropped since the last call
+        """
+        now = time.monotonic()
+        dropped = 0
+        if self.nextFrame is None:
+            self.nextFrame = now
+        else:
+            self.nextFrame += self.interval
+            delay = self.nextFrame - now
+            if delay > 0:
+                time.sleep(delay)
+                now = self.nextFrame
+            else:
+                dropped = int(-delay / self.interval)
+                self.nextFrame = now
+        if self.lastFrame is not None:
+            self.frameTimes.append(now - self.lastFrame)
+        self.lastFrame = now
+        self.frames += 1
+        self.dropped += dropped
+        return dropped
+
+    def percentile(self, pct):
+        """Return the given percentile (0-100) of the recent frame times (in
+           secs), or None if there aren't any yet
+        """
+        if not self.frameTimes:
+            return None
+        times = sorted(self.frameTimes)
+        return times[min(len(times) - 1, int(round((pct / 100.0) * (len(times) - 1))))]
+
+    def stats(self):
+        """Return a dict of the frame pacing stats
+        """
+        return {'fps': self.fps,
+                'frames': self.frames,
+                'dropped': self.dropped,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99)}
+
+    def __str__(self):
+        if not self.frameTimes:
+            return f"{self.fps} fps, n/a"
+        return (f"{self.fps} fps, p50={self.percentile(50) * 1000:.1f} msec, p99={self.percentile(99) * 1000:.1f} msec, "
+                f"dropped={self.dropped}/{self.frames}")
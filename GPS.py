@@ -2,21 +2,34 @@
 #
 # GPS module for pocket1090
 #
-# N.B. Currently hardwired to this location
+# A background thread continuously reads NMEA sentences from the GPS module's
+#  serial port and publishes each valid GGA fix into a latest-fix slot (a
+#  single immutable tuple, so readers never block or take a lock). The GGA
+#  fixes and RMC speeds/courses also feed a PositionFilter, which the
+#  filtered location comes from.
+#
+# NmeaReplay creates a pty-based fake serial device that replays NMEA logs
+#  (or generated sentences), so the GPS can be exercised without hardware.
 #
 # TODO
 #  * implement the interface to the chosen GPS module
 #
 ################################################################################
 
-from collections import deque
+from collections import namedtuple
+from datetime import datetime, timezone
 import logging
+import os
+import threading
 import time
+import tty
 
 from geopy import Point
 from pynmeagps import NMEAReader
 from serial import Serial
 
+from PositionFilter import PositionFilter
+
 
 DEF_SERIAL_PORT = "/dev/ttyAMA0"
 STREAM_BAUD_RATE = 9600
@@ -24,13 +37,37 @@ STREAM_TIMEOUT = 3
 
 WARN_INTERVAL = 1000
 
-MAX_FILTER_LEN = 30
+
+DEF_REPLAY_INTERVAL = 1.0  # secs between replayed fixes (i.e., a typical 1Hz GPS)
+REPLAY_START_DELAY = 0.5   # secs before the first replayed fix, so the GPS can open the device first
+
+DEF_MAX_FIX_AGE = 10.0  # secs the filtered location is extrapolated past the latest fix
+
+
+# utcTime: time of the fix (from the GPS), lat/lon: degrees, alt: meters MSL,
+#  quality: GGA fix quality, numSV: satellites used, hdop: horizontal dilution
+#  of precision, rxTime: time.monotonic() when the fix was received
+Fix = namedtuple("Fix", ["utcTime", "lat", "lon", "alt", "quality", "numSV", "hdop", "rxTime"])
 
 
 class GPS():
-    def __init__(self, serialPort=DEF_SERIAL_PORT, fixedLocation=None):
+    """Reads fixes from the GPS module in a background thread
+
+      N.B. Readers never wait for the serial port: getTimeLocation() and
+           getFilteredLocation() return the latest fix, and only wait (up to
+           maxWaitTime) if there hasn't been one yet.
+    """
+    def __init__(self, serialPort=DEF_SERIAL_PORT, fixedLocation=None, positionFilter=None, maxFixAge=DEF_MAX_FIX_AGE):
         self.serialPort = serialPort
         self.fixedLocation = fixedLocation
+        self.maxFixAge = maxFixAge
+        self.stale = False  # the latest fix was older than maxFixAge when last read
+        self.latestFix = None
+        self.filter = positionFilter if positionFilter else PositionFilter()
+        self.sentences = 0
+        self.errors = 0
+        self.firstFix = threading.Event()
+        self.running = False
         if fixedLocation:
             if not isinstance(fixedLocation, Point):
                 logging.error("The arg 'fixedLocation' must by of type 'Point'")
@@ -38,43 +75,187 @@ class GPS():
         else:
             self.stream = Serial(serialPort, baudrate=STREAM_BAUD_RATE, timeout=STREAM_TIMEOUT)
             self.nmr = NMEAReader(self.stream)
-        self.lats = deque([], maxlen=MAX_FILTER_LEN)
-        self.lons = deque([], maxlen=MAX_FILTER_LEN)
+            self.running = True
+            self.thread = threading.Thread(target=self._reader, args=(), daemon=True)
+            self.thread.start()
 
-    def getTimeLocation(self, maxWaitTime=None):
-        """#### TODO
+    def _reader(self):
+        """Parse NMEA sentences from the serial port and publish the valid fixes
         """
-        if self.fixedLocation:
-            return self.fixedLocation
-        utcTime, lat, lon = None, None, None
-        lastWarning = start = time.time()
-        while None in (lat, lon, utcTime):
-            _, parsedMsg = self.nmr.read()
+        lastWarning = 0
+        while self.running:
+            try:
+                _, parsedMsg = self.nmr.read()
+            except Exception as e:
+                if not self.running:
+                    break
+                self.errors += 1
+                logging.warning(f"Invalid GPS read: {e}")
+                continue
             if parsedMsg is None:
-                logging.warning("Invalid GPS read")
+                # the read timed out
+                continue
+            self.sentences += 1
+            now = time.monotonic()
+            if parsedMsg.msgID == "RMC":
+                if (parsedMsg.status == "A") and (parsedMsg.spd != ""):
+                    self.filter.updateVelocity(now, parsedMsg.spd, None if parsedMsg.cog == "" else parsedMsg.cog)
+                continue
+            if parsedMsg.msgID != "GGA":
+                continue
+            if (parsedMsg.quality == 0) or (parsedMsg.lat == "") or (parsedMsg.lon == ""):
+                if ((now - lastWarning) > WARN_INTERVAL):
+                    logging.warning("GPS quality issue: invalid data")
+                    lastWarning = now
                 continue
-            now = time.time()
-            if parsedMsg.msgID == "GGA":
-                if parsedMsg.quality == 0:
-                    if ((now - lastWarning) > WARN_INTERVAL):
-                        logging.warning("GPS quality issue: invalid data")
-                        lastWarning = now
-                    continue
-                lat = parsedMsg.lat
-                lon = parsedMsg.lon
-                utcTime = parsedMsg.time  #### FIXME make the be the right format
-            if maxWaitTime and ((now - start) > maxWaitTime):
+            fix = Fix(parsedMsg.time, parsedMsg.lat, parsedMsg.lon, None if parsedMsg.alt == "" else parsedMsg.alt,
+                      parsedMsg.quality, parsedMsg.numSV, None if parsedMsg.HDOP == "" else parsedMsg.HDOP, now)
+            self.filter.updatePosition(now, fix.lat, fix.lon, fix.hdop, fix.quality)
+            self.latestFix = fix
+            self.firstFix.set()
+
+    def getFix(self, maxWaitTime=None):
+        """Return the latest Fix, waiting up to maxWaitTime secs (None means
+           forever) for the first one, or None if there isn't one
+        """
+        fix = self.latestFix
+        if (fix is None) and self.running:
+            if not self.firstFix.wait(maxWaitTime):
                 logging.warning("Returned without GPS information")
-                return None, None
-            time.sleep(.1)
-        self.lats.append(lat)
-        self.lons.append(lon)
-        return utcTime, Point(lat, lon)
+                return None
+            fix = self.latestFix
+        return fix
+
+    def fixAge(self):
+        """Return the number of secs since the latest fix was received (or
+           None if there hasn't been one)
+        """
+        fix = self.latestFix
+        return None if fix is None else (time.monotonic() - fix.rxTime)
+
+    def getTimeLocation(self, maxWaitTime=None):
+        """Return the time and location of the latest fix, or (None, None) if
+           there wasn't one within maxWaitTime secs
+        """
+        if self.fixedLocation:
+            return datetime.now(timezone.utc).time(), self.fixedLocation
+        fix = self.getFix(maxWaitTime)
+        if fix is None:
+            return None, None
+        return fix.utcTime, Point(fix.lat, fix.lon)
 
     def getFilteredLocation(self, maxWaitTime=None):
-        """ #### FIXME
+        """Return the time of the latest fix and the filtered location (moved
+           along the filtered velocity to the current time), or (None, None)
+           if there wasn't a fix within maxWaitTime secs
+          If the latest fix is more than maxFixAge secs old (e.g., the receiver
+          lost its fix), the location isn't moved past the time of that fix.
         """
-        time, loc = self.getTimeLocation(maxWaitTime)
-        avgLat = sum(self.lats) / len(self.lats)
-        avgLon = sum(self.lons) / len(self.lons)
-        return time, Point(avgLat, avgLon)
+        if self.fixedLocation:
+            return self.getTimeLocation()
+        fix = self.getFix(maxWaitTime)
+        if fix is None:
+            return None, None
+        now = time.monotonic()
+        stale = (now - fix.rxTime) > self.maxFixAge
+        if stale != self.stale:
+            self.stale = stale
+            if stale:
+                logging.warning(f"GPS fix is stale ({now - fix.rxTime:.0f} secs old), not extrapolating the location")
+            else:
+                logging.info("GPS fix is current again")
+        return fix.utcTime, Point(*self.filter.predict(fix.rxTime if stale else now))
+
+    def close(self):
+        if self.running:
+            self.running = False
+            self.thread.join(STREAM_TIMEOUT + 1)
+            self.stream.close()
+
+
+def nmeaSentence(body):
+    """Return the complete NMEA sentence (with checksum and CRLF, as bytes)
+       for the given body (i.e., the text between the '$' and the '*')
+    """
+    checksum = 0
+    for c in body.encode("ascii"):
+        checksum ^= c
+    return f"${body}*{checksum:02X}\r\n".encode("ascii")
+
+def _nmeaLatLon(lat, lon):
+    latDeg, lonDeg = int(abs(lat)), int(abs(lon))
+    latMin, lonMin = (abs(lat) - latDeg) * 60, (abs(lon) - lonDeg) * 60
+    return (f"{latDeg:02d}{latMin:07.4f},{'N' if lat >= 0 else 'S'}",
+            f"{lonDeg:03d}{lonMin:07.4f},{'E' if lon >= 0 else 'W'}")
+
+def encodeGGA(utc, lat, lon, alt=0.0, quality=1, numSV=8, hdop=1.0):
+    """Return a GGA sentence for the given UTC datetime and location
+    """
+    latStr, lonStr = _nmeaLatLon(lat, lon)
+    return nmeaSentence(f"GPGGA,{utc:%H%M%S}.{utc.microsecond // 10000:02d},{latStr},{lonStr},"
+                        f"{quality},{numSV:02d},{hdop:.2f},{alt:.1f},M,0.0,M,,")
+
+def encodeRMC(utc, lat, lon, speed=0.0, course=0.0):
+    """Return an RMC sentence for the given UTC datetime, location, speed (in
+       knots), and course (in degrees)
+    """
+    latStr, lonStr = _nmeaLatLon(lat, lon)
+    return nmeaSentence(f"GPRMC,{utc:%H%M%S}.{utc.microsecond // 10000:02d},A,{latStr},{lonStr},"
+                        f"{speed:.2f},{course:.2f},{utc:%d%m%y},,,A")
+
+
+class NmeaReplay():
+    """Fake serial device (a pty) that replays NMEA sentences
+
+      The sentences are sent in bursts (i.e., all the sentences from one GGA
+      up to the next one) every interval secs. Sentences can come from a log
+      file (one per line), or any iterable of sentences (as bytes or str).
+      The GPS reads from the device at the path in 'port'.
+    """
+    def __init__(self, sentences, interval=DEF_REPLAY_INTERVAL, loop=False):
+        if isinstance(sentences, str):
+            with open(sentences, "rb") as f:
+                sentences = [l for l in f.read().splitlines() if l.strip()]
+        self.bursts = []
+        for sentence in sentences:
+            if isinstance(sentence, str):
+                sentence = sentence.encode("ascii")
+            sentence = sentence.rstrip(b"\r\n") + b"\r\n"
+            if (not self.bursts) or (sentence[3:6] == b"GGA"):
+                self.bursts.append([])
+            self.bursts[-1].append(sentence)
+        self.interval = interval
+        self.loop = loop
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.sent = 0
+        self.sendTimes = []
+        self.running = True
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._writer, args=(), daemon=True)
+        self.thread.start()
+
+    def _writer(self):
+        # N.B. opening the serial port discards whatever was already sent
+        nextDue = time.monotonic() + REPLAY_START_DELAY
+        while self.running:
+            for burst in self.bursts:
+                delay = nextDue - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self.running:
+                    break
+                self.sendTimes.append(time.monotonic())
+                os.write(self.master, b"".join(burst))
+                self.sent += 1
+                nextDue += self.interval
+            if not self.loop:
+                break
+        self.done.set()
+
+    def close(self):
+        self.running = False
+        self.thread.join(self.interval + 1)
+        os.close(self.master)
+        os.close(self.slave)
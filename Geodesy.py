@@ -0,0 +1,129 @@
+################################################################################
+#
+# Geodesy module for pocket1090
+#
+# Vectorized (NumPy) distance and azimuth from the self location to all of
+#  the tracks in a snapshot, in one pass.
+#
+# Accuracy modes:
+#  * "ellipsoidal": Vincenty's inverse formula on the WGS84 ellipsoid (sub-mm
+#    agreement with geopy's geodesic at receiver ranges)
+#  * "haversine": great circle on a sphere with the mean Earth radius (up to
+#    ~0.5% error in distance)
+#  * "enu": flat-Earth local East/North approximation around the self location
+#    (fastest, good to a few hundred meters within ~100Km)
+#
+# Also, flat-Earth dead reckoning of tracks' distances and azimuths between
+#  snapshots, for smooth motion on the display.
+#
+# N.B. Azimuths are rhumb-line bearings (as in Track.distanceAndAzimuth()),
+#      except in "enu" mode where they're the bearing in the local plane.
+#
+################################################################################
+
+import numpy as np
+
+
+GEO_MODES = ("ellipsoidal", "haversine", "enu")
+DEF_GEO_MODE = "ellipsoidal"
+
+WGS84_A = 6378.137                  # Km
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+MEAN_EARTH_RADIUS = 6371.0088       # Km
+KNOTS_TO_KMPS = 1.852 / 3600.0
+
+VINCENTY_MAX_ITERATIONS = 20
+VINCENTY_TOLERANCE = 1e-12
+
+
+def rhumbAzimuths(lat1, lon1, lat2, lon2):
+    """Return the rhumb-line bearings (in degrees, 0-359) from one point to an
+       array of points (all in radians)
+    """
+    deltaLon = lon2 - lon1
+    deltaLon = np.where(deltaLon > np.pi, deltaLon - (2 * np.pi), deltaLon)
+    deltaLon = np.where(deltaLon < -np.pi, deltaLon + (2 * np.pi), deltaLon)
+    deltaPhi = np.log(np.tan((lat2 / 2) + (np.pi / 4)) / np.tan((lat1 / 2) + (np.pi / 4)))
+    return (np.degrees(np.arctan2(deltaLon, deltaPhi)) + 360.0) % 360.0
+
+def haversineDistances(lat1, lon1, lat2, lon2):
+    """Return the great circle distances (in Km) from one point to an array
+       of points (all in radians)
+    """
+    a = (np.sin((lat2 - lat1) / 2) ** 2) + (np.cos(lat1) * np.cos(lat2) * (np.sin((lon2 - lon1) / 2) ** 2))
+    return 2 * MEAN_EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def vincentyDistances(lat1, lon1, lat2, lon2):
+    """Return the WGS84 ellipsoidal distances (in Km) from one point to an
+       array of points (all in radians)
+
+      N.B. Points that fail to converge (i.e., nearly antipodal ones) fall back
+           to the haversine distance.
+    """
+    u1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(u1), np.cos(u1)
+    sinU2, cosU2 = np.sin(u2), np.cos(u2)
+    L = lon2 - lon1
+    lam = L.copy()
+    for _ in range(VINCENTY_MAX_ITERATIONS):
+        sinLam, cosLam = np.sin(lam), np.cos(lam)
+        sinSigma = np.sqrt(((cosU2 * sinLam) ** 2) + (((cosU1 * sinU2) - (sinU1 * cosU2 * cosLam)) ** 2))
+        cosSigma = (sinU1 * sinU2) + (cosU1 * cosU2 * cosLam)
+        sigma = np.arctan2(sinSigma, cosSigma)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sinAlpha = np.where(sinSigma == 0, 0.0, (cosU1 * cosU2 * sinLam) / sinSigma)
+            cos2Alpha = 1 - (sinAlpha ** 2)
+            cos2SigmaM = np.where(cos2Alpha == 0, 0.0, cosSigma - ((2 * sinU1 * sinU2) / cos2Alpha))
+        C = (WGS84_F / 16) * cos2Alpha * (4 + (WGS84_F * (4 - (3 * cos2Alpha))))
+        prevLam = lam
+        lam = L + ((1 - C) * WGS84_F * sinAlpha *
+                   (sigma + (C * sinSigma * (cos2SigmaM + (C * cosSigma * (-1 + (2 * (cos2SigmaM ** 2))))))))
+        if np.all(np.abs(lam - prevLam) < VINCENTY_TOLERANCE):
+            break
+    u2sq = cos2Alpha * ((WGS84_A ** 2) - (WGS84_B ** 2)) / (WGS84_B ** 2)
+    A = 1 + ((u2sq / 16384) * (4096 + (u2sq * (-768 + (u2sq * (320 - (175 * u2sq)))))))
+    B = (u2sq / 1024) * (256 + (u2sq * (-128 + (u2sq * (74 - (47 * u2sq))))))
+    deltaSigma = B * sinSigma * (cos2SigmaM + ((B / 4) * ((cosSigma * (-1 + (2 * (cos2SigmaM ** 2)))) -
+                 ((B / 6) * cos2SigmaM * (-3 + (4 * (sinSigma ** 2))) * (-3 + (4 * (cos2SigmaM ** 2)))))))
+    distances = WGS84_B * A * (sigma - deltaSigma)
+    bad = ~np.isfinite(distances) | (np.abs(lam - prevLam) >= VINCENTY_TOLERANCE)
+    if np.any(bad):
+        distances = np.where(bad, haversineDistances(lat1, lon1, lat2, lon2), distances)
+    return distances
+
+def distancesAndAzimuths(selfLat, selfLon, lats, lons, mode=DEF_GEO_MODE):
+    """Return arrays of the distances (in Km) and azimuths (in degrees, 0-359)
+       from the self location to each of the given locations (all in degrees)
+    """
+    if mode not in GEO_MODES:
+        raise ValueError(f"Invalid geodesy mode: {mode}")
+    lat1, lon1 = np.radians(selfLat), np.radians(selfLon)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    if mode == "enu":
+        deltaLon = ((lon2 - lon1 + np.pi) % (2 * np.pi)) - np.pi
+        east = deltaLon * np.cos((lat1 + lat2) / 2) * MEAN_EARTH_RADIUS
+        north = (lat2 - lat1) * MEAN_EARTH_RADIUS
+        return np.hypot(east, north), (np.degrees(np.arctan2(east, north)) + 360.0) % 360.0
+    if mode == "haversine":
+        distances = haversineDistances(lat1, lon1, lat2, lon2)
+    else:
+        distances = vincentyDistances(lat1, lon1, lat2, lon2)
+    return distances, rhumbAzimuths(lat1, lon1, lat2, lon2)
+
+def deadReckon(distances, azimuths, speeds, headings, ages):
+    """Return arrays of the distances (in Km) and azimuths (in degrees, 0-359)
+       from the self location to tracks that have moved along their headings
+       (in degrees) at their speeds (in knots) for the given ages (in secs)
+
+      N.B. Tracks with unknown (NaN) speeds or headings stay where they are.
+    """
+    moved = speeds * KNOTS_TO_KMPS * ages
+    moved = np.where(np.isfinite(moved) & np.isfinite(headings), moved, 0.0)
+    headings = np.radians(np.nan_to_num(headings))
+    azimuths = np.radians(azimuths)
+    east = (distances * np.sin(azimuths)) + (moved * np.sin(headings))
+    north = (distances * np.cos(azimuths)) + (moved * np.cos(headings))
+    return np.hypot(east, north), (np.degrees(np.arctan2(east, north)) + 360.0) % 360.0
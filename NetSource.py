@@ -0,0 +1,529 @@
+################################################################################
+#
+# Network Source module for pocket1090
+#
+# Connects directly to one of dump1090's TCP output ports and decodes the
+#  message stream incrementally into the same per-'hex' aircraft dicts that
+#  dump1090-fa writes to aircraft.json (and that Track.update() consumes):
+#  * Beast binary (port 30005): raw Mode S frames, decoded here
+#  * SBS BaseStation (port 30003): comma-separated, already decoded by dump1090
+#
+# N.B. dump1090 only forwards CRC-checked (or corrected) frames on its Beast
+#      output, so the parity isn't re-checked here.
+#
+################################################################################
+
+from collections import deque
+import logging
+import math
+import select
+import socket
+import socketserver
+import threading
+import time
+
+from AircraftSource import AircraftSource
+from Profiler import PROFILER
+
+
+BEAST_PORT = 30005
+SBS_PORT = 30003
+
+BEAST_ESC = 0x1a
+BEAST_MODE_AC = 0x31
+BEAST_MODE_S_SHORT = 0x32
+BEAST_MODE_S_LONG = 0x33
+BEAST_STATUS = 0x34
+BEAST_MSG_LENS = {BEAST_MODE_AC: 2, BEAST_MODE_S_SHORT: 7, BEAST_MODE_S_LONG: 14, BEAST_STATUS: 1}
+BEAST_HEADER_LEN = 7  # 6-byte MLAT timestamp and 1-byte signal level
+
+CPR_MAX = 131072.0    # 2^17
+CPR_PAIR_TIMEOUT = 10 # secs between even/odd frames for a global decode
+NZ = 15
+
+CALLSIGN_CHARS = "#ABCDEFGHIJKLMNOPQRSTUVWXYZ##### ###############0123456789######"
+EMERGENCY_STATES = ("none", "general", "lifeguard", "minfuel", "nordo", "unlawful", "downed", "reserved")
+IDENT_CATEGORIES = {1: "D", 2: "C", 3: "B", 4: "A"}
+
+MODES_CRC_POLY = 0xFFF409
+
+RSSI_WINDOW = 8
+DEF_EXPIRE = 60       # secs without messages before an aircraft is dropped
+READ_SIZE = 64 * 1024
+
+
+def cprNL(lat):
+    """Return the number of CPR longitude zones for the given latitude
+    """
+    if lat == 0:
+        return 59
+    lat = abs(lat)
+    if lat == 87:
+        return 2
+    if lat > 87:
+        return 1
+    a = 1 - math.cos(math.pi / (2 * NZ))
+    b = math.cos(math.radians(lat)) ** 2
+    return int(math.floor((2 * math.pi) / math.acos(1 - (a / b))))
+
+def cprGlobalDecode(evenCpr, oddCpr, oddIsNewest):
+    """Decode a pair of (lat, lon) CPR values (as fractions of a zone), returning
+       the (lat, lon) of the newest one or None if the pair straddles a zone
+    """
+    latE, lonE = evenCpr
+    latO, lonO = oddCpr
+    j = math.floor((59 * latE) - (60 * latO) + 0.5)
+    latEven = (360.0 / 60) * ((j % 60) + latE)
+    latOdd = (360.0 / 59) * ((j % 59) + latO)
+    if latEven >= 270:
+        latEven -= 360
+    if latOdd >= 270:
+        latOdd -= 360
+    nl = cprNL(latEven)
+    if nl != cprNL(latOdd):
+        return None
+    m = math.floor((lonE * (nl - 1)) - (lonO * nl) + 0.5)
+    if oddIsNewest:
+        lat = latOdd
+        ni = max(nl - 1, 1)
+        lon = (360.0 / ni) * ((m % ni) + lonO)
+    else:
+        lat = latEven
+        ni = max(nl, 1)
+        lon = (360.0 / ni) * ((m % ni) + lonE)
+    if lon >= 180:
+        lon -= 360
+    return lat, lon
+
+def cprLocalDecode(cpr, odd, refLat, refLon):
+    """Decode a single CPR (lat, lon) using a reference position that is within
+       180NM of the aircraft (e.g., the receiver's own location)
+    """
+    latCpr, lonCpr = cpr
+    dLat = 360.0 / (60 - odd)
+    j = math.floor(refLat / dLat) + math.floor(0.5 + ((refLat % dLat) / dLat) - latCpr)
+    lat = dLat * (j + latCpr)
+    ni = cprNL(lat) - odd
+    dLon = (360.0 / ni) if ni > 0 else 360.0
+    m = math.floor(refLon / dLon) + math.floor(0.5 + ((refLon % dLon) / dLon) - lonCpr)
+    lon = dLon * (m + lonCpr)
+    return lat, lon
+
+def cprEncode(lat, lon, odd):
+    """Return the 17-bit (lat, lon) CPR encoding of a position
+    """
+    dLat = 360.0 / (60 - odd)
+    yz = math.floor((CPR_MAX * ((lat % dLat) / dLat)) + 0.5)
+    rLat = dLat * ((yz / CPR_MAX) + math.floor(lat / dLat))
+    ni = cprNL(rLat) - odd
+    dLon = (360.0 / ni) if ni > 0 else 360.0
+    xz = math.floor((CPR_MAX * ((lon % dLon) / dLon)) + 0.5)
+    return (int(yz) & 0x1ffff), (int(xz) & 0x1ffff)
+
+def decodeAltitude12(code):
+    """Decode a 12-bit (DF17 airborne position) altitude field in feet, or None
+       if it's not a 25ft (Q-bit) encoding
+    """
+    if not (code & 0x10):
+        return None
+    n = ((code & 0xfe0) >> 1) | (code & 0xf)
+    return (n * 25) - 1000
+
+def decodeAltitude13(code):
+    """Decode a 13-bit (DF4/DF20) altitude code in feet, or None if it's metric
+       or not a 25ft (Q-bit) encoding
+    """
+    if (code & 0x40) or not (code & 0x10):
+        return None
+    n = ((code & 0x1f80) >> 2) | ((code & 0x20) >> 1) | (code & 0xf)
+    return (n * 25) - 1000
+
+def decodeSquawk(code):
+    """Decode a 13-bit Mode A identity code into a four-digit squawk string
+    """
+    bit = lambda n: (code >> n) & 1
+    a = (bit(7) << 2) | (bit(9) << 1) | bit(11)
+    b = (bit(1) << 2) | (bit(3) << 1) | bit(5)
+    c = (bit(8) << 2) | (bit(10) << 1) | bit(12)
+    d = (bit(0) << 2) | (bit(2) << 1) | bit(4)
+    return f"{a}{b}{c}{d}"
+
+def _crcTable():
+    table = []
+    for n in range(256):
+        crc = n << 16
+        for _ in range(8):
+            crc = ((crc << 1) ^ MODES_CRC_POLY) if (crc & 0x800000) else (crc << 1)
+        table.append(crc & 0xffffff)
+    return table
+
+CRC_TABLE = _crcTable()
+
+def modesChecksum(data):
+    """Return the 24-bit Mode S CRC of the given bytes
+    """
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xffffff) ^ CRC_TABLE[((crc >> 16) ^ b) & 0xff]
+    return crc
+
+
+class ModeSDecoder():
+    """Decode Mode S frames into per-aircraft state dicts (keyed by 'hex')
+
+      Only the fields pocket1090 uses are decoded: DF17/18 identification,
+      airborne position, velocity and emergency status, and DF4/5/20/21
+      altitude and squawk replies.
+    """
+    def __init__(self, refLocation=None, expire=DEF_EXPIRE):
+        self.refLocation = refLocation
+        self.expire = expire
+        self.aircraft = {}
+        self.messages = 0
+        self.positions = 0
+        self.badLines = 0  # malformed SBS lines
+
+    def _getAircraft(self, icao, rxTime):
+        a = self.aircraft.get(icao)
+        if a is None:
+            a = {'hex': icao, '_rssi': deque([], maxlen=RSSI_WINDOW), '_cpr': [None, None]}
+            self.aircraft[icao] = a
+        a['_seen'] = rxTime
+        return a
+
+    def _setPosition(self, a, cpr, odd, rxTime):
+        a['_cpr'][odd] = (cpr, rxTime)
+        other = a['_cpr'][1 - odd]
+        pos = None
+        if other and ((rxTime - other[1]) <= CPR_PAIR_TIMEOUT):
+            pairs = (other[0], cpr) if odd else (cpr, other[0])
+            pos = cprGlobalDecode(pairs[0], pairs[1], odd)
+        if (pos is None) and ('lat' in a) and (a.get('_seenPos', 0) > (rxTime - CPR_PAIR_TIMEOUT)):
+            pos = cprLocalDecode(cpr, odd, a['lat'], a['lon'])
+        if (pos is None) and self.refLocation:
+            pos = cprLocalDecode(cpr, odd, self.refLocation.latitude, self.refLocation.longitude)
+        if pos is None:
+            return
+        a['lat'], a['lon'] = round(pos[0], 6), round(pos[1], 6)
+        a['_seenPos'] = rxTime
+        self.positions += 1
+
+    def _decodeExtendedSquitter(self, a, msg, rxTime):
+        me = int.from_bytes(msg[4:11], "big")
+        tc = me >> 51
+        if 1 <= tc <= 4:
+            a['category'] = f"{IDENT_CATEGORIES[tc]}{(me >> 48) & 0x7}"
+            flight = "".join(CALLSIGN_CHARS[(me >> (42 - (6 * n))) & 0x3f] for n in range(8))
+            a['flight'] = flight.replace("#", "").rstrip()
+        elif (9 <= tc <= 18) or (20 <= tc <= 22):
+            alt = decodeAltitude12((me >> 36) & 0xfff)
+            if tc <= 18:
+                if alt is not None:
+                    a['alt_baro'] = alt
+            elif (me >> 36) & 0xfff:
+                a['alt_geom'] = int(((me >> 36) & 0xfff) * 3.28084)
+            cpr = (((me >> 17) & 0x1ffff) / CPR_MAX, (me & 0x1ffff) / CPR_MAX)
+            self._setPosition(a, cpr, (me >> 34) & 1, rxTime)
+        elif tc == 19:
+            subType = (me >> 48) & 0x7
+            if subType in (1, 2):
+                vEW = (me >> 32) & 0x3ff
+                vNS = (me >> 21) & 0x3ff
+                if vEW and vNS:
+                    scale = 4 if subType == 2 else 1
+                    vx = (vEW - 1) * scale * (-1 if (me >> 42) & 1 else 1)
+                    vy = (vNS - 1) * scale * (-1 if (me >> 31) & 1 else 1)
+                    a['gs'] = round(math.hypot(vx, vy), 1)
+                    a['track'] = round(math.degrees(math.atan2(vx, vy)) % 360.0, 1)
+            vr = (me >> 10) & 0x1ff
+            if vr:
+                rate = (vr - 1) * 64 * (-1 if (me >> 19) & 1 else 1)
+                a['baro_rate' if (me >> 20) & 1 else 'geom_rate'] = rate
+        elif tc == 28:
+            if ((me >> 48) & 0x7) == 1:
+                a['emergency'] = EMERGENCY_STATES[(me >> 45) & 0x7]
+                a['squawk'] = decodeSquawk((me >> 32) & 0x1fff)
+
+    def decode(self, msg, rxTime, signal=None):
+        """Decode a single Mode S frame (7 or 14 bytes) received at the given
+           (Unix epoch) time, with the (optional) Beast signal level (0-255)
+        """
+        df = msg[0] >> 3
+        if df in (17, 18) and (len(msg) == 14):
+            if (df == 18) and ((msg[0] & 0x7) not in (0, 1, 6)):
+                return
+            icao = msg[1:4].hex()
+            if df == 18 and (msg[0] & 0x7) == 1:
+                icao = "~" + icao
+            a = self._getAircraft(icao, rxTime)
+            self._decodeExtendedSquitter(a, msg, rxTime)
+        elif df in (4, 5, 20, 21):
+            # address is only recoverable from the parity, so only update known aircraft
+            icao = "%06x" % (modesChecksum(msg[:-3]) ^ int.from_bytes(msg[-3:], "big"))
+            if icao not in self.aircraft:
+                return
+            a = self._getAircraft(icao, rxTime)
+            code = int.from_bytes(msg[0:4], "big") & 0x1fff
+            if df in (4, 20):
+                alt = decodeAltitude13(code)
+                if alt is not None:
+                    a['alt_baro'] = alt
+            else:
+                a['squawk'] = decodeSquawk(code)
+        else:
+            return
+        if signal:
+            a['_rssi'].append((signal / 255.0) ** 2)
+        self.messages += 1
+
+    def updateSbs(self, fields, rxTime):
+        """Update the aircraft state from a split SBS BaseStation 'MSG' line
+
+          Lines with malformed fields are skipped (and counted in badLines).
+        """
+        if (len(fields) < 22) or (fields[0] != "MSG") or not fields[4]:
+            return
+        try:
+            altitude = int(float(fields[11])) if fields[11] else None
+            speed = float(fields[12]) if fields[12] else None
+            heading = float(fields[13]) if fields[13] else None
+            position = (float(fields[14]), float(fields[15])) if (fields[14] and fields[15]) else None
+            rate = int(float(fields[16])) if fields[16] else None
+        except (ValueError, OverflowError):
+            self.badLines += 1
+            return
+        a = self._getAircraft(fields[4].lower(), rxTime)
+        if fields[10].strip():
+            a['flight'] = fields[10].strip()
+        if altitude is not None:
+            a['alt_baro'] = altitude
+        if speed is not None:
+            a['gs'] = speed
+        if heading is not None:
+            a['track'] = heading
+        if position is not None:
+            a['lat'], a['lon'] = position
+            a['_seenPos'] = rxTime
+            self.positions += 1
+        if rate is not None:
+            a['baro_rate'] = rate
+        if fields[17]:
+            a['squawk'] = fields[17]
+        if fields[19]:
+            a['emergency'] = "none" if fields[19] == "0" else "general"
+        self.messages += 1
+
+    def snapshot(self, now):
+        """Return an aircraft.json-style dict of the current state of all
+           aircraft that have been seen within the expiry interval
+        """
+        aircraft = []
+        for icao, a in list(self.aircraft.items()):
+            seen = now - a['_seen']
+            if seen > self.expire:
+                del self.aircraft[icao]
+                continue
+            info = {k: v for k, v in a.items() if k[0] != "_"}
+            info['seen'] = round(seen, 1)
+            if '_seenPos' in a:
+                info['seen_pos'] = round(now - a['_seenPos'], 1)
+            if a['_rssi']:
+                info['rssi'] = round(10 * math.log10((sum(a['_rssi']) / len(a['_rssi'])) + 1e-5), 1)
+            aircraft.append(info)
+        return {'now': now, 'messages': self.messages, 'aircraft': aircraft}
+
+
+class BeastParser():
+    """Incrementally split a Beast binary byte stream into frames
+    """
+    def __init__(self):
+        self.buf = b""
+
+    def feed(self, data):
+        """Add bytes to the stream and return a list of (type, mlatTimestamp,
+           signal, msg) tuples for all of the complete frames
+        """
+        buf = self.buf + data
+        frames = []
+        pos = 0
+        end = len(buf)
+        while True:
+            start = buf.find(b"\x1a", pos)
+            if (start < 0) or (start + 1 >= end):
+                pos = end if start < 0 else start
+                break
+            msgType = buf[start + 1]
+            msgLen = BEAST_MSG_LENS.get(msgType)
+            if msgLen is None:
+                # escaped 0x1a or garbage, resync on the next escape
+                pos = start + 2 if msgType == BEAST_ESC else start + 1
+                continue
+            need = BEAST_HEADER_LEN + msgLen
+            i = start + 2
+            body = bytearray()
+            while (len(body) < need) and (i < end):
+                b = buf[i]
+                if b == BEAST_ESC:
+                    if i + 1 >= end:
+                        break
+                    if buf[i + 1] != BEAST_ESC:
+                        # unescaped 0x1a inside of a frame, drop the frame
+                        break
+                    i += 1
+                body.append(b)
+                i += 1
+            if len(body) < need:
+                if (i >= end) or ((i + 1 >= end) and (buf[i] == BEAST_ESC)):
+                    pos = start  # incomplete, wait for more data
+                    break
+                pos = i
+                continue
+            frames.append((msgType, int.from_bytes(body[0:6], "big"), body[6], bytes(body[7:])))
+            pos = i
+        self.buf = buf[pos:]
+        return frames
+
+
+def encodeBeast(msg, mlatTimestamp=0, signal=0):
+    """Wrap a raw Mode S (or Mode A/C) frame in a Beast binary frame
+    """
+    msgType = {2: BEAST_MODE_AC, 7: BEAST_MODE_S_SHORT, 14: BEAST_MODE_S_LONG}[len(msg)]
+    body = mlatTimestamp.to_bytes(6, "big") + bytes([signal]) + bytes(msg)
+    return bytes([BEAST_ESC, msgType]) + body.replace(b"\x1a", b"\x1a\x1a")
+
+def _extendedSquitter(icao, me):
+    msg = bytes([(17 << 3) | 5]) + bytes.fromhex(icao) + me.to_bytes(7, "big")
+    return msg + modesChecksum(msg).to_bytes(3, "big")
+
+def encodeIdentification(icao, flight, category="A3"):
+    """Return a DF17 identification frame
+    """
+    tc = {v: k for k, v in IDENT_CATEGORIES.items()}[category[0]]
+    me = (tc << 51) | ((int(category[1]) & 0x7) << 48)
+    for n, ch in enumerate(f"{flight: <8}"[:8]):
+        me |= (CALLSIGN_CHARS.index(ch) if ch in CALLSIGN_CHARS[1:] else 32) << (42 - (6 * n))
+    return _extendedSquitter(icao, me)
+
+def encodeAirbornePosition(icao, lat, lon, altitude, odd):
+    """Return a DF17 airborne position (barometric altitude) frame
+    """
+    n = (int(altitude) + 1000) // 25
+    alt = ((n & 0x7f0) << 1) | 0x10 | (n & 0xf)
+    yz, xz = cprEncode(lat, lon, odd)
+    me = (11 << 51) | (alt << 36) | (odd << 34) | (yz << 17) | xz
+    return _extendedSquitter(icao, me)
+
+def encodeVelocity(icao, speed, heading, rate=0):
+    """Return a DF17 airborne velocity (subsonic ground speed) frame
+    """
+    vx = speed * math.sin(math.radians(heading))
+    vy = speed * math.cos(math.radians(heading))
+    me = (19 << 51) | (1 << 48)
+    me |= ((1 if vx < 0 else 0) << 42) | ((int(round(abs(vx))) + 1) << 32)
+    me |= ((1 if vy < 0 else 0) << 31) | ((int(round(abs(vy))) + 1) << 21)
+    me |= (1 << 20) | ((1 if rate < 0 else 0) << 19) | (((abs(int(rate)) // 64) + 1) << 10)
+    return _extendedSquitter(icao, me)
+
+
+class NetSource(AircraftSource):
+    """Aircraft source that reads a dump1090 Beast or SBS TCP stream
+
+      read() returns a new aircraft.json-style snapshot whenever messages have
+      arrived (at most every minInterval secs, and no later than that even if
+      nothing more arrives), so position updates reach the track pipeline at
+      message rate rather than at dump1090's JSON interval.
+    """
+    def __init__(self, host, port=None, fmt="beast", refLocation=None,
+                 minInterval=0.0, expire=DEF_EXPIRE):
+        if fmt not in ("beast", "sbs"):
+            raise ValueError(f"Invalid network source format: {fmt}")
+        self.host = host
+        self.port = port or (BEAST_PORT if fmt == "beast" else SBS_PORT)
+        self.fmt = fmt
+        self.minInterval = minInterval
+        self.decoder = ModeSDecoder(refLocation, expire)
+        self.beast = BeastParser()
+        self.partialLine = b""
+        self.sock = socket.create_connection((self.host, self.port))
+        self.lastSnapshot = 0
+        self.pending = False  # messages have arrived since the last snapshot
+        logging.info(f"Reading {fmt} messages from {self.host}:{self.port}")
+
+    def _feed(self, data, rxTime):
+        """Decode all of the complete messages in the given bytes
+        """
+        if self.fmt == "beast":
+            for msgType, _, signal, msg in self.beast.feed(data):
+                if msgType in (BEAST_MODE_S_SHORT, BEAST_MODE_S_LONG):
+                    self.decoder.decode(msg, rxTime, signal)
+        else:
+            lines = (self.partialLine + data).split(b"\n")
+            self.partialLine = lines.pop()
+            for line in lines:
+                self.decoder.updateSbs(line.decode("ascii", "replace").rstrip("\r").split(","), rxTime)
+
+    def read(self, timeout=None):
+        deadline = None if timeout is None else (time.monotonic() + timeout)
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self.pending:
+                # don't hold back what's been decoded waiting for more messages
+                due = max(0.0, self.minInterval - (time.time() - self.lastSnapshot))
+                remaining = due if remaining is None else min(remaining, due)
+            ready, _, _ = select.select([self.sock], [], [], remaining)
+            if ready:
+                data = self.sock.recv(READ_SIZE)
+                if not data:
+                    raise EOFError(f"Connection to {self.host}:{self.port} closed")
+                with PROFILER.stage("decode"):
+                    self._feed(data, time.time())
+                self.pending = True
+            now = time.time()
+            if self.pending and ((now - self.lastSnapshot) >= self.minInterval):
+                self.lastSnapshot = now
+                self.pending = False
+                return now, self.decoder.snapshot(now)
+            if (deadline is not None) and (time.monotonic() >= deadline):
+                return None
+
+    def close(self):
+        self.sock.close()
+
+
+class ReplayServer():
+    """Serve a captured Beast or SBS byte stream over TCP (e.g., for testing)
+
+      Every client that connects gets the whole capture, sent in chunks with
+      the given delay between them (0 means as fast as possible). A port of 0
+      picks a free port, which is then available as the 'port' attribute.
+    """
+    def __init__(self, data, host="127.0.0.1", port=0, chunkSize=4096, delay=0.0, loop=False):
+        self.data = data
+        self.chunkSize = chunkSize
+        self.delay = delay
+        self.loop = loop
+
+        replay = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    while True:
+                        for offset in range(0, len(replay.data), replay.chunkSize):
+                            self.request.sendall(replay.data[offset:offset + replay.chunkSize])
+                            if replay.delay:
+                                time.sleep(replay.delay)
+                        if not replay.loop:
+                            break
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
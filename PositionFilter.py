@@ -0,0 +1,191 @@
+################################################################################
+#
+# Position Filter module for pocket1090
+#
+# Constant-velocity Kalman filter of the observer's position and velocity,
+#  fed with GGA fixes (weighted by their HDOP and fix quality) and RMC speed
+#  and course. Each update costs a constant (small) amount of time.
+#
+# The filter works in a local East/North plane (in meters) around a
+#  reference point, which is moved to the current estimate when it gets far
+#  away. Longitude differences are wrapped, so the filter works across the
+#  antimeridian, and the estimates are returned as normalized lat/lon.
+#
+# N.B. The East and North axes are independent (for a constant-velocity model
+#      with isotropic noise), so each is a separate 2-state filter.
+#
+################################################################################
+
+from collections import namedtuple
+import math
+
+
+EARTH_RADIUS = 6371008.8  # meters
+KNOTS_TO_MPS = 1852.0 / 3600.0
+
+DEF_UERE = 5.0              # meters, user equivalent range error (position sigma = HDOP * UERE)
+DEF_ACCEL_NOISE = 1.0       # m/s^2, how hard the observer can change velocity (walking/driving)
+DEF_SPEED_SIGMA = 0.5       # m/s, error of RMC speed over ground
+MIN_COURSE_SPEED = 0.5      # m/s, course isn't meaningful below this speed
+REANCHOR_DISTANCE = 10000.0 # meters from the reference point before it's moved
+
+# sigma multipliers for GGA fix qualities (1: GPS, 2: DGPS, 4: RTK fixed, 5: RTK float, 6: dead reckoning)
+QUALITY_SCALES = {1: 1.0, 2: 0.5, 4: 0.05, 5: 0.2, 6: 5.0}
+
+# lat/lon: degrees, speed: m/s, course: degrees, sigma: meters (1-sigma
+#  horizontal position error), time: of the last update
+Estimate = namedtuple("Estimate", ["lat", "lon", "speed", "course", "sigma", "time"])
+
+
+class _AxisFilter():
+    """Kalman filter of position and velocity along one axis
+    """
+    __slots__ = ('x', 'v', 'pxx', 'pxv', 'pvv')
+
+    def __init__(self, x, variance):
+        self.x = x
+        self.v = 0.0
+        self.pxx = variance
+        self.pxv = 0.0
+        self.pvv = 100.0  # (10 m/s)^2, i.e., unknown velocity
+
+    def predict(self, dt, q):
+        self.x += self.v * dt
+        dt2 = dt * dt
+        pxx = self.pxx + (2 * dt * self.pxv) + (dt2 * self.pvv) + (q * dt2 * dt / 3)
+        pxv = self.pxv + (dt * self.pvv) + (q * dt2 / 2)
+        self.pvv += q * dt
+        self.pxx, self.pxv = pxx, pxv
+
+    def updatePosition(self, z, r):
+        s = self.pxx + r
+        kx, kv = self.pxx / s, self.pxv / s
+        y = z - self.x
+        self.x += kx * y
+        self.v += kv * y
+        self.pvv -= kv * self.pxv
+        self.pxv -= kv * self.pxx
+        self.pxx -= kx * self.pxx
+
+    def updateVelocity(self, z, r):
+        s = self.pvv + r
+        kx, kv = self.pxv / s, self.pvv / s
+        y = z - self.v
+        self.x += kx * y
+        self.v += kv * y
+        self.pxx -= kx * self.pxv
+        self.pxv -= kx * self.pvv
+        self.pvv -= kv * self.pvv
+
+
+class PositionFilter():
+    """Tracks the observer's position and velocity from GPS fixes
+
+      Times are in secs, from any monotonic clock (e.g., time.monotonic()).
+    """
+    def __init__(self, uere=DEF_UERE, accelNoise=DEF_ACCEL_NOISE, speedSigma=DEF_SPEED_SIGMA):
+        self.uere = uere
+        self.q = accelNoise ** 2
+        self.speedSigma = speedSigma
+        self.refLat = None
+        self.refLon = None
+        self.east = None
+        self.north = None
+        self.time = None
+        self.estimate = None
+
+    def _toLocal(self, lat, lon):
+        deltaLon = ((lon - self.refLon + 180.0) % 360.0) - 180.0
+        return (math.radians(deltaLon) * EARTH_RADIUS * self.cosRefLat,
+                math.radians(lat - self.refLat) * EARTH_RADIUS)
+
+    def _toLatLon(self, east, north):
+        lat = self.refLat + math.degrees(north / EARTH_RADIUS)
+        lon = self.refLon + math.degrees(east / (EARTH_RADIUS * self.cosRefLat))
+        return lat, ((lon + 180.0) % 360.0) - 180.0
+
+    def _setReference(self, lat, lon):
+        self.refLat, self.refLon = lat, lon
+        self.cosRefLat = max(math.cos(math.radians(lat)), 1e-6)
+
+    def _predict(self, t):
+        dt = t - self.time
+        if dt > 0:
+            self.east.predict(dt, self.q)
+            self.north.predict(dt, self.q)
+            self.time = t
+
+    def _publish(self):
+        if (abs(self.east.x) > REANCHOR_DISTANCE) or (abs(self.north.x) > REANCHOR_DISTANCE):
+            lat, lon = self._toLatLon(self.east.x, self.north.x)
+            self._setReference(lat, lon)
+            self.east.x = self.north.x = 0.0
+        lat, lon = self._toLatLon(self.east.x, self.north.x)
+        speed = math.hypot(self.east.v, self.north.v)
+        course = (math.degrees(math.atan2(self.east.v, self.north.v)) + 360.0) % 360.0
+        sigma = math.sqrt(self.east.pxx + self.north.pxx)
+        self.estimate = Estimate(lat, lon, speed, course, sigma, self.time)
+
+    def positionSigma(self, hdop=None, quality=1):
+        """Return the (1-sigma) error in meters of a fix with the given HDOP
+           and fix quality
+        """
+        return (self.uere * (hdop if hdop else 1.0)) * QUALITY_SCALES.get(quality, 1.0)
+
+    def updatePosition(self, t, lat, lon, hdop=None, quality=1):
+        """Add a position fix (e.g., from a GGA sentence) and return the new
+           Estimate
+        """
+        r = self.positionSigma(hdop, quality) ** 2
+        if self.estimate is None:
+            self._setReference(lat, lon)
+            self.east, self.north = _AxisFilter(0.0, r), _AxisFilter(0.0, r)
+            self.time = t
+        else:
+            self._predict(t)
+            east, north = self._toLocal(lat, lon)
+            self.east.updatePosition(east, r)
+            self.north.updatePosition(north, r)
+        self._publish()
+        return self.estimate
+
+    def updateVelocity(self, t, speed, course):
+        """Add a velocity measurement (e.g., RMC speed over ground in knots and
+           course in degrees) and return the new Estimate
+
+          N.B. Ignored until there's been a position fix, and the course is
+               ignored when the speed is too low for it to mean anything.
+        """
+        if self.estimate is None:
+            return None
+        mps = speed * KNOTS_TO_MPS
+        r = self.speedSigma ** 2
+        if mps < MIN_COURSE_SPEED:
+            # too slow for the course to mean anything, so just pull the velocity towards zero
+            ve, vn = 0.0, 0.0
+            r += mps ** 2
+        elif course is None:
+            return self.estimate
+        else:
+            c = math.radians(course)
+            ve, vn = mps * math.sin(c), mps * math.cos(c)
+        self._predict(t)
+        self.east.updateVelocity(ve, r)
+        self.north.updateVelocity(vn, r)
+        self._publish()
+        return self.estimate
+
+    def predict(self, t):
+        """Return the (lat, lon) of the estimate extrapolated to the given time
+           (without changing the filter), or None if there isn't one
+        """
+        estimate = self.estimate
+        if estimate is None:
+            return None
+        dt = max(0.0, t - estimate.time)
+        c = math.radians(estimate.course)
+        dNorth = estimate.speed * dt * math.cos(c)
+        dEast = estimate.speed * dt * math.sin(c)
+        lat = estimate.lat + math.degrees(dNorth / EARTH_RADIUS)
+        lon = estimate.lon + math.degrees(dEast / (EARTH_RADIUS * max(math.cos(math.radians(estimate.lat)), 1e-6)))
+        return lat, ((lon + 180.0) % 360.0) - 180.0
@@ -0,0 +1,192 @@
+################################################################################
+#
+# Profiler module for pocket1090
+#
+# Lightweight timers for the stages of the ingestion and render pipelines
+#  (e.g., parse, diff, geodesy, sort, symbols, flip), each of which keeps a
+#  rolling histogram of its recent durations along with running totals.
+#
+# Usage:
+#   from Profiler import PROFILER
+#   with PROFILER.stage("parse"):
+#       ...
+#
+# When the profiler is disabled (the default), stage() returns a shared no-op
+#  context manager, so the instrumentation costs about one method call.
+#
+# The stats can be reported as lines of text (for the INFO panel), or dumped
+#  as JSON or in the Prometheus text exposition format.
+#
+################################################################################
+
+from bisect import bisect_left
+from collections import deque
+import json
+import time
+
+
+# upper bounds (in secs) of the histogram buckets, there's also an implicit +Inf one
+DEF_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+DEF_WINDOW = 300  # number of recent samples kept per stage
+
+PROMETHEUS_NAME = "pocket1090_stage_seconds"
+
+
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+
+class _StageTimer():
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.add(time.perf_counter() - self.start)
+        return False
+
+
+class StageHistogram():
+    """Durations of one stage: bucket counts and percentiles over a rolling
+       window of recent samples, plus running totals since the start
+    """
+    def __init__(self, buckets=DEF_BUCKETS, window=DEF_WINDOW):
+        self.buckets = buckets
+        self.samples = deque([], maxlen=window)
+        self.windowCounts = [0] * (len(buckets) + 1)
+        self.totalCounts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, secs):
+        if len(self.samples) == self.samples.maxlen:
+            self.windowCounts[bisect_left(self.buckets, self.samples[0])] -= 1
+        self.samples.append(secs)
+        indx = bisect_left(self.buckets, secs)
+        self.windowCounts[indx] += 1
+        self.totalCounts[indx] += 1
+        self.count += 1
+        self.sum += secs
+
+    def percentile(self, pct):
+        """Return the given percentile (0-100) of the recent samples (in secs),
+           or None if there aren't any
+        """
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(round((pct / 100.0) * (len(samples) - 1))))]
+
+    def summary(self):
+        """Return a dict of the stats of the recent samples and the totals
+        """
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        return {'count': self.count,
+                'sum': self.sum,
+                'window': len(self.samples),
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': max(self.samples) if self.samples else None,
+                'buckets': dict(zip(bounds, self.windowCounts))}
+
+
+class Profiler():
+    """Named stage timers, each with a rolling histogram
+
+      N.B. Each stage should only be timed from one thread at a time, but
+           different stages can be timed from different threads.
+    """
+    def __init__(self, enabled=False, buckets=DEF_BUCKETS, window=DEF_WINDOW):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.window = window
+        self.stages = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def _histogram(self, name):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages.setdefault(name, StageHistogram(self.buckets, self.window))
+        return histogram
+
+    def stage(self, name):
+        """Return a context manager that times the enclosed code as the named
+           stage (or does nothing if the profiler is disabled)
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return _StageTimer(self._histogram(name))
+
+    def record(self, name, secs):
+        """Add an externally measured duration (in secs) to the named stage
+        """
+        if self.enabled:
+            self._histogram(name).add(secs)
+
+    def reset(self):
+        self.stages = {}
+
+    def summary(self):
+        """Return a dict of the summaries of all of the stages
+        """
+        return {name: histogram.summary() for name, histogram in list(self.stages.items())}
+
+    def reportLines(self):
+        """Return a list of lines of text with the recent p50/p99/max times
+           (in msecs) of each stage
+        """
+        lines = []
+        for name, s in self.summary().items():
+            if s['window']:
+                lines.append(f"{name: <10} p50={s['p50'] * 1000:7.2f} p99={s['p99'] * 1000:7.2f} max={s['max'] * 1000:7.2f} msec")
+        return lines
+
+    def toJson(self):
+        return json.dumps(self.summary(), indent=4, sort_keys=True)
+
+    def toPrometheus(self):
+        """Return the stats in the Prometheus text exposition format: running
+           totals as a histogram, and the recent percentiles as gauges
+        """
+        lines = [f"# HELP {PROMETHEUS_NAME} Time spent in each pipeline stage",
+                 f"# TYPE {PROMETHEUS_NAME} histogram"]
+        stages = list(self.stages.items())
+        for name, histogram in stages:
+            cumulative = 0
+            for bound, count in zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.totalCounts):
+                cumulative += count
+                lines.append(f'{PROMETHEUS_NAME}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PROMETHEUS_NAME}_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'{PROMETHEUS_NAME}_count{{stage="{name}"}} {histogram.count}')
+        lines += [f"# HELP {PROMETHEUS_NAME}_recent Recent percentiles of the time spent in each pipeline stage",
+                  f"# TYPE {PROMETHEUS_NAME}_recent gauge"]
+        for name, histogram in stages:
+            for pct in (50, 99):
+                value = histogram.percentile(pct)
+                if value is not None:
+                    lines.append(f'{PROMETHEUS_NAME}_recent{{stage="{name}",quantile="{pct / 100}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, basePath):
+        """Write the stats to '<basePath>.json' and '<basePath>.prom'
+        """
+        with open(f"{basePath}.json", "w") as f:
+            f.write(self.toJson())
+        with open(f"{basePath}.prom", "w") as f:
+            f.write(self.toPrometheus())
+
+
+PROFILER = Profiler()
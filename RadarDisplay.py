@@ -2,23 +2,32 @@
 #
 # Display module for pocket1090
 #
+# In headless mode, the display is rendered into an offscreen surface (with no
+#  window or event handler thread), and every frame is handed to the frame
+#  sinks (e.g., from FrameExport), if any.
+#
 ################################################################################
 
-from collections import namedtuple
+from collections import deque, namedtuple
 from dataclasses import astuple
 from datetime import datetime
 import logging
-from math import dist, floor
+from math import floor
 import os
 import threading
 import time
 
+import numpy as np
 import pygame
 from pygame.locals import *
 import pygame_widgets
 from pygame_widgets.button import Button
 from tabulate import tabulate
 
+from Profiler import PROFILER
+from SpatialGrid import SpatialGrid, placeLabels
+from SymbolAtlas import DEF_ATLAS_RESOLUTION, SymbolAtlas
+from TextCache import DEF_TEXT_CACHE_SIZE, TextCache
 from TrackStats import TrackStats
 from __init__ import * #### FIXME
 
@@ -32,12 +41,14 @@ DEF_RANGE_RING_COLOR = (128, 128, 0)
 DEF_VECTOR_COLOR = (0, 240, 0)
 DEF_TRAIL_COLOR = (128, 128, 128)
 DEF_SELF_COLOR = (255, 0, 0)
+DEF_COVERAGE_COLOR = (0, 48, 72)
 DEF_COLORS = {
     'bgColor': DEF_BACKGROUND_COLOR,
     'ringColor': DEF_RANGE_RING_COLOR,
     'vectorColor': DEF_VECTOR_COLOR,
     'trailColor': DEF_TRAIL_COLOR,
-    'selfColor': DEF_SELF_COLOR
+    'selfColor': DEF_SELF_COLOR,
+    'coverageColor': DEF_COVERAGE_COLOR
 }
 DEF_SYMBOL_FONT_COLOR = (0, 240, 0)
 DEF_RING_FONT_COLOR = (192, 0, 192)
@@ -53,7 +64,11 @@ ALL_CATEGORIES = (f"{letter}{number}" for letter in ("A", "B", "C", "D", "E") fo
 TRACKED_CATEGORIES = (*ALL_CATEGORIES, "?")
 ROTATE_SYMBOL = ("A1", "A2", "A3", "A4", "A5", "A6")
 DEF_MAX_DISTANCE = 64
+SELECT_DISTANCE = 10  # max pixels from a symbol to select its track
+LABEL_GAP = 7  # pixels between a symbol's position and the side of its labels, when they're beside it
+FRAME_STATS_LEN = 100  # number of frames that frame time stats are kept for
 RING_DIVISORS = (8, 4, 2, 1.333333, 1)
+COVERAGE_REDRAW_INTERVAL = 10.0  # min secs between redraws of the coverage overlay (it redraws the whole static layer)
 
 INFO_MODE    = 0
 SUMMARY_MODE = 1
@@ -67,7 +82,9 @@ BUTTON_HOVER_COLOR = (192, 192, 192)
 class RadarDisplay():
     def __init__(self, assetsPath, windowSize=DEF_WINDOW_SIZE, maxDistance=DEF_MAX_DISTANCE,
                  diameter=DEF_DISPLAY_DIAMETER, colors=DEF_COLORS, fontInfo=DEF_FONT_INFO,
-                 fullScreen=False, verbose=False):
+                 fullScreen=False, dirtyRects=True, textCacheSize=DEF_TEXT_CACHE_SIZE,
+                 symbolResolution=DEF_ATLAS_RESOLUTION, declutter=True, headless=False, frameSinks=(),
+                 pacer=None, stats=None, coverage=None, verbose=False):
         self.assetsPath = assetsPath
         if not os.path.exists(assetsPath):
             logging.error(f"Invalid path to assets directory: {assetsPath}")
@@ -82,11 +99,18 @@ class RadarDisplay():
         self.vectorColor = colors['vectorColor']
         self.trailColor = colors['trailColor']
         self.selfColor = colors['selfColor']
+        self.coverageColor = colors['coverageColor']
         self.symbolFontInfo = fontInfo['symbolFont']
         self.ringFontInfo = fontInfo['ringFont']
         self.summaryFontInfo = fontInfo['summaryFont']
         self.infoFontInfo = fontInfo['infoFont']
         self.fullScreen = fullScreen
+        self.dirtyRects = dirtyRects
+        self.declutter = declutter
+        self.headless = headless
+        self.frameSinks = list(frameSinks)
+        self.frames = 0
+        self.pacer = pacer
         self.verbose = verbose
 
         self.center = Coordinate(floor(diameter / 2), floor(diameter / 2))
@@ -99,6 +123,9 @@ class RadarDisplay():
 
         self.tz = time.tzname[time.daylight]
 
+        if headless:
+            # the widgets still need a video system, but not a real display
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
         pygame.display.init()
         if self.verbose:
             print(f"\nDisplay: \n{pygame.display.Info()}\n{pygame.display.get_driver()} {pygame.display.list_modes()}\n")
@@ -121,23 +148,46 @@ class RadarDisplay():
         self.summaryFontColor = self.summaryFontInfo[2]
         self.infoFont = pygame.font.SysFont(self.infoFontInfo[0], self.infoFontInfo[1])
         self.infoFontColor = self.infoFontInfo[2]
+        self.textCache = TextCache(textCacheSize)
+        self.atlas = SymbolAtlas(symbolResolution)
 
         flags = DOUBLEBUF
         if fullScreen:
             flags |= FULLSCREEN
-        self.screen = pygame.display.set_mode(self.windowSize, flags)
+        if headless:
+            self.screen = pygame.Surface(self.windowSize)
+        else:
+            self.screen = pygame.display.set_mode(self.windowSize, flags)
         if False:
             print(f"Screen Size: {self.screen.get_size()}")
         self.radarSurface = pygame.Surface((self.diameter, self.diameter))
+        self.staticLayer = pygame.Surface((self.diameter, self.diameter))
+        self.staticKey = None
+        self.trackRects = {}
+        self.countRect = None
+        self.panelLines = None
+        self.frameTimes = deque([], maxlen=FRAME_STATS_LEN)
+        self.frameCpuTimes = deque([], maxlen=FRAME_STATS_LEN)
         pygame.display.set_caption('Radar Display')
         self.rangeRings = pygame.Surface((self.diameter, self.diameter))
         self.autoRange = True
 
-        self.trackPositions = []
-        self.stats = TrackStats()
+        self.trackGrid = SpatialGrid()
+        self.labelKey = None
+        self.outOfRange = set()  # uniqueIds of the tracks beyond the range (to only log them once)
+        self.labelPlacements = {}
+        self.summaryKey = None
+        self.summaryLines = []
+        # updated by whoever updates the tracks
+        self.stats = TrackStats() if stats is None else stats
+        self.coverage = coverage  # CoverageMap, or None
+        self.showCoverage = coverage is not None
+        self.coverageVersion = None
+        self.coverageDrawn = 0.0
 
         self.lock = threading.Lock()
 
+        self.maxDistance = None
         self._setMaxDistance(maxDistance)
         self._createSelfSymbol()
         self._createSymbols()
@@ -148,17 +198,22 @@ class RadarDisplay():
         self.startTime = datetime.utcnow()
 
         self.running = True
-        threading.Thread(target=self._eventHandler, args=(), daemon=True).start()
+        if not headless:
+            threading.Thread(target=self._eventHandler, args=(), daemon=True).start()
 
     def _setMaxDistance(self, maxDistance):
         """ #### TODO
           force maxDistance to the next higher power of two, clips min distance at 1Km, no upper limit
-          also sets ring distances and recreates/labels the range rings
+          also sets ring distances and recreates/labels the range rings (unless
+          the range is unchanged)
           N.B. Distances are in Km
         """
         prepDist = lambda d: int(d) if d >= 2 else round(d, 2)
         maxD = maxDistance if maxDistance >= 1 else 1
-        self.maxDistance = 1 << int(maxD).bit_length()
+        newMax = 1 << int(maxD).bit_length()
+        if newMax == self.maxDistance:
+            return
+        self.maxDistance = newMax
         self.ringDistances = [prepDist(self.maxDistance / d) for d in RING_DIVISORS]
         self._createRangeRings()
 
@@ -335,10 +390,10 @@ class RadarDisplay():
         symbols = {}
         for cat in TRACKED_CATEGORIES:
             if cat == "?":
-                s.fill(self.bgColor)
-                s.set_colorkey(self.bgColor)
                 diameter = 9
                 s = pygame.Surface((diameter, diameter))
+                s.fill(self.bgColor)
+                s.set_colorkey(self.bgColor)
                 d = floor(diameter / 2)
                 pygame.draw.circle(s, (0, 148, 255), (d, d), d)
                 symbols[cat] = s
@@ -369,13 +424,77 @@ class RadarDisplay():
             surface.blit(img, (0,0))
             symbols[cat] = surface
         self.symbols = symbols
-
-    def _renderSymbol(self, track, selfLocation, trail=0):
-        """Render the named symbol at the given coordinate, with the appropriately sized speed and heading vector
+        for cat, symbol in symbols.items():
+            self.atlas.add(cat, symbol, lazy=(cat not in ROTATE_SYMBOL))
+
+    def _symbolKey(self, track, distance, azimuth):
+        """Return the (whole pixel) screen position of a track's symbol (at the
+           given distance and azimuth) and a key of everything that affects how
+           it's drawn, or (None, None) if it's out of range
+          N.B. The symbol is drawn at exactly the position that's in its key, so
+               a symbol that's skipped because its key didn't change is the
+               same as the one a full redraw would draw
+        """
+        if distance > self.maxDistance:
+            if track.uniqueId not in self.outOfRange:
+                self.outOfRange.add(track.uniqueId)
+                logging.info(f"Track '{track.flightNumber}' out of range: {distance}")
+            return None, None
+        x, y = self._calcPixelAddr(distance, azimuth)
+        trackPosition = (round(x), round(y))
+        key = (trackPosition, track.heading, track.speed, track.flightNumber, track.altitude,
+               track.category, self.trails, len(track.history))
+        return trackPosition, key
+
+    def _symbolRect(self, track, trackPosition):
+        """Return the (approximate) rectangle covered by a track's symbol,
+           whatever its rotation
+        """
+        s = self.symbols[track.category]
+        size = max(s.get_width(), s.get_height())
+        return ((trackPosition[0] - (size // 2)), (trackPosition[1] - (size // 2)), size, size)
+
+    def _labels(self, track, trackPosition):
+        """Return the rendered flight number and altitude labels of a track, and
+           a list of the placements of them (i.e., their (left, top, width,
+           height) rectangles), in order of preference: above/below, right of,
+           and left of the symbol
+        """
+        flightText = self.textCache.render(self.symbolFont, f"{track.flightNumber}", self.symbolFontColor, self.bgColor, True)
+        altText = self.textCache.render(self.symbolFont, f"{track.altitude}", self.symbolFontColor, self.bgColor, True)
+        x, y = trackPosition
+        fw, fh = flightText.get_size()
+        aw, ah = altText.get_size()
+        placements = (((x - (fw // 2)), (y - 5 - fh), fw, fh), ((x - (aw // 2)), (y + 7), aw, ah)), \
+                     (((x + LABEL_GAP), (y - fh), fw, fh), ((x + LABEL_GAP), y, aw, ah)), \
+                     (((x - LABEL_GAP - fw), (y - fh), fw, fh), ((x - LABEL_GAP - aw), y, aw, ah))
+        return (flightText, altText), placements
+
+    def _placeLabels(self, symbols):
+        """Return a dict of the index of the placement of each track's labels
+           (or None if they're hidden) such that they don't overlap other
+           labels or symbols, giving priority to the selected track and then
+           the nearest ones
+        """
+        key = ([key for _, _, key in symbols], self.farthest, self.selectedTrack)
+        if key == self.labelKey:
+            return self.labelPlacements
+        order = list(reversed(symbols)) if self.farthest else list(symbols)
+        if self.selectedTrack:
+            order.sort(key=lambda s: s[0] is not self.selectedTrack)
+        self.labelKey = key
+        self.labelPlacements = placeLabels([(track.uniqueId, self._labels(track, pos)[1]) for track, pos, _ in order],
+                           [(self._symbolRect(track, pos), track.uniqueId) for track, pos, _ in symbols])
+        return self.labelPlacements
+
+    def _renderSymbol(self, track, trackPosition, placement=0):
+        """Render the track's symbol at the given (whole pixel) coordinate, with the appropriately sized speed and heading vector
           If symbolName is None, then use the unknown symbol
           If speed is None, use a min-length vector
           If heading is None, don't add a vector
-          Add flightNumber and altitude as text next to the symbol
+          Add flightNumber and altitude as text next to the symbol, at the given
+          placement (see _labels()), or not at all if it's None
+          Return the rectangle (on the radar surface) that was drawn on
         """
         #### FIXME make symbols overwrite tracks (aot the converse, which is happening now)
         #### FIXME improve handling of interesting things -- log altitude/speed (above/below thresholds), emergencies, special categories
@@ -385,14 +504,11 @@ class RadarDisplay():
         #### TODO add symbols for all categories -- i.e., [A-D][0-7]
         #### TODO age symbols by changing alpha value with seen times ?
         #### TODO update README -- document inputs, document symbols, get screenshot at different ranges (with interesting traffic)
-        if track.distance > self.maxDistance:
-            logging.info(f"Track '{track.flightNumber}' out of range: {track.distance}")
-            return
-        trackPosition = self._calcPixelAddr(track.distance, track.azimuth)
-
-        for trailLocation, trailDistance, trailAzimuth in track.getHistory(self.trails):
+        rects = []
+        trailDistances, trailAzimuths = track.getHistory(self.trails)
+        for trailDistance, trailAzimuth in zip(trailDistances.tolist(), trailAzimuths.tolist()):
             x, y = self._calcPixelAddr(trailDistance, trailAzimuth)
-            pygame.draw.rect(self.radarSurface, self.trailColor, Rect((x - 1), (y - 1), 3, 3))
+            rects.append(pygame.draw.rect(self.radarSurface, self.trailColor, Rect((round(x) - 1), (round(y) - 1), 3, 3)))
 
         angle = 0
         if track.heading:
@@ -400,26 +516,18 @@ class RadarDisplay():
             length = (5 + (track.speed / 10))
             angle = ((track.heading + 270) % 360)
             endPt = pygame.math.Vector2(startPt + pygame.math.Vector2(length, 0).rotate(angle))
-            pygame.draw.line(self.radarSurface, self.vectorColor, startPt, endPt, 1)
-
-        text = self.symbolFont.render(f"{track.flightNumber}", True, self.symbolFontColor, self.bgColor)
-        text.set_colorkey(self.bgColor)
-        textRect = text.get_rect()
-        textRect.midbottom = (trackPosition[0], (trackPosition[1] - 5))
-        self.radarSurface.blit(text, textRect)
-
-        text = self.symbolFont.render(f"{track.altitude}", True, self.symbolFontColor, self.bgColor)
-        text.set_colorkey(self.bgColor)
-        textRect = text.get_rect()
-        textRect.midtop = (trackPosition[0], (trackPosition[1] + 7))
-        self.radarSurface.blit(text, textRect)
-
-        symbol = self.symbols[track.category]
-        newAngle = -(angle + 90.0) if angle <= 270.0 else -(angle - 270.0)
-        s = pygame.transform.rotate(symbol, newAngle) if track.category in ROTATE_SYMBOL else symbol
-        self.radarSurface.blit(s, ((trackPosition[0] - floor(s.get_width() / 2)),
-                                   (trackPosition[1] - floor(s.get_height() / 2))))
-        return trackPosition
+            rects.append(pygame.draw.line(self.radarSurface, self.vectorColor, startPt, endPt, 1))
+
+        if placement is not None:
+            texts, placements = self._labels(track, trackPosition)
+            for text, textRect in zip(texts, placements[placement]):
+                rects.append(self.radarSurface.blit(text, textRect[:2]))
+
+        rotation = (angle + 90.0) if angle <= 270.0 else (angle - 270.0)
+        s = self.atlas.get(track.category, rotation if track.category in ROTATE_SYMBOL else None)
+        rects.append(self.radarSurface.blit(s, ((trackPosition[0] - floor(s.get_width() / 2)),
+                                                (trackPosition[1] - floor(s.get_height() / 2)))))
+        return rects[0].unionall(rects[1:])
 
     def _createSelfSymbol(self):
         """Draw the device symbol onto the selfSymbol surface
@@ -441,13 +549,11 @@ class RadarDisplay():
             pygame.draw.line(selfSymbol, self.selfColor, (delta, 0), ((0.5 * delta), (0.5 * delta)))
             pygame.draw.line(selfSymbol, self.selfColor, (delta, 0), ((1.5 * delta), (0.5 * delta)))
         self.selfSymbol = selfSymbol
+        self.atlas.add("self", selfSymbol)
 
     def _renderSelfSymbol(self, rotation):
-        if rotation is None:
-            s = self.selfSymbol
-        else:
-            s = pygame.transform.rotate(self.selfSymbol, -rotation)
-        self.radarSurface.blit(s, ((self.center.x - floor(s.get_width() / 2)),
+        s = self.atlas.get("self", rotation)
+        self.staticLayer.blit(s, ((self.center.x - floor(s.get_width() / 2)),
                                    (self.center.y - floor(s.get_height() / 2))))
 
     def _createRangeRings(self):
@@ -468,49 +574,60 @@ class RadarDisplay():
             self.rangeRings.blit(text, textRect)
 
     def _renderRangeRings(self):
-        """Render the range rings onto the display surface
+        """Render the range rings onto the static layer
           #### TODO
         """
-        self.radarSurface.blit(self.rangeRings, ((self.center.x - floor(self.rangeRings.get_width() / 2)),
+        self.staticLayer.blit(self.rangeRings, ((self.center.x - floor(self.rangeRings.get_width() / 2)),
                                                  (self.center.y - floor(self.rangeRings.get_height() / 2))))
 
+    def _coverageKey(self):
+        """Return the version of the coverage map to draw in the overlay (or
+          None if it's hidden), which only changes every
+          COVERAGE_REDRAW_INTERVAL secs at most
+        """
+        if (self.coverage is None) or not self.showCoverage:
+            return None
+        now = time.monotonic()
+        if (self.coverage.version != self.coverageVersion) and ((now - self.coverageDrawn) >= COVERAGE_REDRAW_INTERVAL):
+            self.coverageVersion = self.coverage.version
+            self.coverageDrawn = now
+        return self.coverageVersion
+
+    def _renderCoverage(self):
+        """Render the coverage map's max range in each azimuth bin (over all
+          altitudes) onto the static layer, as a filled polygon
+        """
+        ranges = np.minimum(self.coverage.ranges(), self.maxDistance * 2.0)
+        pxPerKm = (self.diameter / 2.0) / self.maxDistance
+        azimuths = np.radians(self.coverage.azimuths())
+        xs = self.center.x + (ranges * pxPerKm * np.sin(azimuths))
+        ys = self.center.y - (ranges * pxPerKm * np.cos(azimuths))
+        pygame.draw.polygon(self.staticLayer, self.coverageColor, list(zip(xs.tolist(), ys.tolist())))
+
     def _initScreen(self, rotation):
-        """Clear the screen and draw the static elements (i.e., range rings and self symbol)
-          #### TODO
+        """Redraw the static layer (i.e., background, coverage overlay, range
+          rings and self symbol) if the range, rotation, or coverage have
+          changed since it was last drawn, and return True if it was redrawn
         """
-        self.radarSurface.fill(self.bgColor)
+        coverageKey = self._coverageKey()
+        key = (self.maxDistance, None if rotation is None else self.atlas.quantize(rotation), coverageKey)
+        if key == self.staticKey:
+            return False
+        self.staticKey = key
+        self.staticLayer.fill(self.bgColor)
+        if coverageKey is not None:
+            self._renderCoverage()
         self._renderRangeRings()
         self._renderSelfSymbol(rotation)
+        return True
 
     def _getSelectedTrack(self, location):
-        """ #### TODO
-          assume always have small number of tracks so don't have to worry about performance
+        """Return the track whose symbol is nearest to the given screen location
+           (within a few pixels), or None
         """
         if (location[1] > self.diameter):
             return None
-        minDist = 10
-        nearestTrack = None
-        if self.trackPositions:
-            for position, track in self.trackPositions:
-                if not isinstance(position, tuple):
-                    logging.warning("No position in track")
-                    continue
-                if not isinstance(location, tuple):
-                    logging.warning("No location in track")
-                    continue
-                d = dist(location, position)
-                if d < minDist:
-                    minDist = d
-                    nearestTrack = track
-        return nearestTrack
-        '''
-        ? = []
-        tree = spatial.KDTree(?)
-        nearestTrack = tree.query([location])
-        print("TTTT", nearestTrack)
-        if nearestTrack?:
-            return nearestTrack
-        '''
+        return self.trackGrid.nearest(location[0], location[1], SELECT_DISTANCE)
 
     def getRange(self):
         """Return the current max distance (in Km)
@@ -549,76 +666,138 @@ class RadarDisplay():
         """
         self.autoRange = True
 
-    def render(self, orientation, selfLocation, currentTime, tracks):
+    def render(self, orientation, selfLocation, currentTime, tracks, positions=None):
         """Render the screen with the given orientation and location
-          #### TODO
+          If given, positions is a tuple of arrays (indexed by slot) of the
+          distances and azimuths to draw the tracks' symbols at (e.g., from
+          TrackTable.predict()), otherwise their last reported ones are used
         """
+        frameStart = time.perf_counter()
+        frameCpuStart = time.process_time()
         #### FIXME allow the Mode displays to work even when there's no tracks
-        if len(tracks) < 1:
-            sortedTracks = []
-            maxDist = DEF_MAX_DISTANCE
-        else:
-            sortedTracks = sorted(tracks.values(), key=lambda t: t.distance, reverse=self.farthest)
-            if self.autoRange:
-                indx = 0 if self.farthest else -1
-                maxDist = sortedTracks[indx].distance
-                logging.info(f"Max Track (Ring) Distance: {maxDist:.2f} ({self.maxDistance}) Km")
-                with self.lock:
-                    self._setMaxDistance(maxDist)
-
-        self._initScreen(orientation[0])
+        with PROFILER.stage("sort"):
+            if len(tracks) < 1:
+                sortedTracks = []
+                maxDist = DEF_MAX_DISTANCE
+            else:
+                sortedTracks = tracks.sortedTracks('distance', reverse=self.farthest)
+                if self.autoRange:
+                    maxDist = float(np.max(tracks.column('distance')))
+                    prevDistance = self.maxDistance
+                    with self.lock:
+                        self._setMaxDistance(maxDist)
+                    if self.maxDistance != prevDistance:
+                        logging.info(f"Max Track (Ring) Distance: {maxDist:.2f} ({self.maxDistance}) Km")
+
+        with PROFILER.stage("static"):
+            fullRedraw = self._initScreen(orientation[0]) or not self.dirtyRects
+        dirtyRects = []
+        if fullRedraw:
+            self.radarSurface.blit(self.staticLayer, (0, 0))
+            self.trackRects = {}
+            self.countRect = None
+            self.panelLines = None
+            dirtyRects.append(self.radarSurface.get_rect())
 
         if self.verbose >= 2:
             #### FIXME
             print("flight      alt.  speed   dir.  rate  rate  dist.   azi.  cat.")
             print("--------  ------  -----  -----  -----  -----  ----")
-        table = []
-        self.trackPositions = []
-        for track in sortedTracks:
-            alt = track.altitude if isinstance(track.altitude, int) else " "
-            speed = round(track.speed, 0) if isinstance(track.speed, float) else " "
-            heading = round(track.heading, 1) if isinstance(track.heading, float) else " "
-            geomRate = track.geomRate if isinstance(track.geomRate, int) else " "
-            baroRate = track.baroRate if isinstance(track.baroRate, int) else " "
-            if isinstance(geomRate, int):
-                rate = geomRate
-            elif isinstance(baroRate, int):
-                rate = baroRate
-            else:
-                rate = " "
-            table.append([track.flightNumber, alt, speed, rate, round(track.distance, 2), round(track.azimuth, 1), track.category, track.rssi])
-            if self.verbose >= 2:
-                alt = f"{track.altitude: >6}" if isinstance(track.altitude, int) else "      "
-                speed = f"{track.speed:5.1f}" if isinstance(track.speed, float) else "     "
-                heading = f"{track.heading:5.1f}" if isinstance(track.heading, float) else "     "
-                geomRate = f"{track.geomRate: >5}" if isinstance(track.geomRate, int) else "     "
-                baroRate = f"{track.baroRate: >5}" if isinstance(track.baroRate, int) else "     "
-                print(f"{track.flightNumber: <8}, {alt}, {speed}, {heading}, {geomRate}, {baroRate}, {track.distance:5.1f}, {track.azimuth:5.1f},  {track.category: >2}")
+        with PROFILER.stage("tracks"):
+            # the summary table only changes when the tracks do (not with their
+            #  predicted positions), so it's only rebuilt then
+            summaryKey = (tracks, tracks.version, self.farthest)
+            table = [] if (self.infoMode == SUMMARY_MODE) and (summaryKey != self.summaryKey) else None
+            trackGrid = SpatialGrid()
+            symbols = []
+            for track in sortedTracks:
+                if table is not None:
+                    alt = track.altitude if isinstance(track.altitude, int) else " "
+                    speed = round(track.speed, 0) if isinstance(track.speed, float) else " "
+                    geomRate = track.geomRate if isinstance(track.geomRate, int) else " "
+                    baroRate = track.baroRate if isinstance(track.baroRate, int) else " "
+                    if isinstance(geomRate, int):
+                        rate = geomRate
+                    elif isinstance(baroRate, int):
+                        rate = baroRate
+                    else:
+                        rate = " "
+                    table.append([track.flightNumber, alt, speed, rate, round(track.distance, 2), round(track.azimuth, 1), track.category, track.rssi])
+                if self.verbose >= 2:
+                    alt = f"{track.altitude: >6}" if isinstance(track.altitude, int) else "      "
+                    speed = f"{track.speed:5.1f}" if isinstance(track.speed, float) else "     "
+                    heading = f"{track.heading:5.1f}" if isinstance(track.heading, float) else "     "
+                    geomRate = f"{track.geomRate: >5}" if isinstance(track.geomRate, int) else "     "
+                    baroRate = f"{track.baroRate: >5}" if isinstance(track.baroRate, int) else "     "
+                    print(f"{track.flightNumber: <8}, {alt}, {speed}, {heading}, {geomRate}, {baroRate}, {track.distance:5.1f}, {track.azimuth:5.1f},  {track.category: >2}")
+                if self.verbose >= 2:
+                    print(track)
+                #### TODO implement per-track trails, for now do them all the same
+                if positions is None:
+                    pos, key = self._symbolKey(track, track.distance, track.azimuth)
+                else:
+                    pos, key = self._symbolKey(track, float(positions[0][track.slot]), float(positions[1][track.slot]))
+                if pos:
+                    trackGrid.insert((pos[0], pos[1], 0, 0), track)
+                    symbols.append((track, pos, key))
             if self.verbose >= 2:
-                print(track)
-            #### TODO implement per-track trails, for now do them all the same
-            pos = self._renderSymbol(track, selfLocation, self.trails)
-            self.trackPositions.append((pos, track))
-            self.stats.update(track)
-        if self.verbose >= 2:
-            print("")
+                print("")
+            self.trackGrid = trackGrid
+            # forget the tracks that came back into range (or went away)
+            drawn = {track.uniqueId for track, _, _ in symbols}
+            self.outOfRange = {uid for uid in self.outOfRange if (uid in tracks) and (uid not in drawn)}
+
+        with PROFILER.stage("declutter"):
+            if self.declutter:
+                placements = self._placeLabels(symbols)
+                symbols = [(track, pos, key + (placements[track.uniqueId],)) for track, pos, key in symbols]
+
+        with PROFILER.stage("symbols"):
+            # erase the symbols of tracks that changed or went away, and the count
+            #  label, by restoring the static layer under them
+            keys = {track.uniqueId: key for track, _, key in symbols}
+            erased = []
+            for uid, (key, rect) in list(self.trackRects.items()):
+                if keys.get(uid) != key:
+                    erased.append(rect)
+                    del self.trackRects[uid]
+            if self.countRect:
+                erased.append(self.countRect)
+            for rect in erased:
+                self.radarSurface.blit(self.staticLayer, rect, rect)
+            dirtyRects.extend(erased)
+
+            # redraw the changed symbols, and any unchanged ones that overlap the
+            #  erased or redrawn regions, in the same (back to front) order as a
+            #  full redraw
+            damaged = list(erased)
+            for track, pos, key in symbols:
+                prev = self.trackRects.get(track.uniqueId)
+                if prev and (prev[1].collidelist(damaged) < 0):
+                    continue
+                rect = self._renderSymbol(track, pos, key[-1] if self.declutter else 0)
+                self.trackRects[track.uniqueId] = (key, rect)
+                damaged.append(rect)
+                dirtyRects.append(rect)
+
+            text = self.textCache.render(self.summaryFont, f"{len(sortedTracks)}", self.summaryFontColor, self.bgColor)
+            textRect = text.get_rect()
+            textRect.bottomleft = (2, (self.diameter - 2))
+            self.countRect = self.radarSurface.blit(text, textRect)
+            dirtyRects.append(self.countRect)
+
         y = self.diameter + self.buttonHeight + 4
-        self.screen.fill(self.bgColor, Rect(0, y, self.diameter, (self.windowSize[1] - y)))
         if self.infoMode == SUMMARY_MODE:
             columns = ["Flight", "Feet", "Knots", "Rate", "Dist.", "Azi.", "Cat.", "RSSI"]
-            t = tabulate(table, headers=columns)
-            for line in t.split('\n'):
-                text = self.summaryFont.render(line, True, self.summaryFontColor, self.bgColor)
-                textRect = text.get_rect()
-                textRect.topleft = (4, y)
-                self.screen.blit(text, textRect)
-                y += textRect.h + 2
-                if y >= self.windowSize[1]:
-                    break
+            if table is not None:
+                with PROFILER.stage("tabulate"):
+                    self.summaryLines = tabulate(table, headers=columns).split('\n')
+                self.summaryKey = summaryKey
+            panel = (self.summaryFont, self.summaryFontColor, 4, 0, self.summaryLines)
         elif self.infoMode == DETAILS_MODE:
-            #### FIXME test if track is gone
-            #if self.selectedTrack not in ?:
-            #    self.selectedTrack = None
+            if self.selectedTrack and not self.selectedTrack.isActive():
+                self.selectedTrack = None
+            lines = []
             if self.selectedTrack:
                 trk = self.selectedTrack
                 '''
@@ -645,16 +824,7 @@ class RadarDisplay():
                     f"Timestamp:      {datetime.fromtimestamp(trk.timestamp).isoformat()} {self.tz}",
                     f"Location:       {trk.location}"
                 ]
-                y += 4
-                for line in lines:
-                    text = self.infoFont.render(line, True, self.infoFontColor, self.bgColor)
-                    textRect = text.get_rect()
-                    textRect.topleft = (12, y)
-                    self.screen.blit(text, textRect)
-                    y += textRect.h + 2
-                    if y >= self.windowSize[1]:
-                        logging.warning("Window overrun")
-                        break
+            panel = (self.infoFont, self.infoFontColor, 12, 4, lines)
         elif self.infoMode == INFO_MODE:
             lines = [
                 f"Start Time:      {self.startTime} UTC",
@@ -662,34 +832,87 @@ class RadarDisplay():
                 f"Location:        {selfLocation}",
                 f"Time:            {currentTime} UTC",
                 f"CPU Temperature: {cpuTemp()} C",
-                f"Number of Uids:  {len(self.stats.uids)}",
-                f"Altitude Stats:  min={self.stats.minAltitude}, max={self.stats.maxAltitude}, avg={self.stats.avgAltitude:.2f}",
-                f"Rate Stats:      min={self.stats.minRate}, max={self.stats.maxRate}, avg={self.stats.avgRate:.2f}",
-                f"Speed Stats:     min={self.stats.minSpeed}, max={self.stats.maxSpeed}, avg={self.stats.avgSpeed:.2f}",
-                f"Distance Stats:  min={self.stats.minDistance:.2f}, max={self.stats.maxDistance:.2f}, avg={self.stats.avgDistance:.2f}",
-                f"RSSI Stats:      min={self.stats.minRSSI}, max={self.stats.maxRSSI}, avg={self.stats.avgRSSI:.2f}"
-                #### TODO add category histogram
+                *self.stats.infoLines(),
+                f"Coverage:        {self._coverageStats()}",
+                f"Frame Time:      {self._frameStats()}",
+                f"Frame Pacing:    {self.pacer if self.pacer else 'n/a'}",
+                f"Text Cache:      {self._textCacheStats()}",
+                f"Symbol Atlas:    {self.atlas.resolution:g} deg, {self.atlas.nbytes() / 1024:.0f} KB",
+                *PROFILER.reportLines()
             ]
-            y += 8
-            for line in lines:
-                text = self.infoFont.render(line, True, self.infoFontColor, self.bgColor)
-                textRect = text.get_rect()
-                textRect.topleft = (22, y)
-                self.screen.blit(text, textRect)
-                y += textRect.h + 2
-                if y >= self.windowSize[1]:
-                    break
-        text = self.summaryFont.render(f"{len(table)}", True, self.summaryFontColor, self.bgColor)
-        textRect = text.get_rect()
-        textRect.bottomleft = (2, (self.diameter - 2))
+            panel = (self.infoFont, self.infoFontColor, 22, 8, lines)
+
         with self.lock:
-            self.screen.blit(self.radarSurface, (0, 0))
-            if text:
-                self.screen.blit(text, textRect)
-            pygame.display.flip()
+            if panel != self.panelLines:
+                self.panelLines = panel
+                with PROFILER.stage("panel"):
+                    dirtyRects.append(self._renderPanel(y, *panel))
+            with PROFILER.stage("flip"):
+                self.screen.blit(self.radarSurface, (0, 0))
+                if self.headless:
+                    # there's no event handler to draw the widgets
+                    pygame_widgets.update([])
+                elif self.dirtyRects:
+                    # the widgets are drawn directly onto the screen by the event handler
+                    dirtyRects.append(Rect(0, self.diameter, self.diameter, self.buttonHeight))
+                    pygame.display.update(dirtyRects)
+                else:
+                    pygame.display.flip()
             r = not self.running
+        self.frames += 1
+        if self.frameSinks:
+            with PROFILER.stage("export"):
+                for sink in self.frameSinks:
+                    sink.write(self.screen, self.frames)
+        self.frameTimes.append(time.perf_counter() - frameStart)
+        self.frameCpuTimes.append(time.process_time() - frameCpuStart)
         return r
 
+    def _renderPanel(self, y, font, fontColor, x, yOffset, lines):
+        """Clear the info panel below the buttons and render the given lines of
+           text onto it, returning the rectangle of the panel
+        """
+        panelRect = Rect(0, y, self.diameter, (self.windowSize[1] - y))
+        self.screen.fill(self.bgColor, panelRect)
+        y += yOffset
+        for line in lines:
+            text = self.textCache.render(font, line, fontColor, self.bgColor)
+            textRect = text.get_rect()
+            textRect.topleft = (x, y)
+            self.screen.blit(text, textRect)
+            y += textRect.h + 2
+            if y >= self.windowSize[1]:
+                logging.debug("Window overrun")
+                break
+        return panelRect
+
+    def _frameStats(self):
+        """Return a string with the average wall-clock and CPU time of recent frames
+        """
+        if not self.frameTimes:
+            return "n/a"
+        frameTime = sum(self.frameTimes) / len(self.frameTimes)
+        cpuTime = sum(self.frameCpuTimes) / len(self.frameCpuTimes)
+        return f"{frameTime * 1000:.1f} msec, {cpuTime * 1000:.1f} msec CPU"
+
+    def _coverageStats(self):
+        """Return a summary of the coverage map
+        """
+        if self.coverage is None:
+            return "n/a"
+        info = self.coverage.maxRangeInfo()
+        if info is None:
+            return "no positions yet"
+        maxRange, azimuth, altitude = info
+        return f"max {maxRange:.1f} Km at {azimuth:.0f} deg ({altitude}+ ft), {len(self.coverage)} cells"
+
+    def _textCacheStats(self):
+        """Return a string with the text cache's size and hit rate
+        """
+        hitRate = self.textCache.hitRate()
+        hitRate = "n/a" if hitRate is None else f"{hitRate * 100:.1f}%"
+        return f"{len(self.textCache)}/{self.textCache.maxSize} entries, hit rate={hitRate}, evictions={self.textCache.evictions}"
+
     def _eventHandler(self):
         """#### TODO
         """
@@ -739,6 +962,8 @@ class RadarDisplay():
                         self.stats.printStats()
                     elif event.key in (K_r, ):
                         self.stats.resetStats()
+                    elif event.key in (K_c, ):
+                        self.showCoverage = not self.showCoverage
                     elif event.key in (K_m, ):
                         dirty = True
                         self.autoRange = False
@@ -757,6 +982,7 @@ class RadarDisplay():
                         print("  'd': detail mode")
                         print("  'p': print info")
                         print("  'r': reset info")
+                        print("  'c': coverage -- show/hide the receiver coverage overlay")
                         print("  'q': quit -- exit the application")
                     elif event.key in (K_q, ):
                         self.running = False
@@ -780,6 +1006,8 @@ class RadarDisplay():
                 pygame_widgets.update(events)
 
     def quit(self):
+        for sink in self.frameSinks:
+            sink.close()
         pygame.quit()
 
 '''
@@ -0,0 +1,414 @@
+################################################################################
+#
+# Session Recorder module for pocket1090
+#
+# Records the state of every aircraft in every snapshot into one file per
+#  (UTC) day, in a compact, chunked, columnar binary format, and reads those
+#  files back (via mmap) for analysis.
+#
+# The recorder's write() only queues the snapshot. A background thread turns
+#  the snapshots into rows and buffers them, and only writes (and fsyncs) a
+#  chunk once enough rows have been buffered or the flush interval has passed,
+#  so the SD card sees a few large writes a minute rather than one small one
+#  per snapshot.
+#
+# File format (all little-endian):
+#  * a file header: magic (b"P1090SES"), format version (uint16), and two
+#    reserved bytes
+#  * any number of chunks, each with a header (see CHUNK_HEADER) of: magic
+#    (b"CHNK"), number of rows (uint32), payload encoding (uint8), three
+#    reserved bytes, payload size (uint32), payload CRC32 (uint32), and the
+#    first and last timestamps (float64), followed by the payload
+#  * the payload is the chunk's columns (in RECORD_FIELDS order), each as a
+#    packed array, one after the other, and then:
+#    - RAW: stored as is (so the reader's arrays are views of the mmap)
+#    - ZLIB: zlib-compressed
+#    - SHUFFLE_ZLIB: each column's bytes are shuffled (all of the first bytes
+#      of its values, then all of the second bytes, etc.) before compressing,
+#      which compresses slowly changing numbers much better
+#
+# A truncated or corrupted last chunk (e.g., from a power loss) is ignored by
+#  the reader, and cut off before a recorder appends to the file again.
+#
+# Strings are encoded as small ints (see the encode*() functions), and missing
+#  values are NaN (floats) or the field's MISSING value (ints).
+#
+################################################################################
+
+from datetime import datetime, timezone
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+FILE_MAGIC = b"P1090SES"
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct("<8sHxx")
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sIBxxxIIdd")
+
+RAW = 0
+ZLIB = 1
+SHUFFLE_ZLIB = 2
+ENCODINGS = (RAW, ZLIB, SHUFFLE_ZLIB)
+
+# field name: dtype
+RECORD_FIELDS = {'ts': np.dtype("<f8"),         # snapshot time (Unix epoch time)
+                 'icao': np.dtype("<u4"),       # 24-bit address
+                 'flags': np.dtype("u1"),       # see FLAG_*
+                 'flight': np.dtype("S8"),
+                 'lat': np.dtype("<f8"),
+                 'lon': np.dtype("<f8"),
+                 'alt_geom': np.dtype("<f4"),
+                 'alt_baro': np.dtype("<f4"),
+                 'gs': np.dtype("<f4"),
+                 'track': np.dtype("<f4"),
+                 'geom_rate': np.dtype("<f4"),
+                 'baro_rate': np.dtype("<f4"),
+                 'seen_pos': np.dtype("<f4"),
+                 'seen': np.dtype("<f4"),
+                 'rssi': np.dtype("<f4"),
+                 'squawk': np.dtype("<u2"),     # the four octal digits as an int
+                 'category': np.dtype("u1"),    # see encodeCategory()
+                 'emergency': np.dtype("u1")}   # index into EMERGENCIES
+ROW_BYTES = sum(dtype.itemsize for dtype in RECORD_FIELDS.values())
+
+FLAG_NON_ICAO = 0x01  # the address isn't an ICAO one (i.e., dump1090's hex started with '~')
+FLAG_GROUND = 0x02    # alt_baro was "ground"
+
+MISSING = {'squawk': 0xFFFF, 'category': 0, 'emergency': 0xFF}
+
+EMERGENCIES = ("none", "general", "lifeguard", "minfuel", "nordo", "unlawful", "downed", "reserved")
+_EMERGENCY_CODES = {e: n for n, e in enumerate(EMERGENCIES)}
+
+DEF_CHUNK_ROWS = 65536
+DEF_FLUSH_INTERVAL = 60.0  # secs, max time snapshots are buffered before they're written
+DEF_QUEUE_SIZE = 600       # snapshots, beyond which new ones are dropped
+DEF_LEVEL = 6              # zlib compression level
+DEF_ENCODING = SHUFFLE_ZLIB
+
+
+def encodeCategory(category):
+    """Return the int code of an emitter category ("A0"-"D7" is 1-32, and
+       anything else is 0)
+    """
+    if (not category) or (len(category) != 2) or (category[0] not in "ABCD") or (category[1] not in "01234567"):
+        return 0
+    return ((ord(category[0]) - ord("A")) * 8) + int(category[1]) + 1
+
+def decodeCategory(code):
+    """Return the emitter category of an int code (or None)
+    """
+    if not (1 <= code <= 32):
+        return None
+    return f"{chr(ord('A') + ((code - 1) // 8))}{(code - 1) % 8}"
+
+def encodeSquawk(squawk):
+    try:
+        return int(squawk, 8)
+    except (TypeError, ValueError):
+        return MISSING['squawk']
+
+def decodeSquawk(code):
+    return None if code == MISSING['squawk'] else f"{code:04o}"
+
+def hexId(icao, flags):
+    """Return dump1090's 'hex' of a recorded address
+    """
+    return f"{'~' if flags & FLAG_NON_ICAO else ''}{icao:06x}"
+
+def dayFile(dirPath, ts):
+    """Return the path of the session file of the (UTC) day of the given time
+    """
+    return os.path.join(dirPath, f"pocket1090_{datetime.fromtimestamp(ts, timezone.utc):%Y%m%d}.ses")
+
+
+def _number(v):
+    return v if isinstance(v, (int, float)) else None
+
+def _encodeRow(ts, a):
+    """Return a tuple (in RECORD_FIELDS order) of an aircraft's info
+    """
+    uid = a.get('hex', "")
+    flags = 0
+    if uid.startswith("~"):
+        flags |= FLAG_NON_ICAO
+        uid = uid[1:]
+    try:
+        icao = int(uid, 16)
+    except ValueError:
+        icao = 0
+    altBaro = a.get('alt_baro')
+    if altBaro == "ground":
+        flags |= FLAG_GROUND
+    flight = a.get('flight')
+    return (ts, icao, flags, flight.strip().encode("ascii", "replace") if flight else b"",
+            _number(a.get('lat')), _number(a.get('lon')),
+            _number(a.get('alt_geom')), _number(altBaro), _number(a.get('gs')), _number(a.get('track')),
+            _number(a.get('geom_rate')), _number(a.get('baro_rate')),
+            _number(a.get('seen_pos')), _number(a.get('seen')), _number(a.get('rssi')),
+            encodeSquawk(a.get('squawk')), encodeCategory(a.get('category')),
+            _EMERGENCY_CODES.get(a.get('emergency'), MISSING['emergency']))
+
+def encodeChunk(columns, encoding=DEF_ENCODING, level=DEF_LEVEL):
+    """Return the chunk header and payload bytes of the given columns (a dict
+       of arrays, with the RECORD_FIELDS dtypes, of the same length)
+
+      The header has the chunk's min and max timestamps, so readers can skip
+      chunks outside of the times they want.
+    """
+    numRows = len(columns['ts'])
+    parts = []
+    for name, dtype in RECORD_FIELDS.items():
+        column = np.ascontiguousarray(columns[name], dtype=dtype)
+        if (encoding == SHUFFLE_ZLIB) and (dtype.itemsize > 1):
+            column = column.view(np.uint8).reshape(numRows, dtype.itemsize).T
+        parts.append(column.tobytes())
+    payload = b"".join(parts)
+    if encoding != RAW:
+        payload = zlib.compress(payload, level)
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, numRows, encoding, len(payload), zlib.crc32(payload),
+                               float(np.min(columns['ts'])) if numRows else 0.0,
+                               float(np.max(columns['ts'])) if numRows else 0.0)
+    return header, payload
+
+def decodeChunk(buf, offset, numRows, encoding, size, crc, fields=None):
+    """Return a dict of the (named) columns of the chunk whose payload is at
+       the given offset in the buffer
+    """
+    payload = memoryview(buf)[offset:offset + size]
+    if zlib.crc32(payload) != crc:
+        raise ValueError(f"Corrupted session chunk at offset {offset}")
+    if encoding != RAW:
+        payload = zlib.decompress(payload)
+    offset = 0
+    columns = {}
+    for name, dtype in RECORD_FIELDS.items():
+        n = numRows * dtype.itemsize
+        if (fields is None) or (name in fields):
+            if (encoding == SHUFFLE_ZLIB) and (dtype.itemsize > 1):
+                shuffled = np.frombuffer(payload, np.uint8, n, offset).reshape(dtype.itemsize, numRows)
+                columns[name] = np.ascontiguousarray(shuffled.T).view(dtype).reshape(numRows)
+            else:
+                columns[name] = np.frombuffer(payload, dtype, numRows, offset)
+        offset += n
+    return columns
+
+def scanChunks(buf):
+    """Return a list of the (payload offset, header fields) of the complete
+       chunks in a session file's contents, and the offset of the end of the
+       last one
+
+      N.B. Only the last chunk's CRC is checked here, as it's the one that a
+           power loss could leave partially written.
+    """
+    if len(buf) < FILE_HEADER.size:
+        raise ValueError("Not a session file (too short)")
+    magic, version = FILE_HEADER.unpack_from(buf, 0)
+    if magic != FILE_MAGIC:
+        raise ValueError("Not a session file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported session file version: {version}")
+    chunks = []
+    offset = FILE_HEADER.size
+    while (offset + CHUNK_HEADER.size) <= len(buf):
+        header = CHUNK_HEADER.unpack_from(buf, offset)
+        magic, _, encoding, size = header[:4]
+        start = offset + CHUNK_HEADER.size
+        if (magic != CHUNK_MAGIC) or (encoding not in ENCODINGS) or ((start + size) > len(buf)):
+            break
+        chunks.append((start, header[1:]))
+        offset = start + size
+    if chunks and (zlib.crc32(buf[chunks[-1][0]:offset]) != chunks[-1][1][3]):
+        offset = chunks.pop()[0] - CHUNK_HEADER.size
+    if offset < len(buf):
+        logging.warning(f"Ignoring {len(buf) - offset} bytes of incomplete chunk(s) at the end of the session file")
+    return chunks, offset
+
+
+class SessionRecorder():
+    """Records snapshots, in the background, into a session file per day in
+       the given directory
+    """
+    def __init__(self, dirPath, chunkRows=DEF_CHUNK_ROWS, flushInterval=DEF_FLUSH_INTERVAL,
+                 encoding=DEF_ENCODING, level=DEF_LEVEL, queueSize=DEF_QUEUE_SIZE, fsync=True):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Invalid encoding '{encoding}', must be one of {ENCODINGS}")
+        if chunkRows < 1:
+            raise ValueError("Invalid chunk size, must be at least one row")
+        os.makedirs(dirPath, exist_ok=True)
+        self.dirPath = dirPath
+        self.chunkRows = chunkRows
+        self.flushInterval = flushInterval
+        self.encoding = encoding
+        self.level = level
+        self.fsync = fsync
+        self.queue = queue.Queue(queueSize)
+        self.rows = []
+        self.filePath = None
+        self.f = None
+        self.lastFlush = time.monotonic()
+        self.snapshots = 0
+        self.dropped = 0
+        self.chunks = 0
+        self.bytesWritten = 0
+        self.rowsWritten = 0
+        self.thread = threading.Thread(target=self._writer, args=(), daemon=True)
+        self.thread.start()
+        logging.info(f"Recording session to '{dirPath}'")
+
+    def write(self, ts, snapshot):
+        """Queue a snapshot to be recorded (dropping it if the writer has
+           fallen too far behind)
+
+          N.B. The snapshot's aircraft are encoded later, so they mustn't be
+               modified after they're written.
+        """
+        try:
+            self.queue.put_nowait((ts, snapshot['aircraft']))
+        except queue.Full:
+            self.dropped += 1
+
+    def _open(self, filePath):
+        """Open a day's session file for appending, cutting off any incomplete
+           chunk at its end
+        """
+        if self.f:
+            self.f.close()
+            self.f = None
+        self.filePath = filePath
+        if os.path.exists(filePath) and os.path.getsize(filePath):
+            with open(filePath, "rb") as f:
+                _, end = scanChunks(f.read())
+            self.f = open(filePath, "r+b")
+            self.f.truncate(end)
+            self.f.seek(end)
+        else:
+            self.f = open(filePath, "wb")
+            self.f.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION))
+        logging.debug(f"Session file: '{filePath}'")
+
+    def _flush(self):
+        """Write the buffered rows (if any) as a chunk
+        """
+        self.lastFlush = time.monotonic()
+        if not self.rows:
+            return
+        columns = {name: np.array(values, dtype=dtype)
+                   for (name, dtype), values in zip(RECORD_FIELDS.items(), zip(*self.rows))}
+        header, payload = encodeChunk(columns, self.encoding, self.level)
+        self.f.write(header)
+        self.f.write(payload)
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+        self.chunks += 1
+        self.rowsWritten += len(self.rows)
+        self.bytesWritten += len(header) + len(payload)
+        self.rows = []
+
+    def _writer(self):
+        while True:
+            timeout = max(0.0, (self.lastFlush + self.flushInterval) - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            try:
+                if item:
+                    ts, aircraft = item
+                    filePath = dayFile(self.dirPath, ts)
+                    if filePath != self.filePath:
+                        self._flush()
+                        self._open(filePath)
+                    self.rows.extend(_encodeRow(ts, a) for a in aircraft)
+                    self.snapshots += 1
+                if (item is None) or (len(self.rows) >= self.chunkRows) or \
+                   ((time.monotonic() - self.lastFlush) >= self.flushInterval):
+                    self._flush()
+            except Exception as e:
+                logging.error(f"Session recording failed: {e}")
+                self.rows = []
+            if item is None:
+                return
+
+    def close(self):
+        """Write everything that's been queued, and close the file
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.f:
+            self.f.close()
+            self.f = None
+        if self.dropped:
+            logging.warning(f"Session recorder dropped {self.dropped} snapshot(s)")
+
+
+class SessionReader():
+    """Reads a session file via mmap
+
+      Chunks are only decompressed when they're read, and the columns of a
+      single RAW chunk are read as views of the file, without copying.
+
+      N.B. The reader can only be closed once there are no such views left.
+    """
+    def __init__(self, filePath):
+        self.filePath = filePath
+        with open(filePath, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.chunks, _ = scanChunks(self.mm)
+        self.numRows = sum(header[0] for _, header in self.chunks)
+
+    def __len__(self):
+        return self.numRows
+
+    def timeRange(self):
+        """Return the (min, max) timestamps in the file (or None)
+        """
+        if not self.chunks:
+            return None
+        return min(h[4] for _, h in self.chunks), max(h[5] for _, h in self.chunks)
+
+    def read(self, start=None, end=None, fields=None):
+        """Return a dict of arrays of the named fields (default: all of them)
+           of the rows with timestamps in [start, end)
+        """
+        names = [n for n in RECORD_FIELDS if (fields is None) or (n in fields)]
+        parts = {n: [] for n in names}
+        for offset, (numRows, encoding, size, crc, firstTs, lastTs) in self.chunks:
+            if ((start is not None) and (lastTs < start)) or ((end is not None) and (firstTs >= end)):
+                continue
+            columns = decodeChunk(self.mm, offset, numRows, encoding, size, crc, set(names) | {'ts'})
+            if ((start is not None) and (firstTs < start)) or ((end is not None) and (lastTs >= end)):
+                ts = columns['ts']
+                mask = np.ones(numRows, dtype=bool)
+                if start is not None:
+                    mask &= ts >= start
+                if end is not None:
+                    mask &= ts < end
+                columns = {n: c[mask] for n, c in columns.items()}
+            for n in names:
+                parts[n].append(columns[n])
+        return {n: (p[0] if len(p) == 1 else np.concatenate(p)) if p else np.empty(0, dtype=RECORD_FIELDS[n])
+                for n, p in parts.items()}
+
+    def aircraft(self, uniqueId, start=None, end=None, fields=None):
+        """Return a dict of arrays of the named fields of the rows of the given
+           aircraft (by dump1090's 'hex')
+        """
+        nonIcao = uniqueId.startswith("~")
+        icao = int(uniqueId.lstrip("~"), 16)
+        names = None if fields is None else set(fields) | {'icao', 'flags'}
+        columns = self.read(start, end, names)
+        mask = (columns['icao'] == icao) & (((columns['flags'] & FLAG_NON_ICAO) != 0) == nonIcao)
+        return {n: c[mask] for n, c in columns.items() if (fields is None) or (n in fields)}
+
+    def close(self):
+        self.mm.close()
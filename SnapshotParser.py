@@ -0,0 +1,121 @@
+################################################################################
+#
+# Snapshot Parser module for pocket1090
+#
+# Parses aircraft.json snapshots (and capture records), keeping only the
+#  snapshot's 'now' and 'messages', and the aircraft fields that the tracks
+#  use (i.e., TRACK_DEFS), using the fastest backend that's installed:
+#  * msgspec: typed decoding into Structs with just those fields, so all the
+#             other fields are skipped by the decoder and never become Python
+#             objects
+#  * orjson: a faster JSON decoder, but the other fields are (briefly)
+#            materialized before they're dropped
+#  * json: the standard library decoder, as before
+#
+# If msgspec rejects a snapshot (e.g., a field has an unexpected type), the
+#  snapshot is parsed again with the next backend, so nothing is lost.
+#
+################################################################################
+
+import json
+import logging
+from typing import Any, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from Track import TRACK_KEYS
+
+
+BACKENDS = tuple(name for name, module in (("msgspec", msgspec), ("orjson", orjson), ("json", json)) if module)
+DEF_BACKEND = BACKENDS[0]
+
+SNAPSHOT_KEYS = ('now', 'messages')
+
+NUMBER = Union[int, float]
+# types of the aircraft fields in dump1090-fa's aircraft.json (any others are Any)
+FIELD_TYPES = {'hex': str,
+               'flight': str,
+               'alt_geom': NUMBER,
+               'alt_baro': Union[int, float, str],  # "ground" when on the ground
+               'gs': float,
+               'track': float,
+               'geom_rate': NUMBER,
+               'baro_rate': NUMBER,
+               'category': str,
+               'lat': float,
+               'lon': float,
+               'squawk': str,
+               'seen_pos': float,
+               'seen': float,
+               'emergency': str,
+               'rssi': float}
+
+if msgspec:
+    _Aircraft = msgspec.defstruct("_Aircraft", [(k, Union[FIELD_TYPES.get(k, Any), msgspec.UnsetType], msgspec.UNSET)
+                                                for k in TRACK_KEYS])
+    _Snapshot = msgspec.defstruct("_Snapshot", [('now', Union[float, msgspec.UnsetType], msgspec.UNSET),
+                                                ('messages', Union[int, msgspec.UnsetType], msgspec.UNSET),
+                                                ('aircraft', list[_Aircraft], [])])
+    _Record = msgspec.defstruct("_Record", [('ts', float), ('snapshot', _Snapshot)])
+
+
+def _trackFields(j):
+    """Return a copy of a generically parsed snapshot with only the fields
+       that are used
+    """
+    snapshot = {k: j[k] for k in SNAPSHOT_KEYS if k in j}
+    snapshot['aircraft'] = [{k: a[k] for k in TRACK_KEYS if k in a} for a in j.get('aircraft', ())]
+    return snapshot
+
+
+class SnapshotParser():
+    """Parses snapshots with the given backend (one of BACKENDS)
+    """
+    def __init__(self, backend=DEF_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid parser backend '{backend}', must be one of {BACKENDS}")
+        self.backend = backend
+        self.fallbacks = 0
+        if backend == "msgspec":
+            self.snapshotDecoder = msgspec.json.Decoder(_Snapshot)
+            self.recordDecoder = msgspec.json.Decoder(_Record)
+        self.loads = orjson.loads if "orjson" in BACKENDS else json.loads
+
+    def _typed(self, decoder, data):
+        try:
+            return msgspec.to_builtins(decoder.decode(data))
+        except msgspec.ValidationError as e:
+            self.fallbacks += 1
+            logging.warning(f"Snapshot didn't match the track schema ({e}), parsing it generically")
+            return None
+
+    def parse(self, data):
+        """Return the snapshot (as a dict) parsed from the given aircraft.json
+           contents (bytes or str)
+        """
+        if self.backend == "msgspec":
+            snapshot = self._typed(self.snapshotDecoder, data)
+            if snapshot is not None:
+                return snapshot
+        elif self.backend == "json":
+            return _trackFields(json.loads(data))
+        return _trackFields(self.loads(data))
+
+    def parseRecord(self, data):
+        """Return the timestamp and snapshot parsed from the given capture
+           record (i.e., one line of a capture file)
+        """
+        if self.backend == "msgspec":
+            record = self._typed(self.recordDecoder, data)
+            if record is not None:
+                return record['ts'], record['snapshot']
+        record = json.loads(data) if self.backend == "json" else self.loads(data)
+        return record['ts'], _trackFields(record['snapshot'])
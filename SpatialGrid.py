@@ -0,0 +1,117 @@
+################################################################################
+#
+# Spatial Grid module for pocket1090
+#
+# Uniform grid (a dict of cells) over screen coordinates, rebuilt every frame,
+#  for finding the track nearest to a click/touch and for finding collisions
+#  between labels without comparing every pair of them.
+#
+# Rects are (left, top, width, height) tuples (or pygame Rects), and two rects
+#  collide if their interiors overlap (i.e., the same as Rect.colliderect()).
+#
+################################################################################
+
+DEF_CELL_SIZE = 32  # pixels, roughly the size of a track's symbol and labels
+
+
+class SpatialGrid():
+    """Items bucketed by the grid cells that their rects touch
+    """
+    def __init__(self, cellSize=DEF_CELL_SIZE):
+        if cellSize <= 0:
+            raise ValueError("Invalid cell size, must be greater than zero")
+        self.cellSize = cellSize
+        self.cells = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _cells(self, left, top, right, bottom):
+        cs = self.cellSize
+        x0, x1, y0, y1 = int(left // cs), int(right // cs), int(top // cs), int(bottom // cs)
+        if (x0 == x1) and (y0 == y1):
+            return ((x0, y0),)
+        return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+    def insert(self, rect, item):
+        """Add an item with the given rect (a point is a rect with no width or
+           height)
+        """
+        left, top, width, height = rect
+        entry = (left, top, left + width, top + height, item)
+        cells = self.cells
+        for cell in self._cells(left, top, left + width, top + height):
+            bucket = cells.get(cell)
+            if bucket is None:
+                cells[cell] = [entry]
+            else:
+                bucket.append(entry)
+        self.count += 1
+
+    def query(self, rect):
+        """Return a list of the items whose rects collide with the given one
+        """
+        left, top, width, height = rect
+        right, bottom = left + width, top + height
+        found = {}
+        for cell in self._cells(left, top, right, bottom):
+            for entry in self.cells.get(cell, ()):
+                if (entry[0] < right) and (left < entry[2]) and (entry[1] < bottom) and (top < entry[3]):
+                    found[id(entry)] = entry[4]
+        return list(found.values())
+
+    def collides(self, rect, ignore=None):
+        """Return True if the given rect collides with the rect of any item
+           (other than the ignored one)
+        """
+        left, top, width, height = rect
+        right, bottom = left + width, top + height
+        cells = self.cells
+        for cell in self._cells(left, top, right, bottom):
+            for l, t, r, b, item in cells.get(cell, ()):
+                if (l < right) and (left < r) and (t < bottom) and (top < b) and ((ignore is None) or (item != ignore)):
+                    return True
+        return False
+
+    def nearest(self, x, y, maxDistance):
+        """Return the item whose rect's center is nearest to the given point,
+           if it's within maxDistance, otherwise None
+        """
+        best, bestD2 = None, maxDistance * maxDistance
+        for cell in self._cells(x - maxDistance, y - maxDistance, x + maxDistance, y + maxDistance):
+            for left, top, right, bottom, item in self.cells.get(cell, ()):
+                dx = ((left + right) / 2) - x
+                dy = ((top + bottom) / 2) - y
+                d2 = (dx * dx) + (dy * dy)
+                if d2 < bestD2:
+                    best, bestD2 = item, d2
+        return best
+
+
+def placeLabels(labels, obstacles=(), cellSize=DEF_CELL_SIZE):
+    """Greedily place labels so they don't collide with each other or with the
+       obstacles, and return a dict of the index of the placement chosen for
+       each item (or None if all of its placements collide, i.e., it's hidden)
+
+      Labels is a sequence of (item, placements) in priority order, where each
+      placement is a list of the rects of all of that item's labels. An item's
+      labels can overlap its own obstacle (e.g., its symbol).
+    """
+    grid = SpatialGrid(cellSize)
+    for rect, item in obstacles:
+        grid.insert(rect, item)
+    chosen = {}
+    collides, insert = grid.collides, grid.insert
+    for item, placements in labels:
+        chosen[item] = None
+        for indx, rects in enumerate(placements):
+            for rect in rects:
+                if collides(rect, item):
+                    break
+            else:
+                for rect in rects:
+                    insert(rect, item)
+                chosen[item] = indx
+                break
+    return chosen
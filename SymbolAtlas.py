@@ -0,0 +1,75 @@
+################################################################################
+#
+# Symbol Atlas module for pocket1090
+#
+# Holds each symbol pre-rotated at a fixed angular resolution, so drawing a
+#  heading-aligned symbol is a lookup and a blit rather than a rotation on
+#  every frame.
+#
+# Angles are clockwise degrees (i.e., compass headings), and are rounded to
+#  the nearest multiple of the resolution.
+#
+################################################################################
+
+import pygame
+
+
+DEF_ATLAS_RESOLUTION = 5.0  # degrees between pre-rotated copies of a symbol
+
+
+class SymbolAtlas():
+    """Pre-rotated copies of named symbol surfaces
+
+      Symbols added with lazy=True have each rotation created the first time
+      it's asked for, instead of all of them up front.
+    """
+    def __init__(self, resolution=DEF_ATLAS_RESOLUTION):
+        if not (0 < resolution <= 360):
+            raise ValueError("Invalid atlas resolution, must be in (0, 360] degrees")
+        self.steps = max(1, round(360.0 / resolution))
+        self.resolution = 360.0 / self.steps
+        self.symbols = {}
+        self.rotations = {}
+
+    def add(self, name, surface, lazy=False):
+        """Add a symbol to the atlas, replacing any existing one by that name
+        """
+        self.symbols[name] = surface
+        self.rotations[name] = [None] * self.steps
+        if not lazy:
+            for step in range(self.steps):
+                self._rotate(name, step)
+
+    def _rotate(self, name, step):
+        surface = self.symbols[name]
+        rotated = pygame.transform.rotate(surface, -(step * self.resolution)) if step else surface
+        self.rotations[name][step] = rotated
+        return rotated
+
+    def quantize(self, angle):
+        """Return the index of the pre-rotated copy closest to the given angle
+        """
+        return round(angle / self.resolution) % self.steps
+
+    def get(self, name, angle=None):
+        """Return the named symbol rotated (clockwise) to the closest multiple
+           of the resolution to the given angle, or unrotated if it's None
+        """
+        if angle is None:
+            return self.symbols[name]
+        step = self.quantize(angle)
+        rotated = self.rotations[name][step]
+        if rotated is None:
+            rotated = self._rotate(name, step)
+        return rotated
+
+    def __contains__(self, name):
+        return name in self.symbols
+
+    def nbytes(self):
+        """Return the (approximate) pixel memory of all of the symbols and
+           their rotated copies
+        """
+        surfaces = list(self.symbols.values())
+        surfaces += [s for rotations in self.rotations.values() for s in rotations[1:] if s is not None]
+        return sum(s.get_bytesize() * s.get_width() * s.get_height() for s in surfaces)
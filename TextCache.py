@@ -0,0 +1,76 @@
+################################################################################
+#
+# Text Cache module for pocket1090
+#
+# Bounded LRU cache of rendered text surfaces, keyed by (font, text, color,
+#  background), so that labels and panel lines that don't change between
+#  snapshots cost a dictionary lookup rather than a font render.
+#
+# N.B. The cached surfaces are shared, so callers must only blit them (and
+#      never draw on them or change their colorkey).
+#
+################################################################################
+
+from collections import OrderedDict
+
+
+DEF_TEXT_CACHE_SIZE = 1024  # max number of rendered text surfaces kept
+
+
+class TextCache():
+    """LRU cache of rendered text surfaces, with hit/miss/eviction counters
+    """
+    def __init__(self, maxSize=DEF_TEXT_CACHE_SIZE):
+        if maxSize < 1:
+            raise ValueError("Invalid text cache size, must be greater than zero")
+        self.maxSize = maxSize
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def render(self, font, text, color, background=None, transparent=False):
+        """Return an antialiased surface with the given text rendered in the
+           given font and color, rendering it only if it's not in the cache
+
+          If 'transparent' is True, the background color is made the colorkey
+          of the surface.
+        """
+        key = (font, text, color, background, transparent)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color, background)
+        if transparent:
+            surface.set_colorkey(background)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxSize:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def hitRate(self):
+        """Return the fraction of lookups that were hits (or None if there
+           haven't been any)
+        """
+        lookups = self.hits + self.misses
+        return (self.hits / lookups) if lookups else None
+
+    def nbytes(self):
+        """Return the (approximate) pixel memory of the cached surfaces
+        """
+        return sum(s.get_bytesize() * s.get_width() * s.get_height() for s in self.surfaces.values())
+
+    def clear(self):
+        self.surfaces.clear()
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
@@ -4,59 +4,95 @@
 #
 ################################################################################
 
-from dataclasses import dataclass
-
 from geopy import Point
 from geopy import distance as geoDistance
 
+from Geodesy import DEF_GEO_MODE, distancesAndAzimuths
+from Profiler import PROFILER
+from TrackHistory import DEF_HISTORY_DEPTH, DEF_HISTORY_MAX_AGE, TrackHistory
+from TrackTable import TRACK_COLUMNS, TrackTable
 from __init__ import * #### FIXME
 
 #### TODO add 'alt_baro', 'geom_rate', 'baro_rate', 'squawk', and 'emergency' keys
 
-TRACK_DEFS = {'hex': "unknown",
-              'flight': "n/a",
-              'alt_geom': None,
-              'alt_baro': None,
-              'gs': None,
-              'track': None,
-              'geom_rate': None,
-              'baro_rate': None,
-              'category': "?",
-              'lat': None,
-              'lon': None,
-              'squawk': "n/a",
-              'seen_pos': None,
-              'seen': None,
-              'emergency': None,
-              'rssi': None}
+# aircraft.json key: (Track attribute, default value)
+TRACK_FIELDS = {'hex': ('uniqueId', "unknown"),         # 24-bit ICAO id, six hex digits, non-ICAO addresses start with '~'
+                'flight': ('flightNumber', "n/a"),      # callsign, the flight name or aircraft registration as 8 chars
+                'alt_geom': ('altitude', None),         # geometric (GNSS/INS) altitude in feet referenced to the WGS84 ellipsoid
+                'alt_baro': ('baroAltitude', None),     # barometric altitude in feet above sea level
+                'gs': ('speed', None),                  # ground speed in knots
+                'track': ('heading', None),             # true track over ground in degrees (0-359)
+                'geom_rate': ('geomRate', None),        # geometric (GNSS/INS) rate of climb/descent in feet per minute
+                'baro_rate': ('baroRate', None),        # barometric rate of climb/descent in feet per minute
+                'category': ('category', "?"),          # emitter category, identifies aircraft classes (values "A0"-"D7")
+                'lat': ('lat', None),                   # aircraft position in decimal degrees
+                'lon': ('lon', None),                   # aircraft position in decimal degrees
+                'squawk': ('squawk', "n/a"),            # transponder code
+                'seen_pos': ('seenPos', None),          # how many seconds before "now" the position was last updated
+                'seen': ('seen', None),                 # how many seconds before "now" a message was last received from this aircraft
+                'emergency': ('emergency', None),       # emergency/priority status
+                'rssi': ('rssi', None)}                 # recent average RSSI (in dbFS); this will always be negative
+TRACK_DEFS = {k: default for k, (_, default) in TRACK_FIELDS.items()}
 TRACK_KEYS = TRACK_DEFS.keys()
 
+# fields that change on every snapshot, even when nothing about the aircraft has
+VOLATILE_KEYS = ('seen', 'seen_pos', 'rssi')
+STATE_KEYS = tuple(k for k in TRACK_KEYS if k not in VOLATILE_KEYS)
+
+# aircraft.json keys of the TrackTable's columns, in column order (None for the
+#  columns that a track derives: timestamp, distance, and azimuth)
+_ATTR_KEYS = {attr: k for k, (attr, _) in TRACK_FIELDS.items()}
+COLUMN_KEYS = tuple(_ATTR_KEYS.get(name) for name in TRACK_COLUMNS)
+_COLUMN_INDX = {name: indx for indx, name in enumerate(TRACK_COLUMNS)}
+TIMESTAMP_INDX, DISTANCE_INDX, AZIMUTH_INDX = (_COLUMN_INDX[n] for n in ('timestamp', 'distance', 'azimuth'))
+
 
-@dataclass
-class TrackSpec():
-    uniqueId: str           # hex: 24-bit ICAO id, six hex digits, non-ICAO addresses start with '~'
-    flightNumber: str       # flight: callsign, the flight name or aircraft registration as 8 chars
-    altitude: int           # alt_geom: geometric (GNSS/INS) altitude in feet referenced to the WGS84 ellipsoid
-    baroAltitude: int       # alt_baro: barometric altitude in feet above sea level
-    speed: float            # gs: ground speed in knots
-    heading: float          # track: true track over ground in degrees (0-359)
-    geomRate: int           # geom_rate: geometric (GNSS/INS) rate of climb/descent in feet per minute
-    baroRate: int           # baro_rate: barometric rate of climb/descent in feet per minute
-    category: str           # category: emitter category, identifies aircraft classes (values "A0"-"D7")
-    lat: float              # lat: aircraft position in decimal degrees
-    lon: float              # lon: aircraft position in decimal degrees
-    squawk: int             # squawk: transponder code
-    seenPos: float          # seen_pos: how many seconds before "now" the position was last updated
-    seen: float             # seen: how many seconds before "now" a message was last received from this aircraft
-    emergency: str          # emergency: 
-    rssi: float             # rssi: recent average RSSI (in dbFS); this will always be negative
-    timestamp: float        # when the aircraft.json file was written (in Unix epoch time)
-    location: (float,float) # (lat, lon) tuple as a geopy Point object
-    distance: float         # distance of aircraft from current position in Km
-    azimuth: float          # direction from current position to aircraft in degrees (0-359)
+def _columnProperty(name):
+    """Return a property that reads/writes the named column of a track's row
+       in its TrackTable
+    """
+    return property(lambda self: self.table.get(name, self.slot),
+                    lambda self, value: self.table.set(name, self.slot, value))
 
 
 class Track():
+    """View of one row of a TrackTable, plus the track's non-numeric fields
+       and its history
+
+      The numeric fields (and the derived timestamp, distance, and azimuth)
+      are only stored in the table, and the rest in the track's slots, so
+      there's one copy of a track's current state.
+
+      N.B. Once a track is removed from its table its slot is None and its
+           numeric fields can no longer be read.
+    """
+    __slots__ = ('table', 'slot', 'history', 'uniqueId', 'flightNumber', 'category', 'squawk', 'emergency')
+
+    # history settings for all new tracks
+    historyDepth = DEF_HISTORY_DEPTH
+    historyMaxAge = DEF_HISTORY_MAX_AGE
+
+    altitude = _columnProperty('altitude')
+    baroAltitude = _columnProperty('baroAltitude')
+    speed = _columnProperty('speed')
+    heading = _columnProperty('heading')
+    geomRate = _columnProperty('geomRate')
+    baroRate = _columnProperty('baroRate')
+    lat = _columnProperty('lat')
+    lon = _columnProperty('lon')
+    seenPos = _columnProperty('seenPos')
+    seen = _columnProperty('seen')
+    rssi = _columnProperty('rssi')
+    timestamp = _columnProperty('timestamp')
+    distance = _columnProperty('distance')
+    azimuth = _columnProperty('azimuth')
+
+    @property
+    def location(self):
+        """The track's position as a geopy Point
+        """
+        return Point(self.lat, self.lon)
+
     @staticmethod
     def distanceAndAzimuth(startPt, endPt):
         """Calculate and return the distance and bearing between two points
@@ -89,10 +125,14 @@ class Track():
         return brng
     '''
 
-    def __init__(self, timestamp, selfLocation, **kwargs):
-        self.history = []
-        self.currentTrack = None
-        self.update(timestamp, selfLocation, **kwargs)
+    def __init__(self, timestamp, selfLocation, info, distAzi=None, table=None):
+        """Create a track in the given TrackTable (or in a table of its own)
+           from an aircraft's info (a dict of aircraft.json fields)
+        """
+        self.table = TrackTable(1) if table is None else table
+        self.slot = self.table.alloc(info.get('hex', TRACK_DEFS['hex']), self)
+        self.history = TrackHistory(Track.historyDepth, Track.historyMaxAge)
+        self.update(timestamp, selfLocation, info, distAzi)
 
     def __repr__(self):
         s = f"uniqueId: "
@@ -179,58 +219,114 @@ class Track():
         s += f", location: {self.location}"
         return s
 
-    def update(self, timestamp, selfLocation, **kwargs):
-        """#### TODO
+    def update(self, timestamp, selfLocation, info, distAzi=None):
+        """Update the track from an aircraft's info (a dict of aircraft.json
+           fields), and add its location to the history
+          distAzi is the (distance, azimuth) from selfLocation, if it's already
+          been calculated (e.g., in a batch by updateTracks())
         """
-        self.uniqueId = kwargs.get('hex', TRACK_DEFS['hex'])
-        self.flightNumber = kwargs.get('flight', TRACK_DEFS['flight'])
-        self.altitude = kwargs.get('alt_geom', TRACK_DEFS['alt_geom'])
-        self.baroAltitude = kwargs.get('alt_baro', TRACK_DEFS['alt_baro'])
-        self.speed = kwargs.get('gs', TRACK_DEFS['gs'])
-        self.heading = kwargs.get('track', TRACK_DEFS['track'])
-        self.geomRate = kwargs.get('geom_rate', TRACK_DEFS['geom_rate'])
-        self.baroRate = kwargs.get('baro_rate', TRACK_DEFS['baro_rate'])
-        self.category = kwargs.get('category', TRACK_DEFS['category'])
-        self.lat = kwargs.get('lat', TRACK_DEFS['lat'])
-        self.lon = kwargs.get('lon', TRACK_DEFS['lon'])
-        self.squawk = kwargs.get('squawk', TRACK_DEFS['squawk'])
-        self.seenPos = kwargs.get('seen_pos', TRACK_DEFS['seen_pos'])
-        self.seen = kwargs.get('seen', TRACK_DEFS['seen'])
-        self.rssi = kwargs.get('rssi', TRACK_DEFS['rssi'])
-        self.emergency = kwargs.get('emergency', TRACK_DEFS['emergency'])
-        self.timestamp = timestamp
-        self.location = Point(self.lat, self.lon)
-        self.distance, self.azimuth = Track.distanceAndAzimuth(selfLocation, self.location)
-
-        if self.currentTrack:
-            self.history.append(self.currentTrack)
-        self.currentTrack = TrackSpec(self.uniqueId, self.flightNumber, self.altitude,
-                                      self.baroAltitude, self.speed, self.heading,
-                                      self.geomRate, self.baroRate, self.category,
-                                      self.lat, self.lon, self.squawk, self.seenPos,
-                                      self.seen, self.rssi, self.emergency,
-                                      self.timestamp, self.location, self.distance,
-                                      self.azimuth)
-
-    def currentTrack(self):
-        """#### TODO
+        get = info.get
+        self.uniqueId = get('hex', TRACK_DEFS['hex'])
+        self.flightNumber = get('flight', TRACK_DEFS['flight'])
+        self.category = get('category', TRACK_DEFS['category'])
+        self.squawk = get('squawk', TRACK_DEFS['squawk'])
+        self.emergency = get('emergency', TRACK_DEFS['emergency'])
+        lat, lon = get('lat'), get('lon')
+        if distAzi is None:
+            distAzi = Track.distanceAndAzimuth(selfLocation, Point(lat, lon))
+        row = [get(k) for k in COLUMN_KEYS]
+        row[TIMESTAMP_INDX] = timestamp
+        row[DISTANCE_INDX], row[AZIMUTH_INDX] = distAzi
+        self.table.setRow(self.slot, row)
+        self.history.append(timestamp, lat, lon, distAzi[0], distAzi[1], self.altitude)
+
+    def refresh(self, timestamp, info):
+        """Update only the volatile fields of a track whose state hasn't changed
+          (i.e., without re-projecting it or adding to its history)
+        """
+        table, slot = self.table, self.slot
+        table.set('seenPos', slot, info.get('seen_pos'))
+        table.set('seen', slot, info.get('seen'))
+        table.set('rssi', slot, info.get('rssi'))
+        table.set('timestamp', slot, timestamp)
+
+    def copyTo(self, table, copy=None):
+        """Return a copy of the track in the given table, at the same slot (see
+           TrackTable.copyFrom()), updating the given earlier copy of it if
+           there is one (and only copying its history if that's changed)
         """
-        return self.currentTrack
-
-    def getHistory(self, depth, collapse=True):
-        """ #### TODO
-          Return list of tuple of (location, distance, azimuth) in order from
-            newest to oldest, up to the given depth (0 means none of them and
-            None means all of them), skipping the current location and
-            (optionally) collapsing identical sequential locations into one
-            tuple.
+        if copy is None:
+            copy = Track.__new__(Track)
+            copy.table, copy.slot = table, self.slot
+            copy.history = self.history.copy()
+        elif copy.history.appends != self.history.appends:
+            copy.history.copyFrom(self.history)
+        copy.uniqueId, copy.flightNumber, copy.category = self.uniqueId, self.flightNumber, self.category
+        copy.squawk, copy.emergency = self.squawk, self.emergency
+        return copy
+
+    def isActive(self):
+        """Return True if the track is still in its table
         """
-        if depth == 0:
-            return []
-        numPts = depth if depth < (len(self.history) - 1) else -1
-
-        history = self.history[-2::-1]
-        if numPts > 0:
-            history = history[0:numPts]
-        trails = [(t.location, t.distance, t.azimuth) for n,t in enumerate(history) if (((n < 1) or (t.location != history[n - 1].location)) or not collapse)]
-        return trails[1:depth]
+        return self.slot is not None
+
+    def getHistory(self, depth, fields=('distance', 'azimuth')):
+        """Return a tuple of arrays (one per named history field) in order from
+          newest to oldest, up to the given depth (0 means none of them and
+          None or negative means all of them), skipping the current location
+
+          N.B. The arrays are views into the history buffer, so they're only
+               valid until the next update.
+        """
+        return self.history.get(fields, depth=depth, skip=1)
+
+
+def trackState(info):
+    """Return the non-volatile fields of an aircraft's info as a tuple
+    """
+    return tuple(info.get(k) for k in STATE_KEYS)
+
+def updateTracks(tracks, states, aircraftInfo, timestamp, selfLocation, reproject=False, geoMode=DEF_GEO_MODE):
+    """Apply a new snapshot of aircraft info to a table of tracks (both keyed
+       by uniqueId), doing work only for aircraft that were added, removed, or
+       changed since the last snapshot
+      Inputs:
+        tracks: TrackTable, updated in place
+        states: dict of trackState() tuples from the last call, updated in place
+        aircraftInfo: dict of per-aircraft info from the new snapshot
+        timestamp: time of the new snapshot
+        selfLocation: current location, as a geopy Point
+        reproject: if True, unchanged tracks are updated too (e.g., when the
+                   self location has moved)
+        geoMode: accuracy mode for the (batched) distance/azimuth calculation
+
+      Returns
+        the (added, removed, changed, unchanged) sets of uniqueIds
+    """
+    with PROFILER.stage("diff"):
+        newStates = {k: trackState(v) for k, v in aircraftInfo.items()}
+        added, removed, changed, unchanged = dictDiff(newStates, states)
+    if reproject:
+        changed |= unchanged
+        unchanged = set()
+    for uniqueId in removed:
+        del tracks[uniqueId]
+    work = [*added, *changed]
+    if work:
+        with PROFILER.stage("geodesy"):
+            distances, azimuths = distancesAndAzimuths(selfLocation.latitude, selfLocation.longitude,
+                                                       [aircraftInfo[k]['lat'] for k in work],
+                                                       [aircraftInfo[k]['lon'] for k in work], geoMode)
+        with PROFILER.stage("update"):
+            for uniqueId, distAzi in zip(work, zip(distances.tolist(), azimuths.tolist())):
+                if uniqueId in added:
+                    Track(timestamp, selfLocation, aircraftInfo[uniqueId], distAzi, tracks)
+                else:
+                    tracks[uniqueId].update(timestamp, selfLocation, aircraftInfo[uniqueId], distAzi)
+    with PROFILER.stage("refresh"):
+        for uniqueId in unchanged:
+            tracks[uniqueId].refresh(timestamp, aircraftInfo[uniqueId])
+    states.clear()
+    states.update(newStates)
+    tracks.version += 1
+    return added, removed, changed, unchanged
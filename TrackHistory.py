@@ -0,0 +1,109 @@
+################################################################################
+#
+# Track History module for pocket1090
+#
+# Fixed-capacity ring buffer of the past positions of a track, holding only
+#  the fields that trails need, in typed (NumPy) arrays.
+#
+# Each entry is written twice (at i and i + capacity) so that the newest N
+#  entries are always one contiguous slice, and reads are just views of the
+#  arrays -- no copying or reversing of lists on every frame.
+#
+################################################################################
+
+import numpy as np
+
+
+HISTORY_FIELDS = {'ts': np.float64,
+                  'lat': np.float64,
+                  'lon': np.float64,
+                  'distance': np.float32,
+                  'azimuth': np.float32,
+                  'altitude': np.float32}
+
+DEF_HISTORY_DEPTH = 300     # entries (i.e., ~5 mins at dump1090's default 1 sec interval)
+DEF_HISTORY_MAX_AGE = None  # secs, None means entries only expire when overwritten
+
+
+class TrackHistory():
+    """Ring buffer of (ts, lat, lon, distance, azimuth, altitude) entries
+
+      N.B. A new entry at the same location as the newest one replaces it
+           (i.e., identical sequential locations are collapsed into one).
+    """
+    def __init__(self, depth=DEF_HISTORY_DEPTH, maxAge=DEF_HISTORY_MAX_AGE):
+        if depth < 1:
+            raise ValueError("Invalid history depth, must be greater than zero")
+        self.capacity = depth
+        self.maxAge = maxAge
+        self.columns = {name: np.zeros(2 * depth, dtype=dtype) for name, dtype in HISTORY_FIELDS.items()}
+        self.head = 0   # where the next entry goes
+        self.count = 0
+        self.appends = 0  # incremented on every change, so copies can tell when they're out of date
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        """Return the memory used by the buffer's arrays (in bytes)
+        """
+        return sum(c.nbytes for c in self.columns.values())
+
+    def append(self, ts, lat, lon, distance, azimuth, altitude=None):
+        """Add a new entry, overwriting the oldest one if the buffer is full
+        """
+        cols = self.columns
+        newest = self.head + self.capacity - 1
+        if self.count and (cols['lat'][newest] == lat) and (cols['lon'][newest] == lon):
+            i = newest % self.capacity
+        else:
+            i = self.head
+            self.head = (i + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        values = (ts, lat, lon, distance, azimuth, np.nan if altitude is None else altitude)
+        for c, v in zip(cols.values(), values):
+            c[i] = v
+            c[i + self.capacity] = v
+        self.appends += 1
+
+    def get(self, fields=('distance', 'azimuth'), depth=None, skip=0, now=None):
+        """Return a tuple of array views (one per named field) of the newest
+           'depth' entries (None or negative means all of them) in newest to
+           oldest order, after skipping the newest 'skip' entries
+
+          If there's a max age, entries older than it (relative to 'now', or to
+          the newest entry if 'now' is None) are left out.
+        """
+        end = self.head + self.capacity - min(skip, self.count)
+        n = self.count - min(skip, self.count)
+        if (depth is not None) and (depth >= 0):
+            n = min(depth, n)
+        start = end - n
+        if (self.maxAge is not None) and n:
+            ts = self.columns['ts']
+            if now is None:
+                now = ts[self.head + self.capacity - 1]
+            start += int(np.searchsorted(ts[start:end], now - self.maxAge, side="left"))
+        return tuple(self.columns[f][start:end][::-1] for f in fields)
+
+    def copy(self):
+        """Return a copy of the buffer
+        """
+        history = TrackHistory(self.capacity, self.maxAge)
+        history.copyFrom(self)
+        return history
+
+    def copyFrom(self, other):
+        """Make this buffer a copy of another one
+        """
+        if other.capacity != self.capacity:
+            self.capacity = other.capacity
+            self.columns = {name: np.empty_like(column) for name, column in other.columns.items()}
+        for name, column in self.columns.items():
+            np.copyto(column, other.columns[name])
+        self.maxAge, self.head, self.count, self.appends = other.maxAge, other.head, other.count, other.appends
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.appends += 1
@@ -0,0 +1,434 @@
+################################################################################
+#
+# Track Server module for pocket1090
+#
+# Serves the current tracks to other programs (e.g., a web page, a logger, or
+#  another display) over a local HTTP and WebSocket API, from an asyncio event
+#  loop in a thread of its own:
+#  * GET /tracks: all of the current tracks
+#  * GET /tracks/<hex>: one track (404 if there's no such track)
+#  * GET /stream (WebSocket): all of the current tracks, and then one delta per
+#    snapshot with just the tracks that were added or changed, and the ids of
+#    the ones that were removed (i.e., updateTracks()'s dictDiff()
+#    classification), instead of all of the tracks again
+#
+# Messages are JSON (in text frames), or MessagePack (in binary frames) if
+#  msgspec or msgpack is installed, as selected by a 'format' query parameter
+#  (e.g., '/stream?format=msgpack'). Each message is encoded once per format,
+#  however many clients it's sent to:
+#  * {"type": "snapshot", "seq": <n>, "ts": <ts>, "tracks": [<track>, ...]}
+#  * {"type": "delta", "seq": <n>, "ts": <ts>, "added": [<track>, ...],
+#     "changed": [<track>, ...], "removed": [<hex>, ...]}
+#  where a track has its aircraft.json fields (e.g., "hex", "flight",
+#  "alt_geom"), its "distance", "azimuth", and "ts", but not the fields that
+#  have no value. A snapshot's seq is that of the last delta it includes, and
+#  each delta's is one more than the last one's, so a client can tell if it
+#  missed one.
+#
+# N.B. The volatile fields (i.e., 'seen', 'seen_pos', and 'rssi') are only
+#      sent when a track changes.
+#
+# Backpressure: each WebSocket client has a short queue of messages, and only
+#  one message in flight. A client that falls behind, so that its queue fills,
+#  has its queued deltas dropped and gets a new snapshot instead (of the tracks
+#  as of when it's sent) once it catches up, so a slow client costs a bounded
+#  amount of memory and never holds up the other clients (or the ingester). A
+#  client that doesn't take a message within SEND_TIMEOUT secs is dropped.
+#
+################################################################################
+
+import asyncio
+import base64
+from collections import deque
+import hashlib
+import json
+import logging
+import socket
+import struct
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from Aggregator import httpResponse, readRequest
+from Profiler import PROFILER
+from Track import TRACK_FIELDS
+from TrackTable import TRACK_COLUMNS
+
+
+DEF_API_HOST = "127.0.0.1"
+DEF_API_PORT = 8092
+DEF_QUEUE_SIZE = 8  # max messages queued for a WebSocket client before it's resynced
+
+SEND_BUFFER = 64 * 1024  # bytes of socket send buffer per WebSocket client (so slow ones are held back, not sent stale data)
+
+SEND_TIMEOUT = 30.0     # max secs a client can take to accept a message
+START_TIMEOUT = 5.0     # max secs to wait for the server to start
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT = 0x1
+WS_BINARY = 0x2
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+WS_MAX_CLIENT_FRAME = 4096  # clients only send control frames
+
+# Track attribute: message key
+TRACK_KEYS = {attr: k for k, (attr, _) in TRACK_FIELDS.items()}
+TRACK_KEYS.update(distance="distance", azimuth="azimuth", timestamp="ts")
+# (attribute, message key) of the fields that aren't TrackTable columns
+_SLOT_KEYS = tuple((attr, k) for attr, k in TRACK_KEYS.items() if attr not in TRACK_COLUMNS)
+# (row index, message key, True if the values are ints) of the TrackTable's columns
+_COLUMN_KEYS = tuple((indx, TRACK_KEYS[name], isInt) for indx, (name, isInt) in enumerate(TRACK_COLUMNS.items()))
+
+
+def _jsonEncode(obj):
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+if msgspec:
+    _msgpackEncode = msgspec.msgpack.Encoder().encode
+elif msgpack:
+    _msgpackEncode = msgpack.packb
+else:
+    _msgpackEncode = None
+
+# format: (encoder, WebSocket opcode, HTTP content type)
+ENCODERS = {'json': (_jsonEncode, WS_TEXT, "application/json")}
+if _msgpackEncode:
+    ENCODERS['msgpack'] = (_msgpackEncode, WS_BINARY, "application/msgpack")
+FORMATS = tuple(ENCODERS)
+
+
+def trackDicts(tracks, uniqueIds):
+    """Return a list of dicts of the fields that have values, with their
+       message keys, of the given tracks of a TrackTable
+
+      The tracks' rows are read from the table all at once, rather than a
+      field at a time.
+    """
+    selected = [tracks[uniqueId] for uniqueId in uniqueIds]
+    if not selected:
+        return []
+    rows = tracks.data[:, [track.slot for track in selected]].T.tolist()
+    dicts = []
+    for track, row in zip(selected, rows):
+        d = {}
+        for attr, k in _SLOT_KEYS:
+            v = getattr(track, attr)
+            if v is not None:
+                d[k] = v
+        for indx, k, isInt in _COLUMN_KEYS:
+            v = row[indx]
+            if v == v:
+                d[k] = int(v) if isInt else v
+        dicts.append(d)
+    return dicts
+
+
+def wsFrame(opcode, payload):
+    """Return an (unmasked, unfragmented) WebSocket frame
+    """
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < (1 << 16):
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+async def readFrame(reader, maxSize=WS_MAX_CLIENT_FRAME):
+    """Read a WebSocket frame from an asyncio stream, and return its opcode
+       and (unmasked) payload
+
+      Raises ValueError if the frame is bigger than maxSize.
+    """
+    b0, b1 = await reader.readexactly(2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if n > maxSize:
+        raise ValueError(f"WebSocket frame too big ({n} bytes)")
+    mask = await reader.readexactly(4) if (b1 & 0x80) else None
+    payload = await reader.readexactly(n)
+    if mask:
+        payload = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+    return b0 & 0x0F, payload
+
+
+class _Message():
+    """A message and its WebSocket frames, encoded in each format as needed
+    """
+    __slots__ = ('seq', 'obj', 'frames')
+
+    def __init__(self, seq, obj):
+        self.seq = seq
+        self.obj = obj
+        self.frames = {}
+
+    def frame(self, fmt):
+        f = self.frames.get(fmt)
+        if f is None:
+            encode, opcode, _ = ENCODERS[fmt]
+            f = self.frames[fmt] = wsFrame(opcode, encode(self.obj))
+        return f
+
+
+class _Client():
+    """A WebSocket client's queue of messages to send
+    """
+    def __init__(self, writer, fmt):
+        self.writer = writer
+        self.fmt = fmt
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.resync = True  # send a snapshot (first, or instead of the queued deltas)
+        self.lastSeq = -1
+        self.resyncs = 0
+
+    def push(self, msg, queueSize):
+        if not self.resync:
+            if len(self.queue) >= queueSize:
+                self.queue.clear()
+                self.resync = True
+                self.resyncs += 1
+            else:
+                self.queue.append(msg)
+        self.wakeup.set()
+
+
+class TrackServer():
+    """HTTP and WebSocket API for the tracks
+
+      publish() is called (e.g., by the ingester) after each snapshot has been
+      applied to the tracks, and the server keeps its own copy of the tracks'
+      fields, so it never touches the TrackTable from its own thread. A port of
+      0 picks a free port (which 'port' is then set to).
+    """
+    def __init__(self, host=DEF_API_HOST, port=DEF_API_PORT, queueSize=DEF_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.queueSize = queueSize
+        self.tracks = {}  # uniqueId: track dict
+        self.seq = 0
+        self.ts = None
+        self.snapshotFrames = {}  # format: frame of the snapshot at the current seq
+        self.clients = set()
+        self.handlers = {}  # connection's handler task: its writer
+        self.connections = 0
+        self.resyncs = 0
+        self.dropped = 0
+        self.loop = None
+        self.error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self._serve(),), daemon=True)
+        self.thread.start()
+        if not self.ready.wait(START_TIMEOUT):
+            raise RuntimeError("Track server didn't start")
+        if self.error:
+            raise self.error
+        logging.info(f"Serving the tracks at http://{self.host}:{self.port}/tracks and ws://{self.host}:{self.port}/stream")
+
+    def __repr__(self):
+        return (f"{len(self.clients)} clients ({self.connections} connections), seq={self.seq}, "
+                f"{self.resyncs + sum(c.resyncs for c in self.clients)} resyncs, {self.dropped} dropped")
+
+    def publish(self, ts, tracks, added, changed, removed):
+        """Send the clients a delta of the tracks that were added, changed, and
+           removed (i.e., the uniqueIds returned by updateTracks()) in the
+           snapshot at the given time
+
+          N.B. This reads the tracks, so it must be called while holding the
+               tracks lock, or by whatever is the only thing that updates them.
+        """
+        if self.loop is None:
+            return
+        with PROFILER.stage("api"):
+            delta = {'type': "delta", 'seq': None, 'ts': ts,
+                     'added': trackDicts(tracks, added),
+                     'changed': trackDicts(tracks, changed),
+                     'removed': list(removed)}
+        self.loop.call_soon_threadsafe(self._broadcast, delta)
+
+    def _broadcast(self, delta):
+        """Apply a delta to the server's copy of the tracks, and queue it for
+           all of the clients
+        """
+        with PROFILER.stage("fanout"):
+            self.seq += 1
+            delta['seq'] = self.seq
+            self.ts = delta['ts']
+            self.snapshotFrames = {}
+            for t in delta['added']:
+                self.tracks[t['hex']] = t
+            for t in delta['changed']:
+                self.tracks[t['hex']] = t
+            for uniqueId in delta['removed']:
+                self.tracks.pop(uniqueId, None)
+            msg = _Message(self.seq, delta)
+            for client in self.clients:
+                client.push(msg, self.queueSize)
+
+    def _snapshot(self):
+        return {'type': "snapshot", 'seq': self.seq, 'ts': self.ts, 'tracks': list(self.tracks.values())}
+
+    def _snapshotFrame(self, fmt):
+        """Return the frame of a snapshot of the current tracks, in the given
+           format (shared by all of the clients that need one at this seq)
+        """
+        f = self.snapshotFrames.get(fmt)
+        if f is None:
+            f = self.snapshotFrames[fmt] = _Message(self.seq, self._snapshot()).frame(fmt)
+        return f
+
+    async def _sendLoop(self, client):
+        """Send a client its snapshots and deltas, one at a time
+        """
+        while True:
+            await client.wakeup.wait()
+            client.wakeup.clear()
+            while client.resync or client.queue:
+                if client.resync:
+                    client.resync = False
+                    client.lastSeq = self.seq
+                    data = self._snapshotFrame(client.fmt)
+                else:
+                    msg = client.queue.popleft()
+                    if msg.seq <= client.lastSeq:
+                        continue
+                    client.lastSeq = msg.seq
+                    data = msg.frame(client.fmt)
+                client.writer.write(data)
+                await asyncio.wait_for(client.writer.drain(), SEND_TIMEOUT)
+
+    async def _receiveLoop(self, reader, client):
+        """Handle a client's control frames, until it closes the connection
+        """
+        while True:
+            opcode, payload = await readFrame(reader)
+            if opcode == WS_CLOSE:
+                client.writer.write(wsFrame(WS_CLOSE, payload[:2]))
+                return
+            if opcode == WS_PING:
+                client.writer.write(wsFrame(WS_PONG, payload))
+
+    async def _stream(self, reader, writer, key, fmt):
+        """Upgrade a connection to a WebSocket and stream the tracks on it
+        """
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        writer.transport.set_write_buffer_limits(SEND_BUFFER)
+        client = _Client(writer, fmt)
+        self.clients.add(client)
+        self.connections += 1
+        client.wakeup.set()
+        tasks = [asyncio.create_task(self._sendLoop(client)), asyncio.create_task(self._receiveLoop(reader, client))]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if isinstance(task.exception(), asyncio.TimeoutError):
+                    self.dropped += 1
+                    logging.info("Dropped a WebSocket client that stopped reading")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.clients.discard(client)
+            self.resyncs += client.resyncs
+
+    async def _handleClient(self, reader, writer):
+        """Serve HTTP/1.1 requests on a connection, until it's closed or
+           upgraded to a WebSocket
+        """
+        task = asyncio.current_task()
+        self.handlers[task] = writer
+        try:
+            while True:
+                request = await readRequest(reader)
+                if request is None:
+                    writer.write(httpResponse(400, keepAlive=False))
+                    break
+                method, target, headers, keepAlive = request
+                url = urlsplit(target)
+                fmt = parse_qs(url.query).get('format', ["json"])[0]
+                if method != "GET":
+                    response = httpResponse(405, keepAlive=keepAlive)
+                elif fmt not in ENCODERS:
+                    response = httpResponse(400, f"Unknown format: {fmt}\n".encode(), keepAlive=keepAlive)
+                elif url.path == "/stream":
+                    if (headers.get("upgrade", "").lower() != "websocket") or ("sec-websocket-key" not in headers):
+                        response = httpResponse(400, b"WebSocket upgrade required\n", keepAlive=False)
+                    else:
+                        await self._stream(reader, writer, headers['sec-websocket-key'], fmt)
+                        break
+                elif url.path == "/tracks":
+                    response = self._httpBody(self._snapshot(), fmt, keepAlive)
+                elif url.path.startswith("/tracks/") and (url.path[8:] in self.tracks):
+                    response = self._httpBody(self.tracks[url.path[8:]], fmt, keepAlive)
+                else:
+                    response = httpResponse(404, keepAlive=keepAlive)
+                writer.write(response)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            del self.handlers[task]
+            writer.close()
+
+    @staticmethod
+    def _httpBody(obj, fmt, keepAlive):
+        encode, _, contentType = ENCODERS[fmt]
+        return httpResponse(200, encode(obj), {'Content-Type': contentType, 'Cache-Control': "no-cache"}, keepAlive)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handleClient, self.host, self.port)
+        except OSError as e:
+            self.error = e
+            self.loop = None
+            self.ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        await self.stopping.wait()
+        server.close()
+        # closing the connections ends their handlers (cancelling them instead
+        #  makes asyncio log an error for each one)
+        handlers = list(self.handlers)
+        for writer in self.handlers.values():
+            writer.close()
+        if handlers:
+            await asyncio.wait(handlers, timeout=START_TIMEOUT)
+
+    def close(self):
+        """Stop the server (and disconnect all of the clients)
+        """
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join(START_TIMEOUT)
@@ -2,102 +2,297 @@
 #
 # Track Statistics module for pocket1090
 #
+# Statistics of the tracks over sliding time windows (by default, the last
+#  minute, the last 15 minutes, and the whole session), updated once for each
+#  aircraft that was added or changed in a snapshot (not on every frame), in
+#  constant time:
+#  * the number of distinct aircraft seen, and a histogram of their emitter
+#    categories (each aircraft is counted once per window)
+#  * histograms, percentiles, min, max, and mean of their altitude, vertical
+#    rate, speed, distance, and RSSI
+#
+# The histograms are the quantile sketches: they have fixed-width bins, so
+#  adding a sample is constant time and the percentiles are interpolated within
+#  a bin, and a sliding window is a ring of sub-window buckets that are dropped
+#  as they expire (which a P^2 or t-digest sketch couldn't do). So a window is
+#  the last (numBuckets - 1) to numBuckets buckets' worth of samples.
+#
+# Windows are in snapshot time (i.e., the tracks' timestamps), so replays and
+#  synthetic traffic at N times real time work the same as live traffic.
+#
 ################################################################################
 
-import json
-import logging
-import sys
-import time
+from collections import OrderedDict
+import math
+import threading
 
 
-class TrackStats():
-    """ #### TODO
-      N.B. The averages are trailing exponential averages
+# window name: length in secs (None means the whole session)
+DEF_WINDOWS = {'1min': 60.0, '15min': 900.0, 'session': None}
+DEF_BUCKETS = 12  # buckets per window
+
+# field name: (lowest bin, highest bin, bin width), values outside of the bins go in the end bins
+STAT_FIELDS = {'altitude': (-1000.0, 50000.0, 100.0),  # feet
+               'rate': (-6050.0, 6050.0, 100.0),       # feet per minute (level flight is the middle of a bin)
+               'speed': (0.0, 700.0, 5.0),             # knots
+               'distance': (0.0, 400.0, 1.0),          # Km
+               'rssi': (-50.0, 0.0, 0.5)}              # dBFS
+STAT_UNITS = {'altitude': "ft", 'rate': "fpm", 'speed': "kts", 'distance': "Km", 'rssi': "dBFS"}
+
+
+def _trackValues(track):
+    """Return a dict of a track's values of the STAT_FIELDS (or None)
     """
-    def __init__(self):
-        self.resetStats()
+    rate = track.geomRate
+    if rate is None:
+        rate = track.baroRate
+    return {'altitude': track.altitude, 'rate': rate, 'speed': track.speed,
+            'distance': track.distance, 'rssi': track.rssi}
 
-    def resetStats(self):
-        """ #### TODO
+
+class RollingHistograms():
+    """Fixed-width-bin histograms (plus count, sum, min, and max) of each of
+       the STAT_FIELDS, over a sliding time window (or ever, if the window is
+       None)
+
+      The bins of all of the fields are in one flat list, so adding a sample
+      of every field only has to find the current bucket once.
+    """
+    def __init__(self, window=None, numBuckets=DEF_BUCKETS, fields=STAT_FIELDS):
+        self.window = window
+        self.numBuckets = numBuckets if window else 1
+        self.bucketLen = (window / numBuckets) if window else None
+        self.fields = list(fields)
+        self.bins = {}  # field: (offset, number of bins, lowest bin, bin width)
+        numBins = 0
+        for f, (lo, hi, binWidth) in fields.items():
+            if (binWidth <= 0) or (hi <= lo):
+                raise ValueError(f"Invalid histogram bins for '{f}'")
+            n = int(math.ceil((hi - lo) / binWidth))
+            self.bins[f] = (numBins, n, lo, binWidth)
+            numBins += n
+        self.numBins = numBins
+        self.buckets = [[0] * numBins for _ in range(self.numBuckets)]
+        self.bucketStats = [self._emptyStats() for _ in range(self.numBuckets)]
+        self.totals = [0] * numBins
+        self.current = 0  # index of the newest bucket (i.e., its start time / bucketLen)
+
+    def _emptyStats(self):
+        # per field: count, sum, min, max
+        return [[0, 0.0, math.inf, -math.inf] for _ in self.fields]
+
+    def advance(self, now):
+        """Expire the buckets that are older than the window at the given time
         """
-        self.uids = set([])
+        if not self.window:
+            return
+        indx = int(now // self.bucketLen)
+        if indx <= self.current:
+            return
+        totals = self.totals
+        for i in range(self.current + 1, min(indx, self.current + self.numBuckets) + 1):
+            b = i % self.numBuckets
+            if any(s[0] for s in self.bucketStats[b]):
+                for n, c in enumerate(self.buckets[b]):
+                    if c:
+                        totals[n] -= c
+                self.buckets[b] = [0] * self.numBins
+                self.bucketStats[b] = self._emptyStats()
+        self.current = indx
 
-        self.maxAltitude = -1
-        self.minAltitude = sys.maxsize
-        self.avgAltitude = 0
+    def binIndex(self, field, x):
+        """Return the index of the (flat) bin that a value of a field goes in
+        """
+        offset, n, lo, binWidth = self.bins[field]
+        return offset + min(max(int((x - lo) // binWidth), 0), n - 1)
 
-        self.maxRate = -1
-        self.minRate = sys.maxsize
-        self.avgRate = 0
+    def add(self, ts, samples):
+        """Add a list of (field index, flat bin index, value) samples, observed
+           at the given time
+        """
+        self.advance(ts)
+        b = self.current % self.numBuckets
+        bucket, stats, totals = self.buckets[b], self.bucketStats[b], self.totals
+        for f, n, x in samples:
+            bucket[n] += 1
+            totals[n] += 1
+            s = stats[f]
+            s[0] += 1
+            s[1] += x
+            if x < s[2]:
+                s[2] = x
+            if x > s[3]:
+                s[3] = x
 
-        self.maxSpeed = -1
-        self.minSpeed = sys.maxsize
-        self.avgSpeed = 0
+    def percentile(self, field, pct):
+        """Return the given percentile (0-100) of a field, interpolated within
+           its bin (or None if there are no values in the window)
+        """
+        offset, numBins, lo, binWidth = self.bins[field]
+        counts = self.totals[offset:offset + numBins]
+        total = sum(counts)
+        if not total:
+            return None
+        target = (pct / 100.0) * total
+        cum = 0
+        for n, c in enumerate(counts):
+            if c and (cum + c) >= target:
+                return lo + ((n + ((target - cum) / c)) * binWidth)
+            cum += c
+        return lo + (numBins * binWidth)
 
-        self.categoryCounts = {l: {str(n): 0 for n in range(8)} for l in list("ABCDE")}
-        self.unkCategoryCount = 0
+    def summary(self, field):
+        """Return a dict of the count, mean, min, max, and median and 90th
+           percentile of a field's values in the window
+        """
+        f = self.fields.index(field)
+        stats = [bs[f] for bs in self.bucketStats]
+        count = sum(s[0] for s in stats)
+        if not count:
+            return {'count': 0, 'mean': None, 'min': None, 'max': None, 'p50': None, 'p90': None}
+        return {'count': count,
+                'mean': sum(s[1] for s in stats) / count,
+                'min': min(s[2] for s in stats),
+                'max': max(s[3] for s in stats),
+                'p50': self.percentile(field, 50),
+                'p90': self.percentile(field, 90)}
+
+    def histogram(self, field):
+        """Return a list of (bin low edge, count) of a field's values in the
+           window
+        """
+        offset, numBins, lo, binWidth = self.bins[field]
+        return [(lo + (n * binWidth), c) for n, c in enumerate(self.totals[offset:offset + numBins])]
 
-        self.maxRSSI = -sys.maxsize
-        self.minRSSI = 0
-        self.avgRSSI = 0
 
-        self.maxDistance = -1
-        self.minDistance = sys.maxsize
-        self.avgDistance = 0
+class AircraftWindow():
+    """The distinct aircraft seen within a sliding time window (or ever, if
+       the window is None), and how many of them are in each category
+    """
+    def __init__(self, window=None):
+        self.window = window
+        self.lastSeen = OrderedDict()  # uniqueId: (ts, category), least recently seen first
+        self.categories = {}
+
+    def __len__(self):
+        return len(self.lastSeen)
+
+    def seen(self, ts, uniqueId, category):
+        prev = self.lastSeen.pop(uniqueId, None)
+        if (prev is None) or (prev[1] != category):
+            if prev is not None:
+                self._uncount(prev[1])
+            self.categories[category] = self.categories.get(category, 0) + 1
+        self.lastSeen[uniqueId] = (ts, category)
+
+    def _uncount(self, category):
+        self.categories[category] -= 1
+        if not self.categories[category]:
+            del self.categories[category]
+
+    def advance(self, now):
+        """Forget the aircraft that haven't been seen within the window
+        """
+        if not self.window:
+            return
+        lastSeen, oldest = self.lastSeen, now - self.window
+        while lastSeen:
+            uniqueId, (ts, category) = next(iter(lastSeen.items()))
+            if ts >= oldest:
+                break
+            lastSeen.popitem(last=False)
+            self._uncount(category)
+
+
+class TrackStats():
+    """Windowed statistics of the tracks
+
+      update() is called (e.g., by the ingester) with each track that was
+      added or changed, and the rest can be called from other threads.
+    """
+    def __init__(self, windows=DEF_WINDOWS, numBuckets=DEF_BUCKETS):
+        self.windows = windows
+        self.numBuckets = numBuckets
+        self.lock = threading.Lock()
+        self.resetStats()
+
+    def resetStats(self):
+        """Clear all of the stats
+        """
+        with self.lock:
+            self.now = None
+            self.samples = 0
+            self.aircraft = {w: AircraftWindow(secs) for w, secs in self.windows.items()}
+            self.histograms = {w: RollingHistograms(secs, self.numBuckets) for w, secs in self.windows.items()}
 
     def update(self, track):
-        """ #### TODO
+        """Add a sample of a track that was added or changed
         """
-        self.uids.add(track.uniqueId)
-
-        if isinstance(track.altitude, int):
-            self.avgAltitude = (track.altitude / 2) + (self.avgAltitude / 2)
-            self.maxAltitude = track.altitude if track.altitude > self.maxAltitude else self.maxAltitude
-            self.minAltitude = track.altitude if track.altitude < self.minAltitude else self.minAltitude
-
-        rate = None
-        if isinstance(track.geomRate, int):
-            rate = track.geomRate
-        elif isinstance(track.baroRate, int):
-            rate = track.baroRate
-        if rate is not None:
-            self.avgRate = (rate / 2) + (self.avgRate / 2)
-            self.maxRate = rate if rate > self.maxRate else self.maxRate
-            self.minRate = rate if rate < self.minRate else self.minRate
-
-        if isinstance(track.speed, float):
-            self.avgSpeed = (track.speed / 2) + (self.avgSpeed / 2)
-            self.maxSpeed = track.speed if track.speed > self.maxSpeed else self.maxSpeed
-            self.minSpeed = track.speed if track.speed < self.minSpeed else self.minSpeed
-
-        if isinstance(track.distance, float):
-            self.avgDistance = (track.distance / 2) + (self.avgDistance / 2)
-            self.maxDistance = track.distance if track.distance > self.maxDistance else self.maxDistance
-            self.minDistance = track.distance if track.distance < self.minDistance else self.minDistance
-
-        if track.category[0] in list("ABCDE"):
-            self.categoryCounts[track.category[0]][track.category[1]] += 1
-        elif track.category[0] == "?":
-            self.unkCategoryCount += 1
-
-        if isinstance(track.rssi, float):
-            self.avgRSSI = (track.rssi / 2) + (self.avgRSSI / 2)
-            self.maxRSSI = track.rssi if track.rssi > self.maxRSSI else self.maxRSSI
-            self.minRSSI = track.rssi if track.rssi < self.minRSSI else self.minRSSI
+        ts = track.timestamp
+        category = track.category if (track.category and track.category[0] in "ABCD") else "?"
+        # all of the windows have the same bins
+        binIndex = next(iter(self.histograms.values())).binIndex
+        samples = [(f, binIndex(field, v), v) for f, (field, v) in enumerate(_trackValues(track).items()) if v is not None]
+        with self.lock:
+            if (self.now is None) or (ts > self.now):
+                self.now = ts
+            self.samples += 1
+            for w, aircraft in self.aircraft.items():
+                aircraft.seen(ts, track.uniqueId, category)
+                aircraft.advance(self.now)
+                self.histograms[w].add(ts, samples)
 
-    def printStats(self):
-        """ #### TODO
+    def summary(self, window):
+        """Return a dict of the number of aircraft, the category histogram, and
+           the summary of each of the fields, in the named window
         """
-        print(f"Number of UniqueIds: {len(self.uids)}")
-        print(f"Altitude: min={self.minAltitude}, max={self.maxAltitude}, avg={self.avgAltitude:.2f}")
-        print(f"Rate:     min={self.minRate}, max={self.maxRate}, avg={self.avgRate:.2f}")
-        print(f"Speed:    min={self.minSpeed}, max={self.maxSpeed}, avg={self.avgSpeed:.2f}")
-        print(f"Distance: min={self.minDistance:.2f}, max={self.maxDistance:.2f}, avg={self.avgDistance:.2f}")
-        print(f"RSSI:     min={self.minRSSI}, max={self.maxRSSI}, avg={self.avgRSSI:.2f}")
-        print("Categories:")
-        for a in list("ABCDE"):
-            print (f"{a}: {self.categoryCounts[a]}")
-        print("")
+        with self.lock:
+            aircraft = self.aircraft[window]
+            histograms = self.histograms[window]
+            if self.now is not None:
+                aircraft.advance(self.now)
+                histograms.advance(self.now)
+            return {'aircraft': len(aircraft),
+                    'categories': dict(sorted(aircraft.categories.items())),
+                    'fields': {f: histograms.summary(f) for f in STAT_FIELDS}}
+
+    def histogram(self, window, field):
+        """Return a list of (bin low edge, count) of a field in the named window
+        """
+        with self.lock:
+            histograms = self.histograms[window]
+            if self.now is not None:
+                histograms.advance(self.now)
+            return histograms.histogram(field)
 
-    #### TODO make histogram of categories seen
+    def infoLines(self, window=None):
+        """Return lines of text summarizing the stats of the named window
+           (default: the longest one that isn't the whole session), for the
+           info panel
+        """
+        if window is None:
+            timed = [w for w, secs in self.windows.items() if secs]
+            window = max(timed, key=self.windows.get) if timed else next(iter(self.windows))
+        counts = ", ".join(f"{w}={self.summary(w)['aircraft']}" for w in self.windows)
+        s = self.summary(window)
+        lines = [f"Aircraft:        {counts}"]
+        for f, v in s['fields'].items():
+            if v['count']:
+                lines.append(f"{f.capitalize() + ' (' + window + '):': <17}p50={v['p50']:.0f}, p90={v['p90']:.0f}, "
+                             f"min={v['min']:.0f}, max={v['max']:.0f} {STAT_UNITS[f]}")
+        cats = " ".join(f"{c}={n}" for c, n in s['categories'].items())
+        lines.append(f"{'Categories (' + window + '):': <17}{cats}")
+        return lines
 
+    def printStats(self):
+        """Print the stats of all of the windows
+        """
+        for window in self.windows:
+            s = self.summary(window)
+            print(f"{window}: {s['aircraft']} aircraft")
+            for f, v in s['fields'].items():
+                if v['count']:
+                    print(f"  {f: <9} n={v['count']: <7} mean={v['mean']:9.1f} min={v['min']:9.1f} p50={v['p50']:9.1f} "
+                          f"p90={v['p90']:9.1f} max={v['max']:9.1f} {STAT_UNITS[f]}")
+            print(f"  categories: {s['categories']}")
+        print("")
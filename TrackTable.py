@@ -0,0 +1,219 @@
+################################################################################
+#
+# Track Table module for pocket1090
+#
+# Columnar store for the current state of all tracks: one (NumPy) column per
+#  numeric field, indexed by slot, with a map from uniqueId (ICAO hex) to slot
+#  and a free list so that slots of removed tracks get reused.
+#
+# Track objects are views of a row of the table (see Track.py), so code that
+#  works on one track can keep using its attributes, while sorting, ranging,
+#  selection, etc. can operate on whole columns.
+#
+# The columns are the rows of one 2D array, so a track's whole row can be
+#  written with a single assignment.
+#
+# N.B. Missing values (None) are stored as NaN, as are non-numeric ones (e.g.,
+#      dump1090's alt_baro of "ground").
+#
+################################################################################
+
+import numpy as np
+
+from Geodesy import deadReckon
+
+
+# column name: True if the values are ints
+TRACK_COLUMNS = {'altitude': True,
+                 'baroAltitude': True,
+                 'speed': False,
+                 'heading': False,
+                 'geomRate': True,
+                 'baroRate': True,
+                 'lat': False,
+                 'lon': False,
+                 'seenPos': False,
+                 'seen': False,
+                 'rssi': False,
+                 'timestamp': False,
+                 'distance': False,
+                 'azimuth': False}
+
+DEF_TABLE_CAPACITY = 64
+
+
+class TrackTable():
+    """Slot-indexed columns of track state, keyed by uniqueId
+
+      Supports the dict-like operations (len, in, [], del, keys(), values(),
+      items()) that the rest of the code uses on collections of tracks.
+
+      'version' is incremented (by updateTracks()) each time a snapshot is
+      applied, so readers can tell whether anything has changed.
+    """
+    def __init__(self, capacity=DEF_TABLE_CAPACITY):
+        self.capacity = 0
+        self.data = np.empty((len(TRACK_COLUMNS), 0), dtype=np.float64)
+        self.columns = {}
+        self.active = np.zeros(0, dtype=bool)
+        self.tracks = []
+        self.index = {}
+        self.freeSlots = []
+        self.version = 0
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        """Increase the capacity of all of the columns
+        """
+        extra = capacity - self.capacity
+        self.data = np.concatenate((self.data, np.full((len(TRACK_COLUMNS), extra), np.nan)), axis=1)
+        self.columns = dict(zip(TRACK_COLUMNS, self.data))
+        self.active = np.concatenate((self.active, np.zeros(extra, dtype=bool)))
+        self.tracks.extend([None] * extra)
+        self.freeSlots.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def alloc(self, uniqueId, track):
+        """Allocate a slot for the given track and return it
+        """
+        if uniqueId in self.index:
+            raise KeyError(f"Track '{uniqueId}' already in table")
+        if not self.freeSlots:
+            self._grow(2 * self.capacity)
+        slot = self.freeSlots.pop()
+        self.index[uniqueId] = slot
+        self.tracks[slot] = track
+        self.active[slot] = True
+        return slot
+
+    def release(self, uniqueId):
+        """Remove a track from the table and return its slot to the free list
+        """
+        slot = self.index.pop(uniqueId)
+        track = self.tracks[slot]
+        track.slot = None
+        self.tracks[slot] = None
+        self.active[slot] = False
+        self.data[:, slot] = np.nan
+        self.freeSlots.append(slot)
+
+    def get(self, name, slot):
+        """Return the value of the named column at the given slot (or None)
+        """
+        v = float(self.columns[name][slot])
+        if v != v:
+            return None
+        return int(v) if TRACK_COLUMNS[name] else v
+
+    def set(self, name, slot, value):
+        """Set the value of the named column at the given slot
+        """
+        try:
+            self.columns[name][slot] = np.nan if value is None else value
+        except (TypeError, ValueError):
+            self.columns[name][slot] = np.nan
+
+    def setRow(self, slot, values):
+        """Set the values of all of the columns (in TRACK_COLUMNS order) at the
+           given slot
+        """
+        try:
+            self.data[:, slot] = values
+        except (TypeError, ValueError):
+            for column, value in zip(self.data, values):
+                try:
+                    column[slot] = np.nan if value is None else value
+                except (TypeError, ValueError):
+                    column[slot] = np.nan
+
+    def copyFrom(self, source):
+        """Make this table a copy of the source table, with the tracks in the
+           same slots (e.g., so that it can be read without holding the lock
+           that the source is updated under)
+
+          The copies of the tracks that are still in the source are kept (see
+          Track.copyTo()), so they stay the same objects from one copy to the
+          next, and those of the ones that were removed are released.
+        """
+        if self.capacity < source.capacity:
+            self._grow(source.capacity)
+        n = source.capacity
+        self.data[:, :n] = source.data
+        self.active[:n] = source.active
+        tracks = self.tracks
+        for uniqueId, slot in self.index.items():
+            if source.index.get(uniqueId) != slot:
+                tracks[slot].slot = None
+                tracks[slot] = None
+        for slot in source.index.values():
+            tracks[slot] = source.tracks[slot].copyTo(self, tracks[slot])
+        self.index = dict(source.index)
+        self.freeSlots = list(source.freeSlots)
+        self.version = source.version
+
+    def slots(self):
+        """Return an array of the slots that are in use
+        """
+        return np.flatnonzero(self.active)
+
+    def column(self, name, slots=None):
+        """Return the named column's values for the given slots (default: all
+           of the ones in use)
+        """
+        return self.columns[name][self.slots() if slots is None else slots]
+
+    def sortedTracks(self, key='distance', reverse=False):
+        """Return a list of the tracks sorted by the named column
+        """
+        slots = self.slots()
+        order = np.argsort(self.columns[key][slots], kind="stable")
+        if reverse:
+            order = order[::-1]
+        return [self.tracks[s] for s in slots[order].tolist()]
+
+    def predict(self, now, maxAge):
+        """Return arrays (indexed by slot) of the distances and azimuths of all
+           of the tracks dead-reckoned to the given time, from their positions'
+           ages, speeds, and headings
+
+          Positions are extrapolated by no more than 'maxAge' secs past their
+          last update, and those of unused slots are NaN.
+        """
+        cols = self.columns
+        ages = (now - cols['timestamp']) + np.nan_to_num(cols['seenPos'])
+        ages = np.clip(np.nan_to_num(ages), 0.0, maxAge)
+        return deadReckon(cols['distance'], cols['azimuth'], cols['speed'], cols['heading'], ages)
+
+    def rowBytes(self):
+        """Return the number of bytes of column storage per track
+        """
+        return (self.data.shape[0] * self.data.itemsize) + self.active.itemsize
+
+    def nbytes(self):
+        """Return the number of bytes used by all of the columns
+        """
+        return self.data.nbytes + self.active.nbytes
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, uniqueId):
+        return uniqueId in self.index
+
+    def __getitem__(self, uniqueId):
+        return self.tracks[self.index[uniqueId]]
+
+    def __delitem__(self, uniqueId):
+        self.release(uniqueId)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return [self.tracks[s] for s in self.index.values()]
+
+    def items(self):
+        return [(k, self.tracks[s]) for k, s in self.index.items()]
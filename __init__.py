@@ -125,8 +125,12 @@ class Coordinate:
         new.y = new.y if new.y >= 0.0 else 0.0
 
 def cpuTemp():
-    """ #### TODO
+    """Return the CPU temperature in degrees C, or None if it isn't available
+       (e.g., not on a RasPi)
     """
-    with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-        mC = float(f.read().strip())
-        return (mC / 1000.0)
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+            mC = float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return (mC / 1000.0)
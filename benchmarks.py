@@ -0,0 +1,1520 @@
+#!/usr/bin/env python3
+################################################################################
+#
+# Benchmarks for pocket1090
+#
+# Each benchmark is a sub-command, e.g.:
+#   ./benchmarks.py watch -n 50
+#
+################################################################################
+
+import argparse
+from collections import deque
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from geopy import Point
+from geopy import distance as geoDistance
+import numpy as np
+
+from AircraftSource import AircraftSource, HttpSource, SyntheticSource
+from FileWatcher import FileWatcher
+import Geodesy
+import NetSource
+from Track import Track, updateTracks
+from TrackTable import TrackTable
+
+
+SELF_LOCATION = Point(37.4, -122.0)
+
+
+def percentile(values, pct):
+    """Return the given percentile (0-100) of a list of values
+    """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    indx = min(len(values) - 1, int(round((pct / 100.0) * (len(values) - 1))))
+    return values[indx]
+
+def printLatencies(label, latencies):
+    """Print summary statistics for a list of latencies (in secs) in msecs
+    """
+    ms = [l * 1000.0 for l in latencies]
+    print(f"{label: <32} n={len(ms): <5} mean={statistics.fmean(ms):8.3f}ms  p50={percentile(ms, 50):8.3f}ms  p99={percentile(ms, 99):8.3f}ms  max={max(ms):8.3f}ms")
+
+def check(label, ok):
+    """Print the result of a behavior check, and exit with an error if it failed
+    """
+    print(f"{label: <32} {'ok' if ok else 'FAILED'}")
+    if not ok:
+        sys.exit(1)
+
+
+def benchWatch(opts):
+    """End-to-end latency from dump1090-style atomic rename of aircraft.json
+       to the parsed snapshot being available, for inotify vs. polling
+    """
+    snapshot = {'now': 0, 'messages': 0,
+                'aircraft': [{'hex': f"{n:06x}", 'lat': 37.0, 'lon': -122.0} for n in range(opts.aircraft)]}
+    for useInotify in (True, False):
+        with tempfile.TemporaryDirectory() as dirPath:
+            aircraftFile = os.path.join(dirPath, "aircraft.json")
+            watcher = FileWatcher(aircraftFile, pollInterval=opts.pollInterval, useInotify=useInotify)
+            renameTimes = {}
+
+            def writer():
+                for n in range(opts.count):
+                    time.sleep(opts.interval)
+                    snapshot['now'] = n
+                    tmpFile = aircraftFile + ".tmp"
+                    with open(tmpFile, "w") as f:
+                        json.dump(snapshot, f)
+                    renameTimes[n] = time.perf_counter()
+                    os.replace(tmpFile, aircraftFile)
+
+            t = threading.Thread(target=writer, daemon=True)
+            t.start()
+            latencies = []
+            while len(latencies) < opts.count:
+                if watcher.wait(opts.interval * 4) is None:
+                    break
+                with open(aircraftFile, "r") as f:
+                    j = json.load(f)
+                latencies.append(time.perf_counter() - renameTimes[j['now']])
+            t.join()
+            watcher.close()
+            printLatencies(f"{watcher.mode} ({opts.pollInterval}s)" if watcher.mode == "poll" else watcher.mode, latencies)
+
+
+def beastCapture(numAircraft, numMsgs, seed=0):
+    """Return a Beast byte stream with a mix of identification, position and
+       velocity frames for the given number of aircraft
+    """
+    rnd = random.Random(seed)
+    aircraft = [(f"{rnd.randrange(1 << 24):06x}", 37.4 + rnd.uniform(-1, 1), -122.0 + rnd.uniform(-1, 1),
+                 rnd.randrange(1000, 40000, 25), rnd.uniform(100, 500), rnd.uniform(0, 360))
+                for _ in range(numAircraft)]
+    frames = []
+    for n in range(numMsgs):
+        icao, lat, lon, alt, speed, heading = aircraft[n % numAircraft]
+        kind = (n // numAircraft) % 4
+        if kind == 0:
+            msg = NetSource.encodeIdentification(icao, f"N{n % 10000}")
+        elif kind == 3:
+            msg = NetSource.encodeVelocity(icao, speed, heading)
+        else:
+            msg = NetSource.encodeAirbornePosition(icao, lat, lon, alt, kind & 1)
+        frames.append(NetSource.encodeBeast(msg, n, rnd.randrange(20, 255)))
+    return b"".join(frames)
+
+def sbsCapture(numAircraft, numMsgs, seed=0):
+    """Return an SBS BaseStation byte stream of position messages
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for n in range(numMsgs):
+        icao = f"{(n % numAircraft) * 7919:06X}"
+        lines.append(f"MSG,3,1,1,{icao},1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,{rnd.randrange(1000, 40000, 25)},,,"
+                     f"{37.4 + rnd.uniform(-1, 1):.5f},{-122.0 + rnd.uniform(-1, 1):.5f},,,0,0,0,0\r\n")
+    return "".join(lines).encode("ascii")
+
+
+def replayNet(data, fmt):
+    """Return the decoder of a NetSource that has read the whole of a Beast or
+       SBS byte stream from a local replay server
+    """
+    server = NetSource.ReplayServer(data)
+    source = NetSource.NetSource(server.host, server.port, fmt)
+    try:
+        while True:
+            source.read(1.0)
+    except EOFError:
+        pass
+    source.close()
+    server.close()
+    return source.decoder
+
+def checkNet():
+    """Check that replayed Beast and SBS streams decode to the aircraft that
+       were encoded in them
+    """
+    known = {"a1b2c3": ("UAL123", 37.61234, -122.38765, 12000, 450.0, 90.0),
+             "c0ffee": ("N42", 36.95, -121.5, 3500, 120.0, 225.0)}
+    frames = []
+    for icao, (flight, lat, lon, alt, speed, heading) in known.items():
+        frames += [NetSource.encodeIdentification(icao, flight), NetSource.encodeAirbornePosition(icao, lat, lon, alt, 0),
+                   NetSource.encodeAirbornePosition(icao, lat, lon, alt, 1), NetSource.encodeVelocity(icao, speed, heading)]
+    # a DF4 altitude reply, whose address is only in its parity, and the same
+    #  reply corrupted (so its address comes out as an unknown aircraft)
+    n = (20000 + 1000) // 25
+    reply = ((4 << 27) | ((n & 0x7e0) << 2) | ((n & 0x10) << 1) | 0x10 | (n & 0xf)).to_bytes(4, "big")
+    parity = NetSource.modesChecksum(reply) ^ int("c0ffee", 16)
+    frames.append(reply + parity.to_bytes(3, "big"))
+    frames.append(bytes([reply[0], reply[1] ^ 0x04]) + reply[2:] + parity.to_bytes(3, "big"))
+    data = b"".join(NetSource.encodeBeast(f, n, 100) for n, f in enumerate(frames))
+
+    parsed = [msg for _, _, _, msg in NetSource.BeastParser().feed(data)]
+    check("beast frames parsed", parsed == frames)
+    check("  DF17 CRCs", all(NetSource.modesChecksum(m[:-3]) == int.from_bytes(m[-3:], "big") for m in parsed if len(m) == 14))
+    aircraft = replayNet(data, "beast").aircraft
+    check("  no other aircraft", set(aircraft) == set(known))
+    for icao, (flight, lat, lon, alt, speed, heading) in known.items():
+        a = aircraft.get(icao, {})
+        check(f"  {icao} position (CPR)", (abs(a.get('lat', 0) - lat) < 1e-4) and (abs(a.get('lon', 0) - lon) < 1e-4))
+        check(f"  {icao} flight, speed, track", (a.get('flight') == flight) and (abs(a.get('gs', 0) - speed) < 1.0) and
+              (abs(a.get('track', 0) - heading) < 0.5))
+    check("  altitudes (DF17, DF4 by CRC)", (aircraft.get("a1b2c3", {}).get('alt_baro') == 12000) and
+          (aircraft.get("c0ffee", {}).get('alt_baro') == 20000))
+
+    lines = ["MSG,3,1,1,A1B2C3,1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,12000,,,37.61234,-122.38765,,,0,1,0,0",
+             "MSG,4,1,1,A1B2C3,1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,,450,90.0,,,-640,,,,,",
+             "MSG,3,1,1,C0FFEE,1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,bad,,,36.95,-121.5,,,,,,",
+             "MSG,3,1,1,C0FFEE,1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,3500,,,36.95,-121.5,,,,,,",
+             "MSG,5,1,1,A1B2C3,1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,,,,,,,,0,0,0,0"]
+    decoder = replayNet("\r\n".join(lines).encode("ascii") + b"\r\n", "sbs")
+    a, b = decoder.aircraft.get("a1b2c3", {}), decoder.aircraft.get("c0ffee", {})
+    check("sbs positions", ((a.get('lat'), a.get('lon'), b.get('lat'), b.get('lon')) == (37.61234, -122.38765, 36.95, -121.5)))
+    check("  altitude, speed, track", (a.get('alt_baro'), b.get('alt_baro'), a.get('gs'), a.get('track')) == (12000, 3500, 450.0, 90.0))
+    check("  malformed line skipped", decoder.badLines == 1)
+    check("  emergency cleared", a.get('emergency') == "none")
+
+def benchNet(opts):
+    """Check that replayed Beast and SBS streams decode correctly, and then
+       measure the single-core decode throughput (in msgs/sec) for them, both
+       in-process and end-to-end through a local replay server
+    """
+    checkNet()
+    for fmt, data in (("beast", beastCapture(opts.aircraft, opts.count)),
+                      ("sbs", sbsCapture(opts.aircraft, opts.count))):
+        decoder = NetSource.ModeSDecoder()
+        parser = NetSource.BeastParser()
+        start = time.process_time()
+        if fmt == "beast":
+            for offset in range(0, len(data), NetSource.READ_SIZE):
+                for msgType, _, signal, msg in parser.feed(data[offset:offset + NetSource.READ_SIZE]):
+                    decoder.decode(msg, 0.0, signal)
+        else:
+            for line in data.decode("ascii").splitlines():
+                decoder.updateSbs(line.split(","), 0.0)
+        elapsed = time.process_time() - start
+        print(f"{fmt: <6} decode:     {decoder.messages / elapsed:10.0f} msgs/sec ({decoder.messages} msgs, {len(decoder.aircraft)} aircraft)")
+
+        server = NetSource.ReplayServer(data)
+        source = NetSource.NetSource(server.host, server.port, fmt)
+        start = time.perf_counter()
+        try:
+            while True:
+                source.read(1.0)
+        except EOFError:
+            pass
+        elapsed = time.perf_counter() - start
+        print(f"{fmt: <6} end-to-end: {source.decoder.messages / elapsed:10.0f} msgs/sec")
+        source.close()
+        server.close()
+
+
+class StandInFeed(AircraftSource):
+    """A stand-in receiver that sees a random fraction of a shared list of
+       aircraft, with random 'seen' and 'seen_pos', every interval secs
+
+      The snapshots are made up front, so reading them costs (almost) nothing.
+    """
+    def __init__(self, aircraft, fraction=0.7, interval=1.0, numSnapshots=8, seed=0):
+        rnd = random.Random(seed)
+        self.interval = interval
+        self.snapshots = []
+        for _ in range(numSnapshots):
+            seen = [dict(a, seen=round(rnd.uniform(0, 1), 1), seen_pos=round(rnd.uniform(0, 5), 1))
+                    for a in aircraft if rnd.random() < fraction]
+            self.snapshots.append({'messages': len(seen) * 10, 'aircraft': seen})
+        self.count = 0
+        self.nextDue = time.monotonic() + rnd.uniform(0, interval)
+
+    def read(self, timeout=None):
+        if not self._sleepUntil(self.nextDue, timeout):
+            return None
+        self.nextDue += self.interval
+        snapshot = self.snapshots[self.count % len(self.snapshots)]
+        self.count += 1
+        now = time.time()
+        snapshot['now'] = now
+        return now, snapshot
+
+
+def benchAggregate(opts):
+    """Check the Aggregator's merge rules, and that it dedupes aircraft and
+       keeps their freshest positions with local stand-ins for each kind of
+       feed (json directory, HTTP, and Beast), and then measure its merge
+       latency and CPU load with many in-process stand-in feeds
+    """
+    import asyncio
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from Aggregator import Aggregator, SNAPSHOT_PATHS, parseFeed
+    from Profiler import PROFILER
+
+    # merge rules: two feeds report the same aircraft, one seen more recently
+    #  and the other with the fresher position (in either order)
+    newer = {'hex': "a1b2c3", 'flight': "NEWER   ", 'alt_baro': 11000, 'seen': 1.0, 'seen_pos': 6.0, 'lat': 37.5, 'lon': -122.1}
+    fresher = {'hex': "a1b2c3", 'flight': "OLDER   ", 'alt_baro': 10000, 'seen': 3.0, 'seen_pos': 1.0, 'lat': 37.6, 'lon': -122.2}
+    for order in (("newer", "fresher"), ("fresher", "newer")):
+        merger = Aggregator({"newer": None, "fresher": None}, port=None, expire=30.0)
+        for name in order:
+            merger.merge(name, 100.0, {'messages': 1, 'aircraft': [newer if name == "newer" else fresher]})
+        merged = merger.snapshot(100.0)['aircraft']
+        a = merged[0] if merged else {}
+        check(f"merge ({' then '.join(order)})",
+              (len(merged) == 1) and (a['flight'] == "NEWER   ") and (a['alt_baro'] == 11000) and (a['seen'] == 1.0) and
+              ((a['lat'], a['lon']) == (37.6, -122.2)) and (a['seen_pos'] == 1.0) and (merger.aircraft['a1b2c3'][4] == "fresher"))
+        check("  not expired before expiry", len(merger.snapshot(99.0 + 30.0)['aircraft']) == 1)
+        check("  expired after expiry", (not merger.snapshot(99.0 + 30.1)['aircraft']) and (not merger.aircraft))
+
+    def runAggregator(aggregator):
+        t = threading.Thread(target=asyncio.run, args=(aggregator.run(),), daemon=True)
+        t.start()
+        while aggregator.loop is None:
+            time.sleep(0.01)
+        return t
+
+    # stand-in feeds: the json directory has aircraft 0-19 with 2 sec old
+    #  positions, the HTTP server has aircraft 10-29 with 0.5 sec old (and
+    #  different) positions, and the Beast stream has a few others
+    aircraft = SyntheticSource(SELF_LOCATION, numAircraft=30, speed=0, seed=1).read()[1]['aircraft']
+    dirAircraft = [dict(a, seen=0.0, seen_pos=2.0) for a in aircraft[:20]]
+    httpAircraft = [dict(a, seen=0.0, seen_pos=0.5, lat=a['lat'] + 0.01) for a in aircraft[10:]]
+    beastData = beastCapture(5, 200, seed=2)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({'now': time.time(), 'messages': 0, 'aircraft': httpAircraft}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with tempfile.TemporaryDirectory() as dirPath, tempfile.TemporaryDirectory() as outputDir:
+        with open(os.path.join(dirPath, "aircraft.json"), "w") as f:
+            json.dump({'now': time.time(), 'messages': 0, 'aircraft': dirAircraft}, f)
+        httpServer = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=httpServer.serve_forever, daemon=True).start()
+        beastServer = NetSource.ReplayServer(beastData)
+        specs = (f"dir:{dirPath}", f"http://127.0.0.1:{httpServer.server_address[1]}/data/aircraft.json",
+                 f"beast:{beastServer.host}:{beastServer.port}")
+        aggregator = Aggregator({spec: parseFeed(spec) for spec in specs}, outputDir=outputDir, port=0, minInterval=0.1)
+        t = runAggregator(aggregator)
+        source = HttpSource(f"http://127.0.0.1:{aggregator.port}{SNAPSHOT_PATHS[0]}", interval=0.2)
+        merged, deadline = [], time.monotonic() + 10.0
+        while time.monotonic() < deadline:
+            snapshot = source.read(1.0)
+            if snapshot:
+                merged = snapshot[1]['aircraft']
+                if all(aggregator.snapshots.values()) and (len(merged) >= 35):
+                    break
+        aggregator.stop()
+        t.join()
+        with open(os.path.join(outputDir, "aircraft.json"), "rb") as f:
+            written = json.load(f)['aircraft']
+        httpServer.shutdown()
+        beastServer.close()
+        source.close()
+
+    byHex = {a['hex']: a for a in merged}
+    expected = {a['hex']: a['lat'] for a in dirAircraft}
+    expected.update({a['hex']: a['lat'] for a in httpAircraft})
+    fromBeast = set(byHex) - set(expected)
+    freshest = all(byHex.get(h, {}).get('lat') == lat for h, lat in expected.items())
+    counts = ", ".join(f"{name.split(':')[0]}={n}" for name, n in aggregator.snapshots.items())
+    print(f"stand-in feeds: {counts} snapshots")
+    print(f"  merged {len(merged)} aircraft ({len(expected)} from json/HTTP, {len(fromBeast)} from Beast), "
+          f"written to aircraft.json: {len(written)}")
+    check("  every feed merged", all(aggregator.snapshots.values()) and bool(fromBeast))
+    check("  no duplicates", len(byHex) == len(merged))
+    check("  freshest positions", freshest)
+
+    # load: many feeds of the same pool of aircraft
+    aircraft = SyntheticSource(SELF_LOCATION, numAircraft=opts.aircraft, speed=0, seed=0).read()[1]['aircraft']
+    feeds = {f"feed{n}": (lambda n=n: StandInFeed(aircraft, opts.fraction, opts.interval, seed=n)) for n in range(opts.feeds)}
+    aggregator = Aggregator(feeds, port=0, minInterval=opts.minInterval)
+    PROFILER.reset()
+    PROFILER.enable()
+    start, cpuStart = time.perf_counter(), time.process_time()
+    t = runAggregator(aggregator)
+    time.sleep(opts.duration)
+    aggregator.stop()
+    t.join()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpuStart
+    PROFILER.enable(False)
+    merge, publish = PROFILER.stages['merge'], PROFILER.stages['publish']
+    print(f"{opts.feeds} feeds x {opts.aircraft} aircraft ({opts.fraction * 100:.0f}% each) every {opts.interval}s, "
+          f"for {opts.duration}s: {aggregator}")
+    print(f"  merge:   {(merge.sum / merge.count) * 1000:.3f}ms per snapshot ({merge.count})")
+    print(f"  publish: {(publish.sum / publish.count) * 1000:.3f}ms per merged snapshot ({publish.count}, {len(aggregator.body) / 1024:.0f} KB)")
+    printLatencies(f"  merge to publish (min {opts.minInterval}s)", list(aggregator.latencies))
+    print(f"  CPU: {100.0 * cpu / elapsed:.1f}% of one core")
+
+
+def benchApi(opts):
+    """Cost of serving the tracks to many WebSocket clients: the size and
+       encode time of snapshots vs. deltas in each format, the server's CPU
+       load and fan-out time per delta, the delivery latency, and whether
+       clients that read too slowly are resynced (with snapshots) without
+       delaying the others, with the clients in another process
+    """
+    import hashlib
+    from Profiler import PROFILER
+    from TrackServer import ENCODERS, TrackServer, trackDicts
+
+    rnd = random.Random(0)
+    aircraft = syntheticSnapshot(opts.aircraft)
+    tracks, states = TrackTable(), {}
+
+    def step(ts):
+        for n, a in enumerate(aircraft):
+            r = rnd.random()
+            if r < opts.churn:
+                aircraft[n] = dict(a, hex=f"{rnd.randrange(1 << 24):06x}")
+            elif r < (opts.churn + opts.changed):
+                a['lat'] += 0.001
+        return updateTracks(tracks, states, {a['hex']: dict(a) for a in aircraft}, ts, SELF_LOCATION)
+
+    def delta(ts, added, removed, changed):
+        return {'type': "delta", 'seq': 0, 'ts': ts, 'added': trackDicts(tracks, added),
+                'changed': trackDicts(tracks, changed), 'removed': list(removed)}
+
+    step(0.0)
+    snapshot = {'type': "snapshot", 'seq': 0, 'ts': 0.0, 'tracks': trackDicts(tracks, tracks.keys())}
+    added, removed, changed, _ = step(1.0)
+    d = delta(1.0, added, removed, changed)
+    print(f"{opts.aircraft} aircraft, {opts.changed * 100:.0f}% changed and {opts.churn * 100:.0f}% replaced per snapshot "
+          f"(delta: {len(added)} added, {len(changed)} changed, {len(removed)} removed)")
+    print(f"  trackDicts: {timeIt(lambda: delta(1.0, added, removed, changed), 100) / max(1, len(added) + len(changed)) * 1e6:.1f}us per track")
+    for fmt, (encode, _, _) in ENCODERS.items():
+        print(f"  {fmt: <8} snapshot={len(encode(snapshot)) / 1024:7.1f}KB ({timeIt(lambda: encode(snapshot), 100) * 1000:.3f}ms)  "
+              f"delta={len(encode(d)) / 1024:7.1f}KB ({timeIt(lambda: encode(d), 100) * 1000:.3f}ms)")
+
+    server = TrackServer(port=0, queueSize=opts.queueSize)
+    server.publish(1.0, tracks, set(tracks.keys()), set(), set())
+    settle = 5.0  # secs for the slow clients to catch up after the last delta
+    clients = subprocess.Popen([sys.executable, os.path.abspath(__file__), "apiclients", "-p", str(server.port),
+                                "-n", str(opts.clients), "-s", str(opts.slow), "-f", opts.format,
+                                "-d", str(opts.duration + settle)], stdout=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + 10.0
+    while (len(server.clients) < (opts.clients + opts.slow)) and (time.monotonic() < deadline):
+        time.sleep(0.01)
+
+    published = {}  # seq: time published
+    serverClock = time.pthread_getcpuclockid(server.thread.ident)
+    PROFILER.reset()
+    PROFILER.enable()
+    start, cpuStart = time.perf_counter(), time.clock_gettime(serverClock)
+    ts, seq = 1.0, 1
+    while (time.perf_counter() - start) < opts.duration:
+        ts += 1.0
+        seq += 1
+        added, removed, changed, _ = step(ts)
+        published[seq] = time.time()
+        server.publish(ts, tracks, added, changed, removed)
+        time.sleep(max(0.0, (start + ((seq - 1) / opts.rate)) - time.perf_counter()))
+    elapsed, cpu = time.perf_counter() - start, time.clock_gettime(serverClock) - cpuStart
+    PROFILER.enable(False)
+    results = json.loads(clients.communicate()[0])
+
+    def digest(trackDicts):
+        return hashlib.sha1(json.dumps(sorted((t['hex'], t.get('lat'), t.get('lon')) for t in trackDicts)).encode()).hexdigest()
+    final = digest(server.tracks.values())
+    api, fanout = PROFILER.stages['api'], PROFILER.stages['fanout']
+    print(f"{opts.clients} clients + {opts.slow} slow ones ({opts.format}), {seq - 1} deltas at {opts.rate}Hz for {opts.duration}s: {server}")
+    print(f"  server thread CPU: {100.0 * cpu / elapsed:.1f}% of one core")
+    print(f"  publish (trackDicts): {(api.sum / api.count) * 1000:.3f}ms per delta  "
+          f"fan-out: {(fanout.sum / fanout.count) * 1000:.3f}ms per delta")
+    for slow in (False, True):
+        rs = [r for r in results if r['slow'] == slow]
+        if not rs:
+            continue
+        latencies = [t - published[s] for r in rs for s, t in r['received'] if s in published]
+        print(f"  {'slow' if slow else 'normal'} clients: connected={sum(r['ok'] for r in rs)}/{len(rs)}, "
+              f"deltas={sum(len(r['received']) for r in rs)}, snapshots={sum(r['snapshots'] for r in rs)}, "
+              f"gaps={sum(r['gaps'] for r in rs)}, {sum(r['bytes'] for r in rs) / len(rs) / 1024:.0f}KB each, "
+              f"final tracks match: {sum(r['digest'] == final for r in rs)}/{len(rs)}")
+        if latencies:
+            printLatencies("    publish to receive", latencies)
+    server.close()
+
+
+def benchApiClients(opts):
+    """Connect WebSocket clients to a TrackServer's stream, keep their own
+       copies of the tracks from its snapshots and deltas for the given number
+       of secs, and print a JSON list of their results (run by the api
+       benchmark)
+    """
+    import asyncio
+    import base64
+    import hashlib
+    import socket
+    from TrackServer import readFrame
+    try:
+        import msgspec
+        decoders = {'json': msgspec.json.decode, 'msgpack': msgspec.msgpack.decode}
+    except ImportError:
+        import msgpack
+        decoders = {'json': json.loads, 'msgpack': msgpack.unpackb}
+    decode = decoders[opts.format]
+
+    async def client(slow):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket()
+        if slow:
+            # a small receive buffer, so that the server soon has to hold back
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("127.0.0.1", opts.port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f"GET /stream?format={opts.format} HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        r = {'slow': slow, 'ok': head.startswith(b"HTTP/1.1 101"), 'bytes': 0, 'snapshots': 0, 'gaps': 0, 'received': []}
+        tracks, lastSeq = {}, None
+        deadline = loop.time() + opts.duration
+        try:
+            while r['ok']:
+                _, payload = await asyncio.wait_for(readFrame(reader, 1 << 30), max(0.0, deadline - loop.time()))
+                now = time.time()
+                msg = decode(payload)
+                r['bytes'] += len(payload)
+                if msg['type'] == "snapshot":
+                    r['snapshots'] += 1
+                    tracks = {t['hex']: t for t in msg['tracks']}
+                else:
+                    if msg['seq'] != lastSeq + 1:
+                        r['gaps'] += 1
+                    for t in msg['added'] + msg['changed']:
+                        tracks[t['hex']] = t
+                    for uniqueId in msg['removed']:
+                        tracks.pop(uniqueId, None)
+                    r['received'].append((msg['seq'], now))
+                lastSeq = msg['seq']
+                if slow:
+                    await asyncio.sleep(opts.slowDelay)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+        r['digest'] = hashlib.sha1(json.dumps(sorted((t['hex'], t.get('lat'), t.get('lon')) for t in tracks.values())).encode()).hexdigest()
+        return r
+
+    async def main():
+        return await asyncio.gather(*[client(n < opts.slow) for n in range(opts.clients + opts.slow)])
+
+    print(json.dumps(asyncio.run(main())))
+
+
+def syntheticSnapshot(numAircraft, seed=0):
+    """Return a list of per-aircraft info dicts of synthetic traffic
+    """
+    source = SyntheticSource(SELF_LOCATION, numAircraft=numAircraft, speed=0, seed=seed)
+    return source.read()[1]['aircraft']
+
+
+def benchDiff(opts):
+    """Per-cycle cost of updating every track vs. only the tracks that were
+       added/changed/removed, for different numbers of aircraft and churn
+    """
+    for numAircraft in opts.aircraft:
+        aircraft = syntheticSnapshot(numAircraft)
+        for churn in opts.churn:
+            fullTimes, diffTimes = [], []
+            fullTracks, tracks, states = {}, TrackTable(), {}
+            numChanged = int(round(numAircraft * churn))
+            for cycle in range(opts.count):
+                for n, a in enumerate(aircraft):
+                    a['seen'] = round((cycle + n) % 10 * 0.1, 1)
+                    if ((n + cycle) % numAircraft) < numChanged:
+                        a['lat'] += 0.001
+                info = {a['hex']: dict(a) for a in aircraft}
+
+                start = time.perf_counter()
+                for uniqueId, i in info.items():
+                    if uniqueId in fullTracks:
+                        fullTracks[uniqueId].update(cycle, SELF_LOCATION, i)
+                    else:
+                        fullTracks[uniqueId] = Track(cycle, SELF_LOCATION, i)
+                fullTracks = {k: v for k, v in fullTracks.items() if k in info}
+                fullTimes.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                updateTracks(tracks, states, info, cycle, SELF_LOCATION)
+                diffTimes.append(time.perf_counter() - start)
+            # the first cycle adds every track in both cases
+            printLatencies(f"{numAircraft: >5} aircraft {churn * 100:5.1f}% full", fullTimes[1:])
+            printLatencies(f"{numAircraft: >5} aircraft {churn * 100:5.1f}% diff", diffTimes[1:])
+
+
+def benchGeo(opts):
+    """Speed and accuracy of the batched distance/azimuth engine, for each
+       accuracy mode, vs. the per-track geopy path
+    """
+    rng = np.random.default_rng(0)
+    for numAircraft in opts.aircraft:
+        spread = np.degrees(opts.range / Geodesy.MEAN_EARTH_RADIUS)
+        lats = SELF_LOCATION.latitude + rng.uniform(-spread, spread, numAircraft)
+        lons = SELF_LOCATION.longitude + (rng.uniform(-spread, spread, numAircraft) / np.cos(np.radians(SELF_LOCATION.latitude)))
+        points = [Point(lat, lon) for lat, lon in zip(lats, lons)]
+
+        start = time.perf_counter()
+        for _ in range(opts.count):
+            ref = [Track.distanceAndAzimuth(SELF_LOCATION, Point(p.latitude, p.longitude)) for p in points]
+        geopyTime = (time.perf_counter() - start) / opts.count
+        refDist = np.array([d for d, _ in ref])
+        refAzi = np.array([a for _, a in ref])
+        print(f"{numAircraft: >5} aircraft  geopy        {geopyTime * 1000.0:9.3f}ms")
+
+        for mode in Geodesy.GEO_MODES:
+            start = time.perf_counter()
+            for _ in range(opts.count):
+                dist, azi = Geodesy.distancesAndAzimuths(SELF_LOCATION.latitude, SELF_LOCATION.longitude, lats, lons, mode)
+            elapsed = (time.perf_counter() - start) / opts.count
+            distErr = np.abs(dist - refDist) * 1000.0
+            aziErr = np.abs(((azi - refAzi) + 180.0) % 360.0 - 180.0)
+            print(f"{numAircraft: >5} aircraft  {mode: <12} {elapsed * 1000.0:9.3f}ms  x{geopyTime / elapsed:7.1f}  "
+                  f"dist err: max={np.max(distErr):9.3f}m mean={np.mean(distErr):9.3f}m  azi err: max={np.max(aziErr):.4f}deg")
+
+
+def timeIt(func, count):
+    """Return the mean time (in secs) of calling func count times
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+def benchTable(opts):
+    """Per-cycle update, sort, range and selection costs and memory per
+       aircraft of the columnar TrackTable
+    """
+    for numAircraft in opts.aircraft:
+        source = SyntheticSource(SELF_LOCATION, numAircraft=numAircraft, speed=0, seed=0)
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        tracks, states = TrackTable(), {}
+        ts, j = source.read()
+        updateTracks(tracks, states, {a['hex']: a for a in j['aircraft']}, ts, SELF_LOCATION)
+        used = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        historyBytes = sum(t.history.nbytes() for t in tracks.values())
+
+        updateTimes = []
+        for _ in range(opts.count):
+            ts, j = source.read()
+            info = {a['hex']: a for a in j['aircraft']}
+            start = time.perf_counter()
+            updateTracks(tracks, states, info, ts, SELF_LOCATION)
+            updateTimes.append(time.perf_counter() - start)
+
+        colSort = timeIt(lambda: tracks.sortedTracks('distance'), opts.count)
+        objSort = timeIt(lambda: sorted(tracks.values(), key=lambda t: t.distance), opts.count)
+        colRange = timeIt(lambda: np.max(tracks.column('distance')), opts.count)
+        objRange = timeIt(lambda: max(t.distance for t in tracks.values()), opts.count)
+        positions = np.random.default_rng(0).uniform(0, 480, (len(tracks), 2))
+        colSelect = timeIt(lambda: np.argmin(np.sum((positions - (240.0, 240.0)) ** 2, axis=1)), opts.count)
+        objSelect = timeIt(lambda: min(range(len(positions)), key=lambda n: math.dist((240.0, 240.0), positions[n])), opts.count)
+
+        print(f"{numAircraft: >5} aircraft: row={tracks.rowBytes()}B/aircraft  total={(used - historyBytes) / numAircraft:.0f}B/aircraft "
+              f"(+{historyBytes / numAircraft:.0f}B history)")
+        printLatencies("    update", updateTimes)
+        print(f"    sort:   columns={colSort * 1000:8.3f}ms  objects={objSort * 1000:8.3f}ms")
+        print(f"    range:  columns={colRange * 1000:8.3f}ms  objects={objRange * 1000:8.3f}ms")
+        print(f"    select: columns={colSelect * 1000:8.3f}ms  objects={objSelect * 1000:8.3f}ms")
+
+
+def benchTrack(opts):
+    """Per-track cost of creating and of updating tracks (the 'update' stage
+       of updateTracks(), with every track changed), and the memory retained by
+       and allocated while updating tracks, for different numbers of aircraft
+    """
+    from Profiler import PROFILER
+
+    PROFILER.enable()
+    for numAircraft in opts.aircraft:
+        source = SyntheticSource(SELF_LOCATION, numAircraft=numAircraft, speed=0, seed=0)
+        ts, j = source.read()
+        tracks, states = TrackTable(numAircraft), {}
+        PROFILER.reset()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        updateTracks(tracks, states, {a['hex']: a for a in j['aircraft']}, ts, SELF_LOCATION)
+        used = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        historyBytes = sum(t.history.nbytes() for t in tracks.values())
+        createTime = PROFILER.stages['update'].sum / numAircraft
+
+        PROFILER.reset()
+        peaks = []
+        for _ in range(opts.count):
+            ts, j = source.read()
+            info = {a['hex']: a for a in j['aircraft']}
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            updateTracks(tracks, states, info, ts, SELF_LOCATION, reproject=True)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            tracemalloc.stop()
+        # tracemalloc slows down allocation, so time some cycles without it
+        PROFILER.reset()
+        for _ in range(opts.count):
+            ts, j = source.read()
+            updateTracks(tracks, states, {a['hex']: a for a in j['aircraft']}, ts, SELF_LOCATION, reproject=True)
+        update = PROFILER.stages['update']
+        print(f"{numAircraft: >5} aircraft: create={createTime * 1e6:6.2f}us/track  update={(update.sum / update.count / numAircraft) * 1e6:6.2f}us/track  "
+              f"retained={(used - historyBytes) / numAircraft:5.0f}B/track (+{historyBytes / numAircraft:.0f}B history)  "
+              f"update peak={statistics.fmean(peaks) / numAircraft:5.0f}B/track")
+    PROFILER.enable(False)
+
+
+def benchStats(opts):
+    """Cost of updating TrackStats with each added/changed track and of
+       summarizing it, and the accuracy of its percentiles (vs. the exact
+       ones) and distinct aircraft counts, for synthetic traffic
+    """
+    from TrackStats import STAT_FIELDS, TrackStats, _trackValues
+
+    source = SyntheticSource(SELF_LOCATION, numAircraft=opts.aircraft, speed=0, churn=opts.churn, seed=0)
+    tracks, states, stats = TrackTable(), {}, TrackStats()
+    samples, seen = [], {}
+    updateTimes = []
+    for _ in range(opts.count):
+        ts, j = source.read()
+        added, removed, changed, unchanged = updateTracks(tracks, states, {a['hex']: a for a in j['aircraft']}, ts, SELF_LOCATION)
+        updated = [tracks[uniqueId] for uniqueId in (added | changed)]
+        start = time.perf_counter()
+        for track in updated:
+            stats.update(track)
+        updateTimes.append((time.perf_counter() - start) / max(1, len(updated)))
+        for track in updated:
+            samples.append((ts, _trackValues(track)))
+            seen[track.uniqueId] = ts
+    now = source.now
+    print(f"{opts.aircraft} aircraft, {opts.count} snapshots, {len(samples)} samples")
+    printLatencies("  update (per track)", updateTimes)
+    print(f"  summary: {timeIt(lambda: stats.summary('15min'), 100) * 1000:.3f}ms  "
+          f"info lines: {timeIt(stats.infoLines, 100) * 1000:.3f}ms")
+    for window, secs in stats.windows.items():
+        summary = stats.summary(window)
+        exactAircraft = sum(1 for ts in seen.values() if (secs is None) or (ts >= (now - secs)))
+        print(f"  {window: <8} aircraft={summary['aircraft']} (exact: {exactAircraft}, {len(seen)} ever)")
+        for field, (lo, hi, binWidth) in STAT_FIELDS.items():
+            values = [v[field] for ts, v in samples if (v[field] is not None) and ((secs is None) or (ts >= (now - secs)))]
+            if not values:
+                continue
+            s = summary['fields'][field]
+            exact = np.percentile(values, (50, 90))
+            print(f"    {field: <9} n={s['count']: <7} (exact: {len(values): <7}) p50={s['p50']:9.1f} (exact: {exact[0]:9.1f})  "
+                  f"p90={s['p90']:9.1f} (exact: {exact[1]:9.1f})  bin={binWidth:g}")
+
+
+def benchCoverage(opts):
+    """Cost of updating a CoverageMap with each added/changed track, of saving,
+       loading, and merging it, and of redrawing the display's static layer
+       with and without the coverage overlay
+    """
+    from Coverage import CoverageMap
+    from RadarDisplay import RadarDisplay
+
+    source = SyntheticSource(SELF_LOCATION, numAircraft=opts.aircraft, speed=0, churn=opts.churn, seed=0)
+    tracks, states, coverage = TrackTable(), {}, CoverageMap(site=SELF_LOCATION)
+    updateTimes = []
+    for _ in range(opts.count):
+        ts, j = source.read()
+        added, removed, changed, unchanged = updateTracks(tracks, states, {a['hex']: a for a in j['aircraft']}, ts, SELF_LOCATION)
+        updated = [tracks[uniqueId] for uniqueId in (added | changed)]
+        start = time.perf_counter()
+        for track in updated:
+            coverage.updateTrack(track)
+        updateTimes.append((time.perf_counter() - start) / max(1, len(updated)))
+    maxRange, azimuth, altitude = coverage.maxRangeInfo()
+    print(f"{opts.aircraft} aircraft, {opts.count} snapshots, {int(coverage.counts.sum())} position reports, "
+          f"{len(coverage)} cells, max range {maxRange:.1f}Km at {azimuth:.1f}deg ({altitude}+ ft)")
+    printLatencies("  update (per track)", updateTimes)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        path = os.path.join(tmpDir, "coverage.npz")
+        print(f"  save: {timeIt(lambda: coverage.save(path), 10) * 1000:.2f}ms ({os.path.getsize(path) / 1024:.1f} KB)  "
+              f"load: {timeIt(lambda: CoverageMap.load(path), 10) * 1000:.2f}ms  "
+              f"merge: {timeIt(lambda: CoverageMap(site=SELF_LOCATION).merge(coverage), 10) * 1000:.2f}ms")
+
+    radar = RadarDisplay(opts.assets, headless=True, coverage=coverage)
+    radar._setMaxDistance(maxRange)
+    for show in (False, True):
+        radar.showCoverage = show
+        def redraw():
+            radar.staticKey = None
+            radar.coverageDrawn = 0.0
+            radar.coverageVersion = None
+            radar._initScreen(0.0)
+        print(f"  static layer redraw ({'with' if show else 'without'} overlay): {timeIt(redraw, 100) * 1000:.3f}ms")
+    radar.running = False
+    time.sleep(0.1)
+    radar.quit()
+
+
+def benchConflicts(opts):
+    """Cost of the conflict detector's pairwise checks in dense synthetic
+       airspace (at a fixed radius, or a fixed density), with SpatialGrid
+       bucketing vs. testing every pair, checking that both find the same
+       alerts, and a few scripted close approaches
+    """
+    from Conflicts import ConflictDetector, TrackKinematics, alertText
+
+    detector = ConflictDetector(horizon=opts.horizon)
+
+    # scripted: two aircraft 10Km apart head-on at the same altitude, one
+    #  crossing 2000ft above them, and one about to pass low over the observer
+    scripted = [{'hex': "c0ffe1", 'flight': "HEADON1", 'lat': 37.45, 'lon': -121.8, 'gs': 300.0, 'track': 90.0, 'alt_baro': 9000},
+                {'hex': "c0ffe2", 'flight': "HEADON2", 'lat': 37.45, 'lon': -121.8 + (10.0 / 88.4), 'gs': 300.0, 'track': 270.0, 'alt_baro': 9000},
+                {'hex': "c0ffe3", 'flight': "ABOVE", 'lat': 37.4, 'lon': -121.74, 'gs': 300.0, 'track': 0.0, 'alt_baro': 11000},
+                {'hex': "c0ffe4", 'flight': "LOWPASS", 'lat': 37.4 - (5.0 / 111.2), 'lon': -122.0, 'gs': 200.0, 'track': 0.0,
+                 'alt_baro': 3000, 'baro_rate': -500}]
+    tracks, states = TrackTable(), {}
+    updateTracks(tracks, states, {a['hex']: a for a in scripted}, 0.0, SELF_LOCATION)
+    for alert in detector.check(tracks, 0.0):
+        print(f"scripted: {alertText(alert)}")
+
+    print(f"{'aircraft': >8} {'radius': >7} {'all pairs': >10} {'candidates': >10} {'alerts': >6} "
+          f"{'grid': >9} {'all pairs': >9} {'check': >9}  same alerts")
+    for numAircraft in opts.aircraft:
+        radius = math.sqrt((numAircraft * 1000.0 / opts.density) / math.pi) if opts.density else opts.radius
+        source = SyntheticSource(SELF_LOCATION, numAircraft=numAircraft, radius=radius, speed=0, seed=numAircraft)
+        tracks, states = TrackTable(), {}
+        ts, j = source.read()
+        updateTracks(tracks, states, {a['hex']: a for a in j['aircraft']}, ts, SELF_LOCATION)
+        k = TrackKinematics(tracks, ts)
+
+        def grid():
+            return detector.pairAlerts(k, *detector.gridPairs(k))
+        gridTime = timeIt(grid, opts.count)
+        found = {ids for _, ids, _, _, _ in grid()}
+        candidates = len(detector.gridPairs(k)[0])
+        allPairs = (numAircraft * (numAircraft - 1)) // 2
+        if numAircraft <= opts.maxBrute:
+            def brute():
+                return detector.pairAlerts(k, *np.triu_indices(len(k), 1))
+            bruteTime = f"{timeIt(brute, opts.count) * 1000:7.2f}ms"
+            same = str(found == {ids for _, ids, _, _, _ in brute()})
+        else:
+            bruteTime, same = f"{'-': >9}", "-"
+        checkTime = timeIt(lambda: ConflictDetector(horizon=opts.horizon).check(tracks, ts), opts.count)
+        print(f"{numAircraft: >8} {radius: >5.0f}Km {allPairs: >10} {candidates: >10} {len(found): >6} "
+              f"{gridTime * 1000:7.2f}ms {bruteTime} {checkTime * 1000:7.2f}ms  {same}")
+
+
+def benchRender(opts):
+    """Frame time and CPU time of full-frame vs. dirty-region rendering of the
+       radar display, for different numbers of aircraft and churn
+    """
+    from RadarDisplay import RadarDisplay, SUMMARY_MODE, DETAILS_MODE
+
+    radar = RadarDisplay(opts.assets, headless=True)
+    radar.infoMode = SUMMARY_MODE if opts.mode == "summary" else DETAILS_MODE
+    radar.trails = opts.trails
+    for numAircraft in opts.aircraft:
+        aircraft = syntheticSnapshot(numAircraft)
+        for churn in opts.churn:
+            numChanged = int(round(numAircraft * churn))
+            for dirtyRects in (False, True):
+                radar.dirtyRects = dirtyRects
+                radar.staticKey = None
+                tracks, states = TrackTable(), {}
+                frameTimes, cpuTimes = [], []
+                for cycle in range(opts.count):
+                    for n, a in enumerate(aircraft):
+                        if ((n + cycle) % numAircraft) < numChanged:
+                            a['lat'] += 0.001
+                    updateTracks(tracks, states, {a['hex']: dict(a) for a in aircraft}, cycle, SELF_LOCATION)
+                    radar.render((0.0, 0.0, 0.0), SELF_LOCATION, cycle, tracks)
+                    frameTimes.append(radar.frameTimes[-1])
+                    cpuTimes.append(radar.frameCpuTimes[-1])
+                # the first frame draws everything in both cases
+                label = f"{numAircraft: >5} aircraft {churn * 100:5.1f}% {'dirty' if dirtyRects else 'full'}"
+                printLatencies(label, frameTimes[1:])
+                print(f"{'': <32} CPU={100.0 * sum(cpuTimes[1:]) / sum(frameTimes[1:]):5.1f}% of frame time, "
+                      f"{100.0 * sum(cpuTimes[1:]) / (opts.interval * (opts.count - 1)):5.2f}% at {opts.interval}s/frame")
+    radar.running = False
+    time.sleep(0.1)
+    radar.quit()
+
+
+def benchShmRead(opts):
+    """Print the mean time (in secs) to read a frame from the named shared
+       memory segment (run by the headless benchmark)
+    """
+    from FrameExport import SharedMemoryReader
+
+    reader = SharedMemoryReader(opts.name)
+    print(timeIt(reader.read, opts.count))
+    reader.close()
+
+def benchHeadless(opts):
+    """Deterministic headless render of synthetic traffic: frame times, a
+       digest of the final frame (to compare across runs/changes), and the
+       cost of exporting frames as PNG, into shared memory, and as JPEG (for
+       the MJPEG stream)
+    """
+    import hashlib
+    import io
+    import pygame
+    from FrameExport import PngSink, SharedMemorySink
+    from RadarDisplay import RadarDisplay
+
+    radar = RadarDisplay(opts.assets, headless=True)
+    radar.trails = opts.trails
+    aircraft = syntheticSnapshot(opts.aircraft)
+    tracks, states = TrackTable(), {}
+    for cycle in range(opts.count):
+        for n, a in enumerate(aircraft):
+            if n % 10 == cycle % 10:
+                a['lat'] += 0.001
+        updateTracks(tracks, states, {a['hex']: dict(a) for a in aircraft}, cycle, SELF_LOCATION)
+        radar.render((opts.heading, 0.0, 0.0), SELF_LOCATION, "00:00:00", tracks)
+    printLatencies(f"{opts.aircraft} aircraft frame", list(radar.frameTimes)[1:])
+    print(f"frame digest: {hashlib.sha1(pygame.image.tobytes(radar.screen, 'RGB')).hexdigest()}")
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        png = PngSink(os.path.join(tmpDir, "frame.png"))
+        print(f"{'PNG': <32} {timeIt(lambda: png.write(radar.screen, 0), 10) * 1000:8.3f}ms/frame")
+    shm = SharedMemorySink(f"pocket1090bench{os.getpid()}", radar.screen.get_size())
+    writeTime = timeIt(lambda: shm.write(radar.screen, 0), 100)
+    # N.B. the reader needs to be in an unrelated process, as multiprocessing's
+    #      children share the writer's resource tracker
+    readTime = float(subprocess.run([sys.executable, os.path.abspath(__file__), "shmread", shm.name],
+                                    capture_output=True, text=True, check=True).stdout.split()[-1])
+    print(f"{'shared memory': <32} {writeTime * 1000:8.3f}ms/frame  read={readTime * 1000:.3f}ms (in another process)")
+    shm.close()
+
+    def jpeg():
+        f = io.BytesIO()
+        pygame.image.save(radar.screen, f, "frame.jpg")
+    print(f"{'JPEG (in the encoder thread)': <32} {timeIt(jpeg, 10) * 1000:8.3f}ms/frame  copy={timeIt(radar.screen.copy, 100) * 1000:.3f}ms")
+    radar.quit()
+
+
+def benchText(opts):
+    """Per-frame cost of rendering the flight number and altitude labels of
+       every track directly vs. through the TextCache, for different numbers
+       of aircraft and fractions of altitudes that change per frame
+    """
+    import pygame
+    from RadarDisplay import DEF_BACKGROUND_COLOR, DEF_FONT_INFO
+    from TextCache import TextCache
+
+    pygame.font.init()
+    fontName, fontSize, fontColor = DEF_FONT_INFO['symbolFont']
+    font = pygame.font.Font(fontName, fontSize)
+    for numAircraft in opts.aircraft:
+        aircraft = syntheticSnapshot(numAircraft)
+        for churn in opts.churn:
+            numChanged = int(round(numAircraft * churn))
+            cache = TextCache(opts.size)
+            directTimes, cachedTimes = [], []
+            for cycle in range(opts.count):
+                for n, a in enumerate(aircraft):
+                    if ((n + cycle) % numAircraft) < numChanged:
+                        a['alt_baro'] += 25
+                labels = [(f"{a.get('flight')}", f"{a['alt_baro']}") for a in aircraft]
+
+                start = time.perf_counter()
+                for flight, alt in labels:
+                    for text in (flight, alt):
+                        s = font.render(text, True, fontColor, DEF_BACKGROUND_COLOR)
+                        s.set_colorkey(DEF_BACKGROUND_COLOR)
+                directTimes.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for flight, alt in labels:
+                    for text in (flight, alt):
+                        s = cache.render(font, text, fontColor, DEF_BACKGROUND_COLOR, True)
+                cachedTimes.append(time.perf_counter() - start)
+            printLatencies(f"{numAircraft: >5} aircraft {churn * 100:5.1f}% direct", directTimes[1:])
+            printLatencies(f"{numAircraft: >5} aircraft {churn * 100:5.1f}% cached", cachedTimes[1:])
+            print(f"{'': <32} hit rate={cache.hitRate() * 100:5.1f}%  entries={len(cache)}  "
+                  f"evictions={cache.evictions}  pixels={cache.nbytes() / 1024:.0f}KB")
+
+
+def benchSymbols(opts):
+    """Per-frame cost of rotating each track's symbol vs. looking it up in a
+       SymbolAtlas, and the atlas' build time and memory, for different
+       angular resolutions
+    """
+    import pygame
+    from RadarDisplay import DEF_BACKGROUND_COLOR, ROTATE_SYMBOL
+    from SymbolAtlas import SymbolAtlas
+
+    pygame.display.init()
+    symbols = {}
+    for cat in ROTATE_SYMBOL:
+        img = pygame.image.load(os.path.join(opts.assets, f"{cat}.png"))
+        symbols[cat] = pygame.Surface(img.get_size())
+        symbols[cat].fill(DEF_BACKGROUND_COLOR)
+        symbols[cat].set_colorkey(DEF_BACKGROUND_COLOR)
+        symbols[cat].blit(img, (0, 0))
+    rng = random.Random(0)
+    for numAircraft in opts.aircraft:
+        tracks = [(rng.choice(ROTATE_SYMBOL), rng.uniform(0, 360)) for _ in range(numAircraft)]
+        rotateTime = timeIt(lambda: [pygame.transform.rotate(symbols[c], -h) for c, h in tracks], opts.count)
+        print(f"{numAircraft: >5} aircraft  rotate:          {rotateTime * 1000:8.3f}ms/frame")
+        for resolution in opts.resolution:
+            start = time.perf_counter()
+            atlas = SymbolAtlas(resolution)
+            for cat, symbol in symbols.items():
+                atlas.add(cat, symbol)
+            buildTime = time.perf_counter() - start
+            lookupTime = timeIt(lambda: [atlas.get(c, h) for c, h in tracks], opts.count)
+            print(f"{numAircraft: >5} aircraft  atlas {resolution:4g}deg:   {lookupTime * 1000:8.3f}ms/frame  x{rotateTime / lookupTime:6.1f}  "
+                  f"build={buildTime * 1000:7.2f}ms  memory={atlas.nbytes() / 1024:7.1f}KB")
+
+
+def benchProfiler(opts):
+    """Per-stage overhead of the Profiler's timers when disabled and enabled,
+       and the cost of reporting
+    """
+    from Profiler import Profiler
+
+    def empty():
+        pass
+
+    for enabled in (False, True):
+        profiler = Profiler(enabled)
+
+        def timed():
+            with profiler.stage("stage"):
+                pass
+
+        overhead = timeIt(timed, opts.count) - timeIt(empty, opts.count)
+        print(f"{'enabled' if enabled else 'disabled': <9} {overhead * 1e9:8.1f}ns/stage")
+    for n in range(15):
+        for _ in range(profiler.window):
+            profiler.record(f"stage{n}", random.random() / 100.0)
+    print(f"report (15 stages): {timeIt(profiler.reportLines, 100) * 1000:.3f}ms  "
+          f"JSON: {timeIt(profiler.toJson, 100) * 1000:.3f}ms  Prometheus: {timeIt(profiler.toPrometheus, 100) * 1000:.3f}ms")
+
+
+def checkGps():
+    """Check that replaying an NMEA log to the GPS gives it the (valid) fix in
+       the log, and that the filtered location stops moving once that's stale
+    """
+    from datetime import datetime, timedelta, timezone
+    from GPS import GPS, NmeaReplay, encodeGGA, encodeRMC
+
+    utc = datetime(2024, 1, 1, 12, 34, 56, tzinfo=timezone.utc)
+    later = utc + timedelta(seconds=1)
+    with tempfile.TemporaryDirectory() as tmpDir:
+        path = os.path.join(tmpDir, "gps.nmea")
+        with open(path, "wb") as f:
+            f.write(encodeGGA(utc, 37.4, -122.0, 10.0, 1, 7, 1.2) + encodeRMC(utc, 37.4, -122.0, 10.0, 90.0))
+            f.write(encodeGGA(later, 37.4001, -122.0001, 12.5, 2, 9, 0.9) + encodeRMC(later, 37.4001, -122.0001, 10.0, 90.0))
+            f.write(encodeGGA(later + timedelta(seconds=1), 0.0, 0.0, quality=0))  # lost the fix
+        replay = NmeaReplay(path, interval=0.1)
+    gps = GPS(replay.port, maxFixAge=0.5)
+    replay.done.wait(5.0)
+    time.sleep(0.2)
+    fix = gps.getFix(1.0)
+    check("NMEA replay fix", (fix is not None) and (abs(fix.lat - 37.4001) < 1e-6) and (abs(fix.lon + 122.0001) < 1e-6))
+    check("  time, altitude, quality", (fix.utcTime == later.time().replace(tzinfo=None)) and (fix.alt == 12.5) and
+          ((fix.quality, fix.numSV, fix.hdop) == (2, 9, 0.9)))
+    check("  sentences read", (gps.sentences == 5) and (gps.errors == 0))
+    time.sleep(max(0.0, 0.6 - gps.fixAge()))
+    _, first = gps.getFilteredLocation()
+    time.sleep(0.2)
+    _, second = gps.getFilteredLocation()
+    check("  stale fix not extrapolated", gps.stale and (first == second) and
+          (geoDistance.distance(second, Point(fix.lat, fix.lon)).m < 50.0))
+    gps.close()
+    replay.close()
+
+def benchGps(opts):
+    """Check the GPS with a replayed NMEA log, and then measure the latency
+       from an NMEA burst being written to a (pty) fake serial device to the
+       fix being available, and the cost of reading the current location from
+       the background GPS reader
+    """
+    from datetime import datetime, timedelta, timezone
+    from GPS import GPS, NmeaReplay, encodeGGA, encodeRMC
+
+    checkGps()
+    start = datetime.now(timezone.utc)
+    sentences = []
+    for n in range(opts.count):
+        utc = start + timedelta(seconds=n)
+        lat = SELF_LOCATION.latitude + (n * 1e-5)
+        sentences += [encodeGGA(utc, lat, SELF_LOCATION.longitude), encodeRMC(utc, lat, SELF_LOCATION.longitude, 2.0, 0.0)]
+    replay = NmeaReplay(sentences, interval=opts.interval)
+    gps = GPS(replay.port)
+    fixLatencies = []
+    lastFix = None
+    while not replay.done.is_set() or (len(fixLatencies) < replay.sent):
+        fix = gps.getFix(opts.interval * 10)
+        if fix is None:
+            break
+        if fix is not lastFix:
+            fixLatencies.append(fix.rxTime - replay.sendTimes[len(fixLatencies)])
+            lastFix = fix
+        time.sleep(opts.interval / 10)
+    readLatencies = []
+    for _ in range(1000):
+        t = time.perf_counter()
+        gps.getFilteredLocation()
+        readLatencies.append(time.perf_counter() - t)
+    printLatencies("serial write to fix", fixLatencies)
+    printLatencies("getFilteredLocation()", readLatencies)
+    print(f"sentences={gps.sentences}  errors={gps.errors}  fixes={len(fixLatencies)}/{replay.sent}")
+    gps.close()
+    replay.close()
+
+
+def benchPosFilter(opts):
+    """Error of the Kalman position filter vs. the old 30-fix boxcar average,
+       for a stationary, walking, and driving observer (optionally crossing
+       the antimeridian), with noisy 1Hz GPS fixes, and its cost per fix
+    """
+    from PositionFilter import EARTH_RADIUS, KNOTS_TO_MPS, PositionFilter
+
+    rng = np.random.default_rng(0)
+    scenarios = (("stationary", 0.0, 0.0), ("walking", 1.4, 2.0), ("driving", 25.0, 1.0))
+    startLon = 179.95 if opts.antimeridian else SELF_LOCATION.longitude
+    for name, speed, turnRate in scenarios:
+        filt = PositionFilter()
+        boxLats, boxLons = deque([], maxlen=30), deque([], maxlen=30)
+        lat, lon, course = SELF_LOCATION.latitude, startLon, 90.0
+        filtErrs, boxErrs, updateTimes = [], [], []
+        for t in range(opts.count):
+            course = (course + rng.normal(0, turnRate)) % 360.0
+            d = speed * 1.0
+            lat += np.degrees(d * np.cos(np.radians(course)) / EARTH_RADIUS)
+            lon += np.degrees(d * np.sin(np.radians(course)) / (EARTH_RADIUS * np.cos(np.radians(lat))))
+            lon = ((lon + 180.0) % 360.0) - 180.0
+            hdop = rng.uniform(0.8, 2.5)
+            noiseN, noiseE = rng.normal(0, 5.0 * hdop, 2)
+            fixLat = lat + np.degrees(noiseN / EARTH_RADIUS)
+            fixLon = lon + np.degrees(noiseE / (EARTH_RADIUS * np.cos(np.radians(lat))))
+            fixLon = ((fixLon + 180.0) % 360.0) - 180.0
+            start = time.perf_counter()
+            filt.updatePosition(float(t), fixLat, fixLon, hdop, 1)
+            filt.updateVelocity(float(t), (speed + rng.normal(0, 0.3)) / KNOTS_TO_MPS, course)
+            updateTimes.append(time.perf_counter() - start)
+            boxLats.append(fixLat)
+            boxLons.append(fixLon)
+            est = filt.estimate
+            filtErrs.append(geoDistance.distance((lat, lon), (est.lat, est.lon)).m)
+            boxErrs.append(geoDistance.distance((lat, lon), (sum(boxLats) / len(boxLats), sum(boxLons) / len(boxLons))).m)
+        # skip the filters' warm-up
+        filtErrs, boxErrs = np.array(filtErrs[30:]), np.array(boxErrs[30:])
+        print(f"{name: <11} kalman: rms={np.sqrt(np.mean(filtErrs ** 2)):9.1f}m max={np.max(filtErrs):9.1f}m   "
+              f"boxcar: rms={np.sqrt(np.mean(boxErrs ** 2)):9.1f}m max={np.max(boxErrs):9.1f}m   "
+              f"update={statistics.fmean(updateTimes) * 1e6:.1f}us/fix")
+
+
+def checkCompass():
+    """Check that the compass's heading hysteresis holds the heading through
+       changes smaller than the threshold (including across north), and
+       follows the bigger ones
+    """
+    from Compass import Compass, FakeBNO055, headingDelta
+
+    bno = FakeBNO055(100.0)
+    compass = Compass(bno=bno, sampleRate=0, smoothing=1.0, hysteresis=2.0)
+    results = []
+    # heading turned to: heading expected to be published
+    for heading, expected in ((100.0, 100.0), (101.5, 100.0), (101.9, 100.0), (98.2, 100.0), (102.5, 102.5),
+                              (101.0, 102.5), (359.5, 359.5), (1.0, 359.5), (1.6, 1.6), (0.0, 1.6)):
+        bno.heading = heading
+        compass._sample()
+        results.append(abs(headingDelta(compass.orientation[0], expected)) < 1e-6)
+    check("compass hysteresis", all(results))
+
+def benchCompass(opts):
+    """Check the compass's heading hysteresis, and then measure the cost of
+       reading the orientation from the compass (direct sensor reads vs. the
+       background sampler), and how smoothing and heading hysteresis reduce
+       the jitter of a stationary, noisy compass and the number of times the
+       display's static layer gets re-rotated
+    """
+    from Compass import Compass, FakeBNO055, headingDelta
+    from SymbolAtlas import DEF_ATLAS_RESOLUTION
+
+    checkCompass()
+
+    direct = Compass(bno=FakeBNO055(readDelay=opts.delay), sampleRate=0)
+    sampled = Compass(bno=FakeBNO055(readDelay=opts.delay), sampleRate=opts.rate)
+    for label, compass in (("direct getEulerAngles()", direct), ("sampled getEulerAngles()", sampled)):
+        latencies = []
+        for _ in range(100):
+            t = time.perf_counter()
+            compass.getEulerAngles()
+            latencies.append(time.perf_counter() - t)
+        printLatencies(label, latencies)
+    sampled.close()
+
+    trueHeading = 42.5  # on a static layer quantization boundary, the worst case for jitter
+    steps = round(360.0 / DEF_ATLAS_RESOLUTION)
+    for smoothing, hysteresis in ((1.0, 0.0), (opts.smoothing, 0.0), (opts.smoothing, opts.hysteresis)):
+        compass = Compass(bno=FakeBNO055(trueHeading, noise=opts.noise, seed=0), sampleRate=0,
+                          smoothing=smoothing, hysteresis=hysteresis)
+        headings, rebuilds, lastKey = [], 0, None
+        for _ in range(opts.count):
+            compass._sample()
+            heading = compass.orientation[0]
+            headings.append(heading)
+            key = round(heading / DEF_ATLAS_RESOLUTION) % steps
+            if key != lastKey:
+                rebuilds += 1
+                lastKey = key
+        changes = sum(1 for a, b in zip(headings, headings[1:]) if a != b)
+        rmsErr = math.sqrt(statistics.fmean(headingDelta(h, trueHeading) ** 2 for h in headings))
+        print(f"smoothing={smoothing:.2f} hysteresis={hysteresis:4.1f}  heading changes={changes: <5} "
+              f"static layer rebuilds={rebuilds: <5} rms error={rmsErr:5.2f} deg")
+
+
+def dump1090Snapshot(numAircraft, seed=0):
+    """Return an aircraft.json snapshot (as bytes) of synthetic traffic with
+       all of the (mostly unused) fields that dump1090-fa writes
+    """
+    rnd = random.Random(seed)
+    aircraft = syntheticSnapshot(numAircraft, seed)
+    for a in aircraft:
+        a.update({'type': "adsb_icao", 'alt_geom': a['alt_baro'] + 150, 'ias': rnd.randrange(100, 300),
+                  'tas': rnd.randrange(100, 500), 'mach': round(rnd.uniform(0.2, 0.8), 3), 'track_rate': 0.0,
+                  'roll': round(rnd.uniform(-5, 5), 1), 'mag_heading': round(a['track'] - 13.5, 1),
+                  'true_heading': a['track'], 'nav_qnh': 1013.6, 'nav_altitude_mcp': 36000,
+                  'nav_heading': round(a['track'], 1), 'nav_modes': ["autopilot", "vnav", "tcas"],
+                  'nic': 8, 'rc': 186, 'version': 2, 'nic_baro': 1, 'nac_p': 9, 'nac_v': 1, 'sil': 3,
+                  'sil_type': "perhour", 'gva': 2, 'sda': 2, 'alert': 0, 'spi': 0, 'mlat': [], 'tisb': [],
+                  'messages': rnd.randrange(100, 100000)})
+    return json.dumps({'now': 1700000000.0, 'messages': 123456789, 'aircraft': aircraft}).encode("utf-8")
+
+def benchParse(opts):
+    """Parse throughput and peak memory allocated while parsing aircraft.json
+       snapshots with each SnapshotParser backend, vs. the old full json.loads()
+       of everything, for different numbers of aircraft
+    """
+    from SnapshotParser import BACKENDS, SnapshotParser
+
+    if opts.capture:
+        from AircraftSource import openCapture
+        with openCapture(opts.capture, "r") as f:
+            records = [l for l in f if l.strip()]
+        samples = [(f"capture ({len(records)} records)", records, "parseRecord")]
+    else:
+        samples = [(f"{n} aircraft", [dump1090Snapshot(n)], "parse") for n in opts.aircraft]
+    for label, datas, method in samples:
+        size = sum(len(d) for d in datas)
+        parsers = [("json (full)", (lambda d: json.loads(d)) if method == "parse" else (lambda d: json.loads(d)['snapshot']))]
+        parsers += [(backend, getattr(SnapshotParser(backend), method)) for backend in BACKENDS]
+        for name, parse in parsers:
+            elapsed = timeIt(lambda: [parse(d) for d in datas], opts.count)
+            tracemalloc.start()
+            result = [parse(d) for d in datas]
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label: <22} {name: <12} {elapsed * 1000:9.3f}ms  {(size / elapsed) / 1e6:7.1f}MB/s  "
+                  f"peak={peak / 1024:9.1f}KB ({peak / size:4.2f}x the JSON)")
+            del result
+
+
+def benchSession(opts):
+    """Session recording cost on the ingest thread, file size per aircraft row
+       for each encoding (vs. a gzipped JSON capture), background encoding
+       cost, and the cost of reading the file back, for a synthetic session
+    """
+    from AircraftSource import CaptureWriter
+    import SessionRecorder as sr
+
+    numSnapshots = int(opts.hours * 3600)
+    with tempfile.TemporaryDirectory() as dirPath:
+        capturePath = os.path.join(dirPath, "capture.jsonl.gz")
+        capture = CaptureWriter(capturePath)
+        recorders = {encoding: sr.SessionRecorder(os.path.join(dirPath, str(encoding)), encoding=encoding)
+                     for encoding in sr.ENCODINGS}
+        source = SyntheticSource(SELF_LOCATION, numAircraft=opts.aircraft, speed=0, churn=0.001, seed=0)
+        source.now -= source.now % 86400  # start at midnight, so it's one day's file
+        writeTimes, captureTimes, sample = [], [], []
+        for n in range(numSnapshots):
+            ts, j = source.read()
+            start = time.perf_counter()
+            recorders[sr.DEF_ENCODING].write(ts, j)
+            writeTimes.append(time.perf_counter() - start)
+            for encoding, recorder in recorders.items():
+                if encoding != sr.DEF_ENCODING:
+                    recorder.write(ts, j)
+            start = time.perf_counter()
+            capture.write(ts, j)
+            captureTimes.append(time.perf_counter() - start)
+            if n < 100:
+                sample.append((ts, j))
+        capture.close()
+        for recorder in recorders.values():
+            recorder.close()
+        numRows = recorders[sr.DEF_ENCODING].rowsWritten
+        print(f"{opts.aircraft} aircraft for {opts.hours} hours: {numSnapshots} snapshots, {numRows} rows "
+              f"({sr.ROW_BYTES}B/row unencoded)")
+        printLatencies("  write() on ingest thread", writeTimes)
+        printLatencies("  capture write() (gzip JSON)", captureTimes)
+        encodeTime = timeIt(lambda: [[sr._encodeRow(ts, a) for a in j['aircraft']] for ts, j in sample], 1) / len(sample)
+        print(f"  background row encoding: {encodeTime * 1000:.3f}ms/snapshot")
+        print(f"  gzip JSON capture:  {os.path.getsize(capturePath) / numRows:6.1f}B/row")
+
+        for encoding, recorder in recorders.items():
+            filePath = sr.dayFile(recorder.dirPath, source.now)
+            start = time.perf_counter()
+            reader = sr.SessionReader(filePath)
+            openTime = time.perf_counter() - start
+            columns = reader.read()
+            chunk = {name: c[:sr.DEF_CHUNK_ROWS] for name, c in columns.items()}
+            chunkTime = timeIt(lambda: sr.encodeChunk(chunk, encoding), 3)
+            readTime = timeIt(lambda: reader.read(), 3)
+            first, last = reader.timeRange()
+            rangeTime = timeIt(lambda: reader.read(last - 600, last + 1, ('ts', 'lat', 'lon', 'alt_baro')), 3)
+            uniqueId = sr.hexId(int(columns['icao'][-1]), int(columns['flags'][-1]))
+            aircraftTime = timeIt(lambda: reader.aircraft(uniqueId, fields=('ts', 'lat', 'lon')), 3)
+            print(f"  {('raw', 'zlib', 'shuffle+zlib')[encoding]: <13} {os.path.getsize(filePath) / numRows:6.1f}B/row  "
+                  f"{recorder.chunks} chunk writes  encode={chunkTime * 1e9 / len(chunk['ts']):5.0f}ns/row  "
+                  f"open={openTime * 1000:6.2f}ms  read all={readTime * 1000:7.1f}ms  last 10 mins={rangeTime * 1000:6.1f}ms  "
+                  f"one aircraft={aircraftTime * 1000:6.1f}ms")
+            del columns, chunk
+            reader.close()
+
+
+def benchGrid(opts):
+    """Cost of building the per-frame SpatialGrid, of hit-testing clicks with
+       it vs. scanning every track, and of the label declutter pass (and how
+       many labels it moves/hides), for tracks clustered around an airport
+    """
+    from SpatialGrid import SpatialGrid, placeLabels
+
+    rng = np.random.default_rng(0)
+    diameter, flightSize, altSize, symbolSize, gap = 480, (42, 10), (30, 10), 9, 7
+    for numTracks in opts.tracks:
+        pts = np.clip(rng.normal(diameter / 2, diameter / 8, (numTracks, 2)), 0, diameter - 1)
+        points = [(float(x), float(y)) for x, y in pts]
+        clicks = [(float(x), float(y)) for x, y in rng.uniform(0, diameter, (opts.count, 2))]
+
+        def build():
+            grid = SpatialGrid()
+            for n, (x, y) in enumerate(points):
+                grid.insert((x, y, 0, 0), n)
+            return grid
+
+        def scan():
+            for cx, cy in clicks:
+                d2 = np.sum((pts - (cx, cy)) ** 2, axis=1)
+                nearest = int(np.argmin(d2))
+                _ = nearest if d2[nearest] < 100 else None
+
+        grid = build()
+        buildTime = timeIt(build, 10)
+        scanTime = timeIt(scan, 10) / opts.count
+        gridTime = timeIt(lambda: [grid.nearest(cx, cy, 10) for cx, cy in clicks], 10) / opts.count
+
+        labels, obstacles = [], []
+        for n, (x, y) in enumerate(points):
+            placements = [[(x - (flightSize[0] / 2), y - 5 - flightSize[1], *flightSize), (x - (altSize[0] / 2), y + 7, *altSize)],
+                          [(x + gap, y - flightSize[1], *flightSize), (x + gap, y, *altSize)],
+                          [(x - gap - flightSize[0], y - flightSize[1], *flightSize), (x - gap - altSize[0], y, *altSize)]]
+            labels.append((n, placements))
+            obstacles.append(((x - (symbolSize / 2), y - (symbolSize / 2), symbolSize, symbolSize), n))
+        declutterTime = timeIt(lambda: placeLabels(labels, obstacles), 10)
+        chosen = placeLabels(labels, obstacles)
+        cluttered = SpatialGrid()
+        for rect, n in obstacles:
+            cluttered.insert(rect, n)
+        for n, placements in labels:
+            for rect in placements[0]:
+                cluttered.insert(rect, n)
+        overlapping = sum(1 for n, placements in labels if any(cluttered.collides(r, n) for r in placements[0]))
+        moved = sum(1 for c in chosen.values() if c)
+        hidden = sum(1 for c in chosen.values() if c is None)
+        print(f"{numTracks: >5} tracks  build={buildTime * 1000:7.3f}ms  click: scan={scanTime * 1e6:7.1f}us grid={gridTime * 1e6:6.1f}us  "
+              f"declutter={declutterTime * 1000:7.3f}ms  overlapping={overlapping} moved={moved} hidden={hidden}")
+
+
+def getOps():
+    ap = argparse.ArgumentParser(description="pocket1090 benchmarks")
+    subs = ap.add_subparsers(dest="benchmark", required=True)
+
+    sp = subs.add_parser("watch", help="aircraft.json snapshot latency: inotify vs. polling")
+    sp.add_argument("-n", "--count", type=int, default=20, help="Number of snapshots to write")
+    sp.add_argument("-a", "--aircraft", type=int, default=200, help="Number of aircraft per snapshot")
+    sp.add_argument("-i", "--interval", type=float, default=1.0, help="Secs between snapshots")
+    sp.add_argument("-p", "--pollInterval", type=float, default=0.5, help="Poll interval for the fallback watcher")
+    sp.set_defaults(func=benchWatch)
+
+    sp = subs.add_parser("net", help="Beast/SBS network source decode throughput")
+    sp.add_argument("-n", "--count", type=int, default=100000, help="Number of messages")
+    sp.add_argument("-a", "--aircraft", type=int, default=200, help="Number of aircraft")
+    sp.set_defaults(func=benchNet)
+
+    sp = subs.add_parser("diff", help="Per-cycle track update cost vs. churn")
+    sp.add_argument("-n", "--count", type=int, default=20, help="Number of cycles")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[50, 200, 1000], help="Numbers of aircraft")
+    sp.add_argument("-c", "--churn", type=float, nargs="+", default=[0.0, 0.1, 1.0], help="Fractions of aircraft that change per cycle")
+    sp.set_defaults(func=benchDiff)
+
+    sp = subs.add_parser("geo", help="Batched distance/azimuth speed and accuracy vs. geopy")
+    sp.add_argument("-n", "--count", type=int, default=10, help="Number of repetitions")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[50, 200, 1000], help="Numbers of aircraft")
+    sp.add_argument("-r", "--range", type=float, default=200.0, help="Max distance (in Km) from the self location")
+    sp.set_defaults(func=benchGeo)
+
+    sp = subs.add_parser("table", help="Columnar TrackTable costs and memory per aircraft")
+    sp.add_argument("-n", "--count", type=int, default=10, help="Number of cycles")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[50, 500, 5000], help="Numbers of aircraft")
+    sp.set_defaults(func=benchTable)
+
+    sp = subs.add_parser("track", help="Per-track create/update cost and memory of Track objects")
+    sp.add_argument("-n", "--count", type=int, default=10, help="Number of cycles")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[500, 2000, 10000], help="Numbers of aircraft")
+    sp.set_defaults(func=benchTrack)
+
+    sp = subs.add_parser("stats", help="TrackStats update/summary cost and percentile accuracy")
+    sp.add_argument("-n", "--count", type=int, default=1800, help="Number of 1Hz snapshots")
+    sp.add_argument("-a", "--aircraft", type=int, default=200, help="Number of aircraft")
+    sp.add_argument("-c", "--churn", type=float, default=0.002, help="Probability of an aircraft being replaced per snapshot")
+    sp.set_defaults(func=benchStats)
+
+    sp = subs.add_parser("coverage", help="Coverage map update, save/load/merge, and overlay redraw costs")
+    sp.add_argument("-n", "--count", type=int, default=600, help="Number of 1Hz snapshots")
+    sp.add_argument("-a", "--aircraft", type=int, default=200, help="Number of aircraft")
+    sp.add_argument("-c", "--churn", type=float, default=0.002, help="Probability of an aircraft being replaced per snapshot")
+    sp.add_argument("--assets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"), help="Path to the assets directory")
+    sp.set_defaults(func=benchCoverage)
+
+    sp = subs.add_parser("conflicts", help="Close approach detection cost in dense airspace: grid-bucketed vs. all pairs")
+    sp.add_argument("-a", "--aircraft", type=lambda s: [int(n) for n in s.split(",")], default=[100, 300, 1000, 2000, 5000],
+                    help="Comma-separated numbers of aircraft")
+    sp.add_argument("-r", "--radius", type=float, default=64.0, help="Km radius the aircraft are in")
+    sp.add_argument("-D", "--density", type=float, default=None, help="Aircraft per 1000 Km^2 (instead of a fixed radius)")
+    sp.add_argument("-H", "--horizon", type=float, default=60.0, help="Secs to look ahead")
+    sp.add_argument("-b", "--maxBrute", type=int, default=2000, help="Max number of aircraft to test all pairs of")
+    sp.add_argument("-n", "--count", type=int, default=5, help="Number of checks to time")
+    sp.set_defaults(func=benchConflicts)
+
+    sp = subs.add_parser("aggregate", help="Multi-receiver Aggregator correctness, merge latency, and CPU load")
+    sp.add_argument("-f", "--feeds", type=int, default=10, help="Number of stand-in feeds")
+    sp.add_argument("-a", "--aircraft", type=int, default=500, help="Number of aircraft")
+    sp.add_argument("-F", "--fraction", type=float, default=0.7, help="Fraction of the aircraft each feed sees")
+    sp.add_argument("-i", "--interval", type=float, default=1.0, help="Secs between each feed's snapshots")
+    sp.add_argument("-m", "--minInterval", type=float, default=0.0, help="Aggregator's min secs between merged snapshots")
+    sp.add_argument("-d", "--duration", type=float, default=10.0, help="Secs to run the load for")
+    sp.set_defaults(func=benchAggregate)
+
+    sp = subs.add_parser("api", help="Track server snapshot/delta sizes, fan-out cost, and latency with many WebSocket clients")
+    sp.add_argument("-a", "--aircraft", type=int, default=300, help="Number of aircraft")
+    sp.add_argument("-c", "--changed", type=float, default=0.3, help="Fraction of the aircraft that change per snapshot")
+    sp.add_argument("-C", "--churn", type=float, default=0.01, help="Fraction of the aircraft that are replaced per snapshot")
+    sp.add_argument("-n", "--clients", type=int, default=50, help="Number of WebSocket clients")
+    sp.add_argument("-s", "--slow", type=int, default=3, help="Number of (additional) clients that read too slowly")
+    sp.add_argument("-f", "--format", choices=("json", "msgpack"), default="json", help="Message format")
+    sp.add_argument("-q", "--queueSize", type=int, default=8, help="Max messages queued per client")
+    sp.add_argument("-r", "--rate", type=float, default=10.0, help="Deltas per sec")
+    sp.add_argument("-d", "--duration", type=float, default=10.0, help="Secs to publish for")
+    sp.set_defaults(func=benchApi)
+
+    sp = subs.add_parser("apiclients", help="WebSocket clients of the track server (used by the api benchmark)")
+    sp.add_argument("-p", "--port", type=int, required=True, help="Track server port")
+    sp.add_argument("-n", "--clients", type=int, default=50, help="Number of clients")
+    sp.add_argument("-s", "--slow", type=int, default=0, help="Number of (additional) clients that read too slowly")
+    sp.add_argument("-S", "--slowDelay", type=float, default=0.2, help="Secs the slow clients wait after each message")
+    sp.add_argument("-f", "--format", choices=("json", "msgpack"), default="json", help="Message format")
+    sp.add_argument("-d", "--duration", type=float, default=10.0, help="Secs to run for")
+    sp.set_defaults(func=benchApiClients)
+
+    sp = subs.add_parser("render", help="Radar display frame cost: full vs. dirty-region redraws")
+    sp.add_argument("-n", "--count", type=int, default=30, help="Number of frames")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[50, 200], help="Numbers of aircraft")
+    sp.add_argument("-c", "--churn", type=float, nargs="+", default=[0.0, 0.1, 1.0], help="Fractions of aircraft that move per frame")
+    sp.add_argument("-i", "--interval", type=float, default=1.0, help="Secs between frames (for CPU load)")
+    sp.add_argument("-m", "--mode", choices=("summary", "details"), default="details", help="Info panel mode")
+    sp.add_argument("-t", "--trails", type=int, default=0, help="Number of trail points")
+    sp.add_argument("--assets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"), help="Path to the assets directory")
+    sp.set_defaults(func=benchRender)
+
+    sp = subs.add_parser("headless", help="Deterministic headless render, with frame digest and frame export costs")
+    sp.add_argument("-n", "--count", type=int, default=30, help="Number of frames")
+    sp.add_argument("-a", "--aircraft", type=int, default=200, help="Number of aircraft")
+    sp.add_argument("-t", "--trails", type=int, default=5, help="Number of trail points")
+    sp.add_argument("-H", "--heading", type=float, default=0.0, help="Heading of the display")
+    sp.add_argument("--assets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"), help="Path to the assets directory")
+    sp.set_defaults(func=benchHeadless)
+
+    sp = subs.add_parser("shmread", help="Shared memory frame read cost (used by the headless benchmark)")
+    sp.add_argument("-n", "--count", type=int, default=100, help="Number of reads")
+    sp.add_argument("name", help="Name of the shared memory segment")
+    sp.set_defaults(func=benchShmRead)
+
+    sp = subs.add_parser("text", help="Track label rendering cost: direct vs. TextCache")
+    sp.add_argument("-n", "--count", type=int, default=30, help="Number of frames")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[50, 200, 1000], help="Numbers of aircraft")
+    sp.add_argument("-c", "--churn", type=float, nargs="+", default=[0.0, 0.1, 1.0], help="Fractions of altitudes that change per frame")
+    sp.add_argument("-s", "--size", type=int, default=1024, help="Max number of cached surfaces")
+    sp.set_defaults(func=benchText)
+
+    sp = subs.add_parser("symbols", help="Track symbol rotation cost: per-frame rotation vs. SymbolAtlas")
+    sp.add_argument("-n", "--count", type=int, default=30, help="Number of frames")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[50, 200, 1000], help="Numbers of aircraft")
+    sp.add_argument("-r", "--resolution", type=float, nargs="+", default=[1.0, 5.0, 15.0], help="Atlas resolutions (in degrees)")
+    sp.add_argument("--assets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"), help="Path to the assets directory")
+    sp.set_defaults(func=benchSymbols)
+
+    sp = subs.add_parser("profiler", help="Stage timer overhead when disabled/enabled")
+    sp.add_argument("-n", "--count", type=int, default=1000000, help="Number of timed stages")
+    sp.set_defaults(func=benchProfiler)
+
+    sp = subs.add_parser("gps", help="Background GPS reader latency, using a pty fake serial device")
+    sp.add_argument("-n", "--count", type=int, default=50, help="Number of fixes")
+    sp.add_argument("-i", "--interval", type=float, default=0.05, help="Secs between fixes")
+    sp.set_defaults(func=benchGps)
+
+    sp = subs.add_parser("posfilter", help="Kalman position filter vs. boxcar average error and cost")
+    sp.add_argument("-n", "--count", type=int, default=600, help="Number of 1Hz fixes")
+    sp.add_argument("-A", "--antimeridian", action="store_true", default=False, help="Start next to the antimeridian")
+    sp.set_defaults(func=benchPosFilter)
+
+    sp = subs.add_parser("compass", help="Compass read cost and heading jitter: direct reads vs. smoothed background sampling")
+    sp.add_argument("-n", "--count", type=int, default=1000, help="Number of samples of the stationary compass")
+    sp.add_argument("-d", "--delay", type=float, default=0.002, help="Secs per (fake) sensor read")
+    sp.add_argument("-r", "--rate", type=float, default=20.0, help="Background sampling rate (Hz)")
+    sp.add_argument("-N", "--noise", type=float, default=1.5, help="Std dev of the sensor noise (degrees)")
+    sp.add_argument("-s", "--smoothing", type=float, default=0.3, help="Weight of each new sample")
+    sp.add_argument("-H", "--hysteresis", type=float, default=2.0, help="Heading hysteresis (degrees)")
+    sp.set_defaults(func=benchCompass)
+
+    sp = subs.add_parser("parse", help="aircraft.json parse throughput and peak allocation per parser backend")
+    sp.add_argument("-n", "--count", type=int, default=20, help="Number of repetitions")
+    sp.add_argument("-a", "--aircraft", type=int, nargs="+", default=[10, 200, 2000], help="Numbers of aircraft")
+    sp.add_argument("-c", "--capture", type=str, help="Parse the records of a capture file instead of synthetic snapshots")
+    sp.set_defaults(func=benchParse)
+
+    sp = subs.add_parser("session", help="Session recorder cost, file size, and read speed per encoding")
+    sp.add_argument("-a", "--aircraft", type=int, default=200, help="Number of aircraft")
+    sp.add_argument("-H", "--hours", type=float, default=0.5, help="Hours of 1Hz snapshots")
+    sp.set_defaults(func=benchSession)
+
+    sp = subs.add_parser("grid", help="Track hit-testing and label declutter cost with a SpatialGrid")
+    sp.add_argument("-n", "--count", type=int, default=1000, help="Number of clicks")
+    sp.add_argument("-t", "--tracks", type=int, nargs="+", default=[100, 300, 600], help="Numbers of on-screen tracks")
+    sp.set_defaults(func=benchGrid)
+
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    opts = getOps()
+    opts.func(opts)
+    sys.exit(0)
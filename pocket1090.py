@@ -10,7 +10,7 @@
 # * ?
 #
 # N.B.
-#  need to do "export SDL_VIDEODRIVER='dummy'"
+#  need to do "export SDL_VIDEODRIVER='dummy'" (or use headless mode, i.e., '-H')
 #  workon POCKET_1090
 #  /home/jdn/Code2/dump1090/dump1090 --write-json /tmp/ > /tmp/fa.txt
 #
@@ -18,38 +18,131 @@
 ################################################################################
 
 import argparse
+import asyncio
 from datetime import datetime, timezone
 import json
 import logging
 import math
 import os
+import signal
 import sys
+import threading
 import time
 import yaml
 
 from geopy import Point
+from geopy import distance as geoDistance
 
 from __init__ import * #### FIXME
 
-from Compass import Compass
-from GPS import GPS
-from RadarDisplay import RadarDisplay
-from Track import TrackSpec, Track
+from Aggregator import DEF_AGGREGATOR_HOST, DEF_AGGREGATOR_PORT, DEF_MIN_INTERVAL as DEF_AGGREGATOR_INTERVAL, \
+                       SNAPSHOT_PATHS, Aggregator, parseFeed
+from AircraftSource import CaptureSource, CaptureWriter, HttpSource, JsonDirSource, SyntheticSource
+from Compass import DEF_HYSTERESIS, DEF_SAMPLE_RATE, DEF_SMOOTHING, Compass
+from Conflicts import DEF_HORIZON as DEF_ALERT_HORIZON, DEF_OBSERVER_ALTITUDE, DEF_OBSERVER_HEIGHT, DEF_OBSERVER_RADIUS, \
+                      DEF_PAIR_SEPARATION, DEF_PAIR_VERTICAL, ConflictDetector, alertText
+from Coverage import CoverageMap
+from FrameExport import DEF_MJPEG_FPS, DEF_MJPEG_HOST, MjpegServer, PngSink, SharedMemorySink
+from FramePacer import DEF_FPS, FramePacer
+from Geodesy import DEF_GEO_MODE, GEO_MODES
+from GPS import DEF_MAX_FIX_AGE, DEF_SERIAL_PORT, GPS
+from NetSource import NetSource
+from Profiler import PROFILER
+from RadarDisplay import DEF_WINDOW_SIZE, RadarDisplay
+from SessionRecorder import DEF_FLUSH_INTERVAL as DEF_SESSION_FLUSH_INTERVAL, SessionRecorder
+from SnapshotParser import DEF_BACKEND as DEF_JSON_PARSER, BACKENDS as JSON_PARSERS, SnapshotParser
+from SymbolAtlas import DEF_ATLAS_RESOLUTION
+from TextCache import DEF_TEXT_CACHE_SIZE
+from Track import Track, updateTracks
+from TrackHistory import DEF_HISTORY_DEPTH, DEF_HISTORY_MAX_AGE
+from TrackServer import DEF_API_HOST, DEF_QUEUE_SIZE as DEF_API_QUEUE_SIZE, TrackServer
+from TrackStats import TrackStats
+from TrackTable import TrackTable
 
 DEF_CONFIG_FILE = "./pocket1090.yml"
 
 DEFAULT_CONFIG = {
     'logLevel': "DEBUG",  #"DEBUG" #"INFO" #"WARNING"
     'logFile': None,  # None means use stdout
-    'assetsPath': "/opt/pocket1090/assets"
+    'assetsPath': "/opt/pocket1090/assets",
+    'gpsPort': DEF_SERIAL_PORT,  # serial device the GPS module is on
+    'gpsMaxFixAge': DEF_MAX_FIX_AGE,  # secs the location is dead-reckoned past the latest GPS fix
+    'useInotify': True,
+    'pollInterval': 0.5,  # secs, only used if inotify isn't available
+    'jsonParser': DEF_JSON_PARSER,  # "msgspec", "orjson", or "json" (defaults to the fastest one installed)
+    'netInterval': 0.25,  # min secs between snapshots from a network source (or between requests, for http)
+    'aggregatorHost': DEF_AGGREGATOR_HOST,  # address to serve the merged snapshot on, in aggregator mode ('-A')
+    'aggregatorPort': DEF_AGGREGATOR_PORT,  # port to serve it on (None means don't serve it)
+    'aggregatorDir': None,  # directory to also write the merged snapshot to, as aircraft.json (preferably on a tmpfs)
+    'aggregatorInterval': DEF_AGGREGATOR_INTERVAL,  # min secs between merged snapshots
+    'geoMode': DEF_GEO_MODE,  # "ellipsoidal", "haversine", or "enu"
+    'historyDepth': DEF_HISTORY_DEPTH,     # max number of trail points kept per track
+    'historyMaxAge': DEF_HISTORY_MAX_AGE,  # secs, None means trail points don't expire
+    'fullScreen': False,
+    'headless': False,  # render offscreen, without a window (e.g., to only export the frames)
+    'framePng': None,  # path of a PNG file to write frames to ('{frame}' in it is replaced with the frame number)
+    'framePngEvery': 10,  # write every N-th frame to framePng
+    'frameShm': None,  # name of a shared memory segment to copy each frame's raw RGB pixels into
+    'mjpegPort': None,  # port to serve the frames on as an MJPEG stream (i.e., http://<mjpegHost>:<mjpegPort>/stream)
+    'mjpegHost': DEF_MJPEG_HOST,
+    'mjpegFps': DEF_MJPEG_FPS,  # max frames per second of the MJPEG stream
+    'dirtyRects': True,  # only redraw the parts of the radar that changed (False means redraw every frame)
+    'textCacheSize': DEF_TEXT_CACHE_SIZE,  # max number of rendered labels/lines of text kept
+    'symbolResolution': DEF_ATLAS_RESOLUTION,  # degrees between the pre-rotated copies of the symbols
+    'declutterLabels': True,  # move (or hide) track labels that would overlap other labels or symbols
+    'fps': DEF_FPS,  # display frames per second, independent of the rate of snapshots
+    'compassRate': DEF_SAMPLE_RATE,  # Hz the compass is sampled at in the background (0 means read it every frame)
+    'compassSmoothing': DEF_SMOOTHING,  # weight of each new compass sample (1.0 means no smoothing)
+    'headingHysteresis': DEF_HYSTERESIS,  # degrees the heading must change by before the display is re-rotated
+    'sessionDir': None,  # directory to record every snapshot's aircraft into, in a compact binary file per day
+    'sessionFlushInterval': DEF_SESSION_FLUSH_INTERVAL,  # max secs the session recording is buffered before it's written
+    'coverageFile': None,  # file to accumulate the receiver's range/coverage map in (merged with the map already in it, if any)
+    'coverageSaveInterval': 300.0,  # secs between saves of the coverage map (it's also saved on exit)
+    'apiPort': None,  # port to serve the tracks on (i.e., http://<apiHost>:<apiPort>/tracks and ws://<apiHost>:<apiPort>/stream)
+    'apiHost': DEF_API_HOST,
+    'apiQueueSize': DEF_API_QUEUE_SIZE,  # max messages queued for a WebSocket client before it's sent a new snapshot instead
+    'conflictAlerts': True,  # alert on aircraft predicted to pass close to the observer or to each other
+    'alertHorizon': DEF_ALERT_HORIZON,  # secs to look ahead for close approaches
+    'pairSeparation': DEF_PAIR_SEPARATION,  # Km, aircraft predicted to come closer than this horizontally...
+    'pairVertical': DEF_PAIR_VERTICAL,  # ...and this many feet vertically are alerted on
+    'observerRadius': DEF_OBSERVER_RADIUS,  # Km, aircraft predicted to come closer than this to the observer horizontally...
+    'observerHeight': DEF_OBSERVER_HEIGHT,  # ...and this many feet above/below it are alerted on
+    'observerAltitude': DEF_OBSERVER_ALTITUDE,  # feet
+    'maxExtrapolation': 10.0,  # max secs to dead-reckon tracks past their last position (0 means don't)
+    'profile': False,  # time the stages of the ingestion and render pipelines
+    'profileDumpPath': "/tmp/pocket1090_profile"  # SIGUSR1 (and exit) writes stage times to <path>.json and <path>.prom
 }
 
 REQUIRED_FIELDS = set({'lat', 'lon'})
 
+WAIT_TIMEOUT = 1.0  # secs to wait for a new aircraft.json before checking for quit
+
+REPROJECT_DISTANCE = 0.01  # Km the self location can move before all tracks are re-projected
+
+
+def getSource(options):
+    """Return the AircraftSource selected by the options
+    """
+    if options.net:
+        fmt, host, port = options.net
+        if fmt == "http":
+            return HttpSource(f"http://{host}:{port or DEF_AGGREGATOR_PORT}{SNAPSHOT_PATHS[0]}",
+                              interval=options.config['netInterval'], parser=SnapshotParser(options.config['jsonParser']))
+        return NetSource(host, port, fmt, refLocation=options.position,
+                         minInterval=options.config['netInterval'])
+    if options.replay:
+        return CaptureSource(options.replay, speed=options.speed, parser=SnapshotParser(options.config['jsonParser']))
+    if options.synthetic:
+        if options.position is None:
+            fatalError("Synthetic traffic requires a fixed position")
+        return SyntheticSource(options.position, numAircraft=options.synthetic, speed=options.speed)
+    return JsonDirSource(options.path, pollInterval=options.config['pollInterval'],
+                         useInotify=options.config['useInotify'], parser=SnapshotParser(options.config['jsonParser']))
+
 
 def run(options):
-    rcvrFile = os.path.join(options.path, "receiver.json")
-    if os.path.exists(rcvrFile):
+    rcvrFile = os.path.join(options.path, "receiver.json") if options.path else None
+    if rcvrFile and os.path.exists(rcvrFile):
         with open(rcvrFile, "r") as f:
             rcvrInfo = json.load(f)
         if options.verbose:
@@ -57,85 +150,274 @@ def run(options):
             json.dump(rcvrInfo, sys.stdout, indent=4, sort_keys=True)
             print("")
 
-    if options.position is None:
-        gps = GPS()
-    if options.orientation is None:
-        compass = Compass()
-    radar = RadarDisplay(options.config['assetsPath'], fullScreen=options.config['fullScreen'], verbose=options.verbose)
-
-    running = True
-    aircraftFile = os.path.join(options.path, "aircraft.json")
-    lastTs = 0
-    now = None
-    msgCount = 0
-    tracks = {}
-    while running:
-        ts = os.stat(aircraftFile).st_mtime
-        while ts == lastTs:
-            ts = os.stat(aircraftFile).st_mtime
-            time.sleep(0.5)
-        lastTs = ts
-        with open(aircraftFile, "r") as f:
-            j = json.load(f)
-            now = j['now']
-            msgCount = j['messages']
-            unfilteredAircraftInfo = {a['hex']: a for a in j['aircraft']}
-        aircraftInfo = {k: v for k, v in unfilteredAircraftInfo.items() if REQUIRED_FIELDS.issubset(v.keys())}
-        added, removed, changed, unchanged = dictDiff(aircraftInfo, unfilteredAircraftInfo)
-        filtered = {k: v for k, v in unfilteredAircraftInfo.items() if k in removed}
-        ##logging.debug(f"Filtered: {filtered}, {len(added)}, {len(removed)}, {len(changed)}, {len(unchanged)}")
-        if options.verbose > 1:
-            print("Aircraft Info:")
-            json.dump(aircraftInfo, sys.stdout, indent=4, sort_keys=True)
-            print("")
-        ##logging.debug(f"Current number of aircraft: {len(aircraftInfo)}")
-        if options.verbose:
-            currentFlightNums = [a['flight'] for a in aircraftInfo.values() if 'flight' in a]
-            if currentFlightNums:
-                logging.info(f"Flights ({len(currentFlightNums)}): {currentFlightNums}")
-
-        #### TODO detect "interesting" cases (e.g., emergency, other than "A?") and save them
-        emergencies = {k: v for k, v in aircraftInfo.items() if v.get('emergency', "none") != "none"}
-        if emergencies and options.exceptFd:
-            options.exceptFd.write(f"\a\nEmergencies: {emergencies}\n\a")
-        oddVehicles = {k: v for k, v in aircraftInfo.items() if not v.get('category', "A").startswith("A")}
-        if oddVehicles:
-            options.exceptFd.write(f"\a\nUnusual Vehicles: {oddVehicles}\n\a")
-
-        if options.orientation is None:
-            heading, roll, pitch = compass.getEulerAngles()
+    gps = GPS(options.config['gpsPort'], maxFixAge=options.config['gpsMaxFixAge']) if options.position is None else None
+    compass = Compass(sampleRate=options.config['compassRate'], smoothing=options.config['compassSmoothing'],
+                      hysteresis=options.config['headingHysteresis']) if options.orientation is None else None
+    pacer = FramePacer(options.config['fps'])
+    stats = TrackStats()
+    coverage = None
+    if options.config['coverageFile']:
+        coverage = CoverageMap(site=options.position)
+        coveragePath = coverage.loadAndMerge(options.config['coverageFile'])
+        if coveragePath == options.config['coverageFile']:
+            logging.info(f"Loaded coverage map: {coveragePath} ({len(coverage)} cells)")
+        # N.B. the file can't be saved over if it couldn't be merged
+        options.config['coverageFile'] = coveragePath
+    frameSinks = []
+    if options.config['framePng']:
+        frameSinks.append(PngSink(options.config['framePng'], options.config['framePngEvery']))
+    if options.config['frameShm']:
+        frameSinks.append(SharedMemorySink(options.config['frameShm'], DEF_WINDOW_SIZE))
+    if options.config['mjpegPort']:
+        frameSinks.append(MjpegServer(options.config['mjpegPort'], options.config['mjpegHost'], options.config['mjpegFps']))
+    radar = RadarDisplay(options.config['assetsPath'], fullScreen=options.config['fullScreen'],
+                         dirtyRects=options.config['dirtyRects'], textCacheSize=options.config['textCacheSize'],
+                         symbolResolution=options.config['symbolResolution'],
+                         declutter=options.config['declutterLabels'], headless=options.config['headless'],
+                         frameSinks=frameSinks, pacer=pacer, stats=stats, coverage=coverage, verbose=options.verbose)
+    if options.config['headless']:
+        # there's no window to close, so quit on a signal
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: setattr(radar, 'running', False))
+
+    Track.historyDepth = options.config['historyDepth']
+    Track.historyMaxAge = options.config['historyMaxAge']
+
+    if options.config['profile']:
+        PROFILER.enable()
+        signal.signal(signal.SIGUSR1, lambda signum, frame: PROFILER.dump(options.config['profileDumpPath']))
+
+    source = getSource(options)
+    recorders = []
+    if options.record:
+        recorders.append(CaptureWriter(options.record))
+    if options.config['sessionDir']:
+        recorders.append(SessionRecorder(options.config['sessionDir'], flushInterval=options.config['sessionFlushInterval']))
+    trackServer = None
+    if options.config['apiPort']:
+        try:
+            trackServer = TrackServer(options.config['apiHost'], options.config['apiPort'], options.config['apiQueueSize'])
+        except OSError as e:
+            fatalError(f"Failed to start the track server: {e}")
+    conflicts = None
+    if options.config['conflictAlerts']:
+        conflicts = ConflictDetector(options.config['alertHorizon'], options.config['pairSeparation'],
+                                     options.config['pairVertical'], options.config['observerRadius'],
+                                     options.config['observerHeight'], options.config['observerAltitude'])
+    tracks = TrackTable()
+    trackStates = {}
+    tracksLock = threading.Lock()
+    shared = {'running': True, 'failed': False, 'ts': None, 'received': None, 'curTime': None, 'selfLocation': None}
+    ingester = threading.Thread(target=ingest, args=(options, source, recorders, gps, tracks, trackStates, tracksLock, stats, coverage,
+                                                     trackServer, conflicts, shared),
+                                daemon=True)
+    ingester.start()
+
+    # snapshot timestamps advance at the replay/synthetic speed, not in real time
+    clockRate = options.speed if (options.replay or options.synthetic) and options.speed > 0 else 1.0
+    maxExtrapolation = options.config['maxExtrapolation']
+    # frames are rendered from a copy of the tracks, so the lock is only held
+    #  while that's brought up to date (once per snapshot), not while rendering
+    view = TrackTable()
+    while shared['running'] and radar.running:
+        dropped = pacer.wait()
+        if dropped:
+            logging.debug(f"Dropped {dropped} frame(s)")
+        frameStart = time.perf_counter()
+        if compass:
+            with PROFILER.stage("compass"):
+                heading, roll, pitch = compass.getEulerAngles()
         else:
             heading, roll, pitch = options.orientation
-        if options.position is None:
-            curTime, selfLocation = gps.getFilteredLocation()  #### TODO consider adding and handling timeouts
-        else:
-            curTime = datetime.utcnow().isoformat()
-            selfLocation = options.position
-        logging.info(f"Self: curTime={curTime}, location={selfLocation}, heading={heading}, roll={roll}, pitch={pitch}")
-
-        for uniqueId, info in aircraftInfo.items():
-            if uniqueId in tracks.keys():
-                tracks[uniqueId].update(ts, selfLocation, **info)
-                logging.debug(f"Updated track '{uniqueId}'")
-            else:
-                tracks[uniqueId] = Track(ts, selfLocation, **info)
-                logging.debug(f"New Track {uniqueId}: {tracks[uniqueId]}")
+        with tracksLock:
+            if shared['ts'] is None:
+                continue
+            if view.version != tracks.version:
+                with PROFILER.stage("copy"):
+                    view.copyFrom(tracks)
+            ts, received, curTime, selfLocation = shared['ts'], shared['received'], shared['curTime'], shared['selfLocation']
+        positions = None
+        if maxExtrapolation > 0:
+            with PROFILER.stage("predict"):
+                now = ts + ((time.monotonic() - received) * clockRate)
+                positions = view.predict(now, maxExtrapolation)
+        with PROFILER.stage("render"):
+            done = radar.render((heading, roll, pitch), selfLocation, curTime, view, positions)
+        PROFILER.record("frame", time.perf_counter() - frameStart)
+        if done:
+            break
+    logging.info(f"Frame pacing: {pacer}")
+    if PROFILER.enabled:
+        logging.info("Stage times:\n" + "\n".join(PROFILER.reportLines()))
+        PROFILER.dump(options.config['profileDumpPath'])
+    shared['running'] = False
+    ingester.join(2 * WAIT_TIMEOUT)
+    source.close()
+    if gps:
+        gps.close()
+    if compass:
+        compass.close()
+    for recorder in recorders:
+        recorder.close()
+    if coverage is not None:
+        coverage.save(options.config['coverageFile'])
+    if conflicts:
+        logging.info(f"Conflict alerts: {conflicts}")
+    if trackServer:
+        logging.info(f"Track server: {trackServer}")
+        trackServer.close()
+    radar.quit()
+    print("DONE")
+    return 1 if shared['failed'] else 0
 
-        uids = aircraftInfo.keys()
-        tracks = {k: v for k,v in tracks.items() if k in uids}
 
-        if radar.render((heading, roll, pitch), selfLocation, curTime, tracks):
-            running = False
-    radar.quit()
+def runAggregator(options):
+    """Merge the feeds given with '-A' and publish the merged snapshot, until
+       interrupted
+    """
+    try:
+        feeds = {spec: parseFeed(spec, options.config['jsonParser'], options.config['netInterval']) for spec in options.aggregate}
+    except ValueError as e:
+        fatalError(f"{e}")
+    aggregator = Aggregator(feeds, outputDir=options.config['aggregatorDir'], host=options.config['aggregatorHost'],
+                            port=options.config['aggregatorPort'], minInterval=options.config['aggregatorInterval'])
+    if options.config['profile']:
+        PROFILER.enable()
+        signal.signal(signal.SIGUSR1, lambda signum, frame: PROFILER.dump(options.config['profileDumpPath']))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, aggregator.stop)
+        await aggregator.run()
+
+    logging.info(f"Aggregating {len(feeds)} feeds: {', '.join(feeds)}")
+    asyncio.run(main())
+    logging.info(f"Aggregator: {aggregator}")
+    if PROFILER.enabled:
+        logging.info("Stage times:\n" + "\n".join(PROFILER.reportLines()))
+        PROFILER.dump(options.config['profileDumpPath'])
     print("DONE")
     return 0
 
 
+def ingest(options, source, recorders, gps, tracks, trackStates, tracksLock, stats, coverage, trackServer, conflicts, shared):
+    """Read snapshots from the source and update the tracks with them, until
+       the source ends or 'running' is cleared in the shared state (which
+       this clears when it stops, including if it fails, so the display stops
+       too)
+
+      Everything but the track update is done without holding the tracks lock,
+      so that rendering delays ingestion as little as possible. (The deltas
+      are published to the track server, and the conflicts checked, after
+      releasing it, which is safe because this is the only thing that updates
+      the tracks.)
+    """
+    try:
+        projLocation = None
+        atSite = True
+        lastSave = time.monotonic()
+        while shared['running']:
+            try:
+                snapshot = source.read(WAIT_TIMEOUT)
+            except EOFError as e:
+                logging.info(f"{e}")
+                break
+            if snapshot is None:
+                continue
+            received = time.monotonic()
+            ts, j = snapshot
+            for recorder in recorders:
+                recorder.write(ts, j)
+            aircraftInfo = {a['hex']: a for a in j['aircraft'] if REQUIRED_FIELDS.issubset(a.keys())}
+            if options.verbose > 1:
+                print("Aircraft Info:")
+                json.dump(aircraftInfo, sys.stdout, indent=4, sort_keys=True)
+                print("")
+            ##logging.debug(f"Current number of aircraft: {len(aircraftInfo)}")
+            if options.verbose:
+                currentFlightNums = [a['flight'] for a in aircraftInfo.values() if 'flight' in a]
+                if currentFlightNums:
+                    logging.info(f"Flights ({len(currentFlightNums)}): {currentFlightNums}")
+
+            # N.B. close approaches are detected once the tracks have been updated
+            emergencies = {k: v for k, v in aircraftInfo.items() if v.get('emergency', "none") != "none"}
+            if emergencies and options.exceptFd:
+                options.exceptFd.write(f"\a\nEmergencies: {emergencies}\n\a")
+            oddVehicles = {k: v for k, v in aircraftInfo.items() if not v.get('category', "A").startswith("A")}
+            if oddVehicles and options.exceptFd:
+                options.exceptFd.write(f"\a\nUnusual Vehicles: {oddVehicles}\n\a")
+
+            if gps:
+                with PROFILER.stage("gps"):
+                    curTime, selfLocation = gps.getFilteredLocation(WAIT_TIMEOUT)
+                if selfLocation is None:
+                    logging.warning("No GPS fix, dropping snapshot")
+                    continue
+            else:
+                curTime = datetime.utcnow().isoformat()
+                selfLocation = options.position
+            logging.info(f"Self: curTime={curTime}, location={selfLocation}")
+
+            reproject = (projLocation is None) or (geoDistance.distance(projLocation, selfLocation).km > REPROJECT_DISTANCE)
+            if reproject:
+                projLocation = selfLocation
+                if (coverage is not None) and (coverage.checkSite(selfLocation) != atSite):
+                    atSite = not atSite
+                    if not atSite:
+                        logging.warning(f"Not at the coverage map's site ({coverage.site}), not updating it")
+            start = time.perf_counter()
+            with tracksLock:
+                lockWait = time.perf_counter() - start
+                PROFILER.record("lockWait", lockWait)
+                added, removed, changed, unchanged = updateTracks(tracks, trackStates, aircraftInfo, ts, selfLocation, reproject,
+                                                                  options.config['geoMode'])
+                with PROFILER.stage("stats"):
+                    for uniqueId in (added | changed):
+                        stats.update(tracks[uniqueId])
+                if (coverage is not None) and atSite:
+                    with PROFILER.stage("coverage"):
+                        for uniqueId in (added | changed):
+                            coverage.updateTrack(tracks[uniqueId])
+                shared.update(ts=ts, received=received, curTime=curTime, selfLocation=selfLocation)
+            cycleTime = (time.perf_counter() - start) * 1000.0
+            if trackServer:
+                trackServer.publish(ts, tracks, added, changed, removed)
+            if conflicts:
+                with PROFILER.stage("conflicts"):
+                    alerts = conflicts.check(tracks, ts)
+                for alert in alerts:
+                    logging.warning(f"Alert: {alertText(alert)}")
+                    if options.exceptFd:
+                        options.exceptFd.write(f"\a\nClose Approach: {alertText(alert)}\n\a")
+            PROFILER.record("ingest", time.monotonic() - received)
+            logging.debug(f"Tracks: {len(tracks)} (added={len(added)}, removed={len(removed)}, changed={len(changed)}, unchanged={len(unchanged)}{', reprojected' if reproject else ''}) in {cycleTime:.2f} ms ({lockWait * 1000.0:.2f} ms waiting for render)")
+            logging.debug(f"Ingestion latency: {(time.monotonic() - received) * 1000.0:.2f} ms")
+            if (coverage is not None) and ((received - lastSave) >= options.config['coverageSaveInterval']):
+                lastSave = received
+                try:
+                    coverage.save(options.config['coverageFile'])
+                except OSError as e:
+                    logging.warning(f"Failed to save coverage map: {e}")
+    except Exception:
+        # N.B. the tracks may have been left part way through an update, so
+        #      stop, rather than have the display go on showing them as if
+        #      they were current
+        logging.exception("Failed to ingest a snapshot, stopping")
+        shared['failed'] = True
+    finally:
+        shared['running'] = False
+
+
 def getOps():
     usage = f"Usage: {sys.argv[0]} [-c <configFile>] [-f] [-L <logLevel>]"
     usage += " [-l <logFile>] [-o <heading>,<roll>,<pitch>] [-p <lat>,<lon>]"
-    usage += " [-e <path>] [-v] <path>"
+    usage += " [-e <path>] [-n <fmt>:<host>[:<port>]] [-r <captureFile>] [-R <captureFile>] [-A <feed>]"
+    usage += " [-S <numAircraft>] [-x <speed>] [-P] [-v] <path>"
     ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "-A", "--aggregate", action="append", type=str,
+        help="Run as an aggregator of the given feed, instead of a display (repeat for each feed: 'dir:<path>', 'http://<url>', 'beast:<host>[:<port>]', or 'sbs:<host>[:<port>]')")
     ap.add_argument(
         "-c", "--configFile", action="store", type=str, default=DEF_CONFIG_FILE,
         help="Path to file with configuration information; will be created if doesn't exist")
@@ -145,6 +427,9 @@ def getOps():
     ap.add_argument(
         "-f", "--fullScreen", action="store_true", default=False,
         help="Execute in full screen mode")
+    ap.add_argument(
+        "-H", "--headless", action="store_true", default=False,
+        help="Render offscreen without a window (e.g., to export frames as PNG, shared memory, or MJPEG)")
     ap.add_argument(
         "-L", "--logLevel", action="store", type=str,
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
@@ -152,17 +437,35 @@ def getOps():
     ap.add_argument(
         "-l", "--logFile", action="store", type=str,
         help="Path to location of logfile (create it if it doesn't exist)")
+    ap.add_argument(
+        "-n", "--net", action="store", type=str,
+        help="Read from dump1090's network output (or an aggregator's merged snapshot) instead of its json files (string of the form '<beast|sbs|http>:<host>[:<port>]')")
     ap.add_argument(
         "-o", "--orientation", action="store", type=str,
         help="Fixed orientation to use instead of Compass (string containing three comma-separated floats: 'heading, roll, pitch'))")
+    ap.add_argument(
+        "-P", "--profile", action="store_true", default=False,
+        help="Time the stages of the ingestion and render pipelines (send SIGUSR1 to dump them)")
     ap.add_argument(
         "-p", "--position", action="store", type=str,
         help="Fixed position to use instead of GPS (string containing two comma-separated floats: 'lat, lon'))")
+    ap.add_argument(
+        "-r", "--replay", action="store", type=str,
+        help="Replay a recorded capture file instead of reading dump1090's json files")
+    ap.add_argument(
+        "-R", "--record", action="store", type=str,
+        help="Record all snapshots into a capture file (compressed if it ends in '.gz')")
+    ap.add_argument(
+        "-S", "--synthetic", action="store", type=int,
+        help="Generate synthetic traffic with the given number of aircraft (requires a fixed position)")
+    ap.add_argument(
+        "-x", "--speed", action="store", type=float, default=1.0,
+        help="Replay/synthetic speed: 1 is real time, N is N times real time, and 0 is as fast as possible")
     ap.add_argument(
         "-v", "--verbose", action="count", default=0, help="Print debug info")
     ap.add_argument(
-        "path", action="store", type=str,
-        help="Path to where dump1090-fa writes its json files")
+        "path", action="store", type=str, nargs="?",
+        help="Path to where dump1090-fa writes its json files (not needed with -n, -r, or -S)")
     opts = ap.parse_args()
 
     if not os.path.exists(opts.configFile):
@@ -191,6 +494,12 @@ def getOps():
         config['orientation'] = opts.orientation
     if opts.position:
         config['position'] = opts.position
+    if opts.profile:
+        config['profile'] = True
+    if opts.fullScreen:
+        config['fullScreen'] = True
+    if opts.headless:
+        config['headless'] = True
     dictMerge(opts.config, config)
     if opts.verbose:
         print("CONFIG:")
@@ -234,14 +543,73 @@ def getOps():
             sys.exit(1)
         opts.position = Point(float(position[0]), float(position[1]))
 
+    if opts.net:
+        net = opts.net.split(":")
+        if (len(net) not in (2, 3)) or (net[0] not in ("beast", "sbs", "http")):
+            logging.error(f"Invalid network source: '{opts.net}'")
+            sys.exit(1)
+        opts.net = (net[0], net[1], int(net[2]) if len(net) == 3 else None)
+
+    if opts.config['jsonParser'] not in JSON_PARSERS:
+        fatalError(f"Invalid jsonParser: {opts.config['jsonParser']} (available: {', '.join(JSON_PARSERS)})")
+
+    if opts.config['geoMode'] not in GEO_MODES:
+        fatalError(f"Invalid geoMode: {opts.config['geoMode']}")
+
+    if not (opts.path or opts.net or opts.replay or opts.synthetic or opts.aggregate):
+        logging.error("Must give a path to dump1090's json files or another source of aircraft")
+        sys.exit(1)
+
+    if opts.config['headless'] and opts.config['fullScreen']:
+        fatalError("Can't be both headless and full screen")
+
+    if opts.config['framePngEvery'] < 1:
+        fatalError(f"Invalid framePngEvery: {opts.config['framePngEvery']}")
+
+    if opts.config['sessionFlushInterval'] <= 0:
+        fatalError(f"Invalid sessionFlushInterval: {opts.config['sessionFlushInterval']}")
+
+    if opts.config['coverageSaveInterval'] <= 0:
+        fatalError(f"Invalid coverageSaveInterval: {opts.config['coverageSaveInterval']}")
+
+    if opts.config['aggregatorInterval'] < 0:
+        fatalError(f"Invalid aggregatorInterval: {opts.config['aggregatorInterval']}")
+
+    if opts.config['fps'] <= 0:
+        fatalError(f"Invalid fps: {opts.config['fps']}")
+
+    if opts.config['gpsMaxFixAge'] < 0:
+        fatalError(f"Invalid gpsMaxFixAge: {opts.config['gpsMaxFixAge']}")
+
+    if opts.config['compassRate'] < 0:
+        fatalError(f"Invalid compassRate: {opts.config['compassRate']}")
+
+    if not (0 < opts.config['compassSmoothing'] <= 1):
+        fatalError(f"Invalid compassSmoothing: {opts.config['compassSmoothing']}")
+
+    if opts.speed < 0:
+        logging.error(f"Invalid speed: '{opts.speed}'")
+        sys.exit(1)
+
     if opts.verbose:
         print(f"    Config File Path:   {opts.configFile}")
-        print(f"    JSON Files Path:    {opts.path}")
+        if opts.aggregate:
+            print(f"    Aggregating Feeds:  {opts.aggregate}")
+        elif opts.net:
+            print(f"    Network Source:     {opts.net}")
+        elif opts.replay:
+            print(f"    Replaying Capture:  {opts.replay} (x{opts.speed})")
+        elif opts.synthetic:
+            print(f"    Synthetic Traffic:  {opts.synthetic} aircraft (x{opts.speed})")
+        else:
+            print(f"    JSON Files Path:    {opts.path}")
         if opts.exceptFd:
             print(f"    Excepts Track file: {opts.exceptFd.name}")
         print(f"    Asset Files Path:   {opts.config['assetsPath']}")
         if opts.config['fullScreen']:
             print(f"    Enable Full Screen Mode")
+        if opts.config['headless']:
+            print(f"    Headless Mode")
         print(f"    Log level:          {opts.config['logLevel']}")
         if opts.config['logFile']:
             print(f"    Logging to:         {opts.config['logFile']}")
@@ -257,5 +625,5 @@ def getOps():
 
 if __name__ == '__main__':
     opts = getOps()
-    r = run(opts)
+    r = runAggregator(opts) if opts.aggregate else run(opts)
     sys.exit(r)